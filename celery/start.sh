@@ -6,4 +6,10 @@ echo Starting Celery.
 cd $PROJECT_ROOT
 cd etabotsite
 
-celery -A etabotsite worker -l info --max-tasks-per-child=1
+DEFAULT_QUEUE=${CELERY_DEFAULT_QUEUE:-etabotqueue}
+INTERACTIVE_QUEUE=${CELERY_INTERACTIVE_QUEUE:-${DEFAULT_QUEUE}_interactive}
+BATCH_QUEUE=${CELERY_BATCH_QUEUE:-${DEFAULT_QUEUE}_batch}
+
+# dedicated worker for user-triggered tasks so that they do not wait behind nightly estimations
+celery -A etabotsite worker -l info --max-tasks-per-child=1 -Q $INTERACTIVE_QUEUE -n interactive@%h &
+celery -A etabotsite worker -l info --max-tasks-per-child=1 -Q $BATCH_QUEUE,$DEFAULT_QUEUE -n batch@%h
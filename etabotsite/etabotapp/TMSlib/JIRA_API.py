@@ -8,12 +8,16 @@
     Python Version: 3.6
 """
 import threading
+import warnings
 import logging
+import re
 from datetime import datetime
 
 import etabotapp.TMSlib.Atlassian_API as Atlassian_API
+from etabotapp.TMSlib.spans import span
+from etabotapp import metrics
 from jira import JIRA
-from typing import Dict
+from typing import Dict, List
 
 from etabotapp.constants import PROJECTS_AVAILABLE
 
@@ -23,9 +27,65 @@ JIRA_CLOUD_API = Atlassian_API.ATLASSIAN_CLOUD_BASE + "ex/jira/"
 
 logger = logging.getLogger('django')
 
+JIRA_ENDPOINT_RE = re.compile(r'/rest/(api|agile)/[^/]+/([A-Za-z_]+)')
+# responses the jira ResilientSession retries
+RETRIED_STATUS_CODES = (429, 503)
+
 logger.info('JIRA_CLOUD_API: {}'.format(JIRA_CLOUD_API))
 
 
+def jira_endpoint_class(url: str) -> str:
+    """Return endpoint class of JIRA REST API url, e.g. "search", "issue", "agile/board"."""
+    match = JIRA_ENDPOINT_RE.search(url or '')
+    if match is None:
+        return 'other'
+    if match.group(1) == 'agile':
+        return 'agile/{}'.format(match.group(2))
+    return match.group(2)
+
+
+class JiraUsage:
+    """Accounting of JIRA API calls of one run per endpoint class: requests, response bytes, seconds,
+    retried responses (RETRIED_STATUS_CODES) and throttled ones (429)."""
+    FIELDS = ('requests', 'bytes', 'seconds', 'retries', 'throttled')
+
+    def __init__(self):
+        self.endpoints = {}  # type: Dict[str, List]
+        self.lock = threading.Lock()
+
+    def add(self, endpoint: str, status_code: int, response_bytes: int, seconds: float) -> None:
+        with self.lock:
+            counts = self.endpoints.setdefault(endpoint, [0, 0, 0., 0, 0])
+            counts[0] += 1
+            counts[1] += response_bytes
+            counts[2] += seconds
+            counts[3] += int(status_code in RETRIED_STATUS_CODES)
+            counts[4] += int(status_code == 429)
+
+    def add_columns(self, columns: Dict[str, List]) -> None:
+        """Add counts from to_columns output, e.g. of a previous attempt of the run."""
+        with self.lock:
+            for i, endpoint in enumerate(columns['endpoint']):
+                counts = self.endpoints.setdefault(endpoint, [0, 0, 0., 0, 0])
+                for j, field in enumerate(self.FIELDS):
+                    counts[j] += columns[field][i]
+
+    def totals(self) -> Dict:
+        with self.lock:
+            return {field: sum(counts[i] for counts in self.endpoints.values())
+                    for i, field in enumerate(self.FIELDS)}
+
+    def to_columns(self) -> Dict[str, List]:
+        """Return per endpoint counts as compact columns."""
+        with self.lock:
+            endpoints = sorted(self.endpoints.keys())
+            columns = {'endpoint': endpoints}
+            for i, field in enumerate(self.FIELDS):
+                columns[field] = [self.endpoints[endpoint][i] for endpoint in endpoints]
+            columns['seconds'] = [round(seconds, 3) for seconds in columns['seconds']]
+            return columns
+
+
 class Person:
     def __init__(
             self, *,
@@ -52,7 +112,10 @@ class JIRA_wrapper:
             username,
             password=None,
             TMSconfig: 'TMS' = None,
-            logs=None):
+            logs=None,
+            progress=None,
+            spans=None,
+            usage: JiraUsage = None):
         """Create JIRA_wrapper object for JIRA API communication.
 
         Arguments:
@@ -61,17 +124,35 @@ class JIRA_wrapper:
         username - JIRA username (not used for OAuth2.0 (password==None, token not None)
         password - JIRA password or API key (not needed if OAuth2.0 token is passed
         TMSconfig - TMS django model (not needed if password is passed)
+        progress - optional object with add_issues(fetched, total) method to report fetched issues
+        spans - optional SpanRecorder to record timing of JQL queries
+        usage - optional JiraUsage of the run to account API calls in, new one is created if not passed
         """
         self.username = username
+        self.progress = progress
+        self.spans = spans
+        self.usage = usage if usage is not None else JiraUsage()
         self.max_results_jira_api = 50
         self.TMSconfig = TMSconfig
         if logs is None:
             logs = []
         self.logs = logs
-        self.jira = self.JIRA_connect(
-            server, username, password=password)
+        with metrics.timer('etabot_jira_connect_seconds'):
+            self.jira = self.JIRA_connect(
+                server, username, password=password)
+        session = getattr(self.jira, '_session', None)
+        if session is not None:
+            session.hooks.setdefault('response', []).append(self.on_response)
         self.field_id_by_name = {field['name']: field['id'] for field in self.jira.fields()}
 
+    def on_response(self, response, *args, **kwargs):
+        """requests response hook accounting every JIRA API call."""
+        endpoint = jira_endpoint_class(response.request.url if response.request is not None else response.url)
+        metrics.inc('etabot_jira_requests_total', endpoint=endpoint, status=response.status_code)
+        metrics.observe('etabot_jira_request_seconds', response.elapsed.total_seconds(), endpoint=endpoint)
+        self.usage.add(endpoint, response.status_code, len(response.content or b''), response.elapsed.total_seconds())
+        return response
+
     def JIRA_connect(
             self,
             server,
@@ -168,6 +249,22 @@ Errors: "{}"'.format(jira, errors_place))
 
         if 'assignee' not in search_string:
             logger.warning('Searching for all assignees.')
+        with span(self.spans, 'jql') as jql_span:
+            jira_issues = self._get_jira_issues_pages(search_string, get_all, jql_span)
+
+        logger.info('{}: got {} issues'.format(search_string, len(jira_issues)))
+        return jira_issues
+
+    def count_issues(self, search_string) -> int:
+        """Return number of issues matching search_string without fetching them (maxResults=0)."""
+        with span(self.spans, 'jql_count'), warnings.catch_warnings():
+            # jira warns that json_result with maxResults=0 cannot fetch all issues which is intended here
+            warnings.simplefilter('ignore')
+            result = self.jira.search_issues(search_string, maxResults=0, fields='id', json_result=True)
+        logger.debug('{}: {} issues'.format(search_string, result.get('total')))
+        return result.get('total', 0)
+
+    def _get_jira_issues_pages(self, search_string, get_all, jql_span):
         returned_result_length = 50
         jira_issues = []
         while get_all and returned_result_length == self.max_results_jira_api:
@@ -178,6 +275,7 @@ Errors: "{}"'.format(jira, errors_place))
                     startAt=len(jira_issues),
                     expand=['changelog', 'names'])
             except Exception as e:
+                metrics.inc('etabot_jira_search_errors_total')
                 log_message = 'ERROR: jira.search_issues for search_string="{}" failed due to "{}"'.format(
                     search_string, e)
                 logger.error(log_message)
@@ -189,9 +287,12 @@ Errors: "{}"'.format(jira, errors_place))
                     than max = {}'.format(
                         returned_result_length, self.max_results_jira_api))
             returned_result_length = len(jira_issues_batch)
+            if self.progress is not None:
+                # total number of issues for the search is known from its first page
+                total = getattr(jira_issues_batch, 'total', None) if len(jira_issues) == 0 else None
+                self.progress.add_issues(returned_result_length, total)
+            jql_span.add(issues=returned_result_length, pages=1)
             jira_issues += jira_issues_batch
-
-        logger.info('{}: got {} issues'.format(search_string, len(jira_issues)))
         return jira_issues
 
     def get_team_members(self, project: str, time_frame=365) -> Dict[str, Person]:
@@ -12,6 +12,7 @@ logging.debug('loading TMSlib.TMS')
 print('loading TMSlib.TMS')
 
 import etabotapp.TMSlib.JIRA_API as JIRA_API
+from etabotapp.TMSlib.spans import span
 logging.debug('loading TMSlib.TMS: loaded JIRA_API')
 print('loading TMSlib.TMS: loaded JIRA_API')
 import sys
@@ -50,12 +51,17 @@ class ProtoTMS:
         TMS = Task Management System
         prototype for any TMS class to standardize critical methods and properties
     """
-    def __init__(self, server_end_point, username_login, task_system_schema: Dict, logs=None):
+    def __init__(
+            self, server_end_point, username_login, task_system_schema: Dict, logs=None, progress=None, spans=None,
+            usage=None):
         """
 
         :param server_end_point: TMS API. TMS url is stored in task_system_schema
         :param username_login:
         :param task_system_schema: Dict['tms_url':<user facing tms url>, ...]
+        :param progress: optional progress reporter of the running task (e.g. celery_tracking.TaskProgress)
+        :param spans: optional SpanRecorder of the running task
+        :param usage: optional JiraUsage accounting API calls of the running task
 
         # todo: refactor task_system_schema into a class
         """
@@ -63,6 +69,9 @@ class ProtoTMS:
         self.username_login = username_login
         self.task_system_schema = task_system_schema
         self.logs = logs
+        self.progress = progress
+        self.spans = spans
+        self.usage = usage
         # self.connectivity_status = None
 
     def get_projects(self):
@@ -95,7 +104,10 @@ class TMS_JIRA(ProtoTMS):
             server_end_point,
             task_system_schema,
             tms_config,
-            logs=None):
+            logs=None,
+            progress=None,
+            spans=None,
+            usage=None):
         """
 
         :param server_end_point: api end point
@@ -113,7 +125,8 @@ class TMS_JIRA(ProtoTMS):
 
         username_login = tms_config.username
         ProtoTMS.__init__(
-            self, server_end_point, username_login, task_system_schema, logs=logs)
+            self, server_end_point, username_login, task_system_schema, logs=logs, progress=progress, spans=spans,
+            usage=usage)
 
         self.jira = None
         self.tms_config = tms_config  # Django TMS object
@@ -129,12 +142,16 @@ class TMS_JIRA(ProtoTMS):
         logging.debug('connect_to_TMS started.')
         result = None
         try:
-            self.jira = JIRA_API.JIRA_wrapper(
-                self.server_end_point,
-                self.username_login,
-                password=self.tms_config.password,
-                TMSconfig=self.tms_config,
-                logs=self.logs)
+            with span(self.spans, 'connect'):
+                self.jira = JIRA_API.JIRA_wrapper(
+                    self.server_end_point,
+                    self.username_login,
+                    password=self.tms_config.password,
+                    TMSconfig=self.tms_config,
+                    logs=self.logs,
+                    progress=self.progress,
+                    spans=self.spans,
+                    usage=self.usage)
             logging.debug('connect_to_TMS jira object: {}'.format(self.jira))
             self.tms_config.connectivity_status = {
                 'status': 'connected',
@@ -178,6 +195,14 @@ cannot send connectivity issue email')
 # skipping saving connectivity status'.format(self.tms_config.owner_id))
         return result
 
+    def count_issues_updated_recently(self, project_name: str, minutes: int) -> int:
+        """Return number of issues of the project updated within the last minutes, connecting if needed."""
+        if self.jira is None:
+            error = self.connect_to_TMS(update_tms=False)
+            if error is not None:
+                raise NameError(error)
+        return self.jira.count_issues("project = '{}' AND updated >= -{}m".format(project_name, minutes))
+
     @staticmethod
     def construct_extra_filter(
             assignee: str = None,
@@ -307,7 +332,10 @@ class TMSWrapper(TMS_JIRA):
             self,
             tms_config: 'TMS',
             projects=None,
-            logs=None):
+            logs=None,
+            progress=None,
+            spans=None,
+            usage=None):
         """
         Task Management System Wrapper - generalized TMS to
         support multiple platforms (JIRA, Asana, Trello, etc)
@@ -315,6 +343,9 @@ class TMSWrapper(TMS_JIRA):
         Arguments:
             tms_config - Django model of TMS.
             projects - list of Django model projects to pre-populate open_status_values
+            progress - optional progress reporter of the running task
+            spans - optional SpanRecorder of the running task
+            usage - optional JiraUsage accounting API calls of the running task
 
         Todo:
             figure out how to subclass from ProtoTMS to
@@ -359,7 +390,10 @@ projects: {}'.format(tms_config, projects))
                 server_end_point=server,
                 tms_config=tms_config,
                 task_system_schema=task_system_schema,
-                logs=logs)
+                logs=logs,
+                progress=progress,
+                spans=spans,
+                usage=usage)
         else:
             raise NameError(
                 "TMS_type {} is not supported at this time".format(
@@ -1,12 +1,15 @@
+import datetime
+import hashlib
 import logging
 from enum import Enum
 from typing import List, Dict, Union
-import queue
-from django.template.loader import render_to_string
+from collections import deque
+from django.template.loader import get_template, render_to_string
 import pandas as pd
 import json
 
 from etabotapp.misc_utils.convertors import timestamp2unix, value2safejson, df_to_dict_for_json
+from etabotapp.misc_utils.convertors import columns_to_df, df_to_columns_for_json
 logger = logging.getLogger('django')
 
 due_alert_names_map = {
@@ -54,6 +57,46 @@ class TargetDatesStats:
             "counts": self.counts
             }
 
+    @staticmethod
+    def from_dict(stats_dict: Dict) -> 'TargetDatesStats':
+        stats = TargetDatesStats()
+        stats.summary_table = stats_dict.get('summary_table', stats.summary_table)
+        stats.tasks.update(stats_dict.get('tasks', {}))
+        stats.counts.update(stats_dict.get('counts', {}))
+        return stats
+
+    def refresh_overdue(self, now: datetime.datetime) -> int:
+        """Move tasks with due_date before now (naive UTC) to overdue. Return number of moved tasks.
+
+        summary_table is not regenerated."""
+        overdue = due_alert_display_name(DueAlert.overdue)
+        moved = 0
+        for alert_name in list(self.tasks.keys()):
+            if alert_name == overdue:
+                continue
+            remaining = []
+            for task in self.tasks[alert_name]:
+                due_date = parse_due_date(task.get('due_date')) if isinstance(task, dict) else None
+                if due_date is not None and due_date < now:
+                    self.tasks.setdefault(overdue, []).append(task)
+                    self.counts[alert_name] = self.counts.get(alert_name, 1) - 1
+                    self.counts[overdue] = self.counts.get(overdue, 0) + 1
+                    moved += 1
+                else:
+                    remaining.append(task)
+            self.tasks[alert_name] = remaining
+        return moved
+
+
+def parse_due_date(value) -> Union[datetime.datetime, None]:
+    """Return due date as naive UTC datetime or None if it is missing or not a date."""
+    if not isinstance(value, (str, datetime.date)):
+        return None
+    due_date = pd.to_datetime(value, errors='coerce', utc=True)
+    if pd.isnull(due_date):
+        return None
+    return due_date.tz_convert(None).to_pydatetime()
+
 
 class VelocityReport:
     def __init__(self, entity_uuid: Union[str, None], summary: str, df_sprint_stats: pd.DataFrame, aux: str = ''):
@@ -62,25 +105,53 @@ class VelocityReport:
         self.df_sprint_stats = df_sprint_stats  # rows - sprints, columns: scope, velocity, etc
         self.df_velocity_vs_time = pd.DataFrame()  # rows - sprints, columns - entities/measureables
         self.df_velocity_stats = pd.DataFrame()  # rows - stats (mean, std, sum), columns - entities/measureable stats
-        self.html = self.to_html()
+        self._html = None
         self.images = {}  # '{image_name: img_tag}'
         self.images_for_email = {}  # {'cid': MIMEImage}
         self.aux = aux
 
+    @staticmethod
+    def from_dict(entity_uuid: Union[str, None], report_dict: Dict) -> 'VelocityReport':
+        """Restore VelocityReport from to_dict output. Dataframes other than df_sprint_stats and
+        email images are not restored."""
+        df_sprint_stats = report_dict.get('df_sprint_stats')
+        velocity_report = VelocityReport(
+            entity_uuid, report_dict.get('summary', ''),
+            columns_to_df(df_sprint_stats) if df_sprint_stats is not None else None)
+        velocity_report.html = report_dict.get('html')
+        velocity_report.images = report_dict.get('images', {})
+        return velocity_report
+
+    @property
+    def html(self) -> str:
+        """Sprint stats table rendered on first access."""
+        if self._html is None:
+            self._html = self.to_html()
+        return self._html
+
+    @html.setter
+    def html(self, value: Union[str, None]):
+        self._html = value
+
     def to_html(self, **params) -> str:
         if self.df_sprint_stats is not None:
             return self.df_sprint_stats.rename(columns={'id': 'done_issues in sprint'}).to_html(**params)
         return 'No Velocity report html.'
 
-    def to_dict(self) -> Dict:
-        return {
+    def to_dict(self, include_html: bool = True, include_images: bool = True, include_dataframes: bool = False) -> Dict:
+        """Return JSON serializable report. With include_dataframes df_sprint_stats is encoded column by column."""
+        result = {
             'summary': self.summary,
-            # 'df_sprint_stats': df_to_dict_for_json(self.df_sprint_stats),
             # 'df_velocity_vs_time': df_to_dict_for_json(self.df_velocity_vs_time),
             # 'df_velocity_stats': df_to_dict_for_json(self.df_velocity_stats),
-            'html': self.html,
-            'images': self.images
         }
+        if include_images:
+            result['images'] = self.images
+        if include_html:
+            result['html'] = self.html
+        if include_dataframes and isinstance(self.df_sprint_stats, pd.DataFrame):
+            result['df_sprint_stats'] = df_to_columns_for_json(self.df_sprint_stats)
+        return result
 
 
 class BasicReport:
@@ -119,8 +190,29 @@ class BasicReport:
         self.params = params
         self.params_str = params_str
         self.tms_name = tms_name
-        self.html = self.render_to_html()
-        self.short_html = self.render_to_html_short()
+        # rendered on first access or by render_reports
+        self._html = None
+        self._short_html = None
+
+    @property
+    def html(self) -> str:
+        if self._html is None:
+            self._html = self.render_to_html()
+        return self._html
+
+    @html.setter
+    def html(self, value: Union[str, None]):
+        self._html = value
+
+    @property
+    def short_html(self) -> str:
+        if self._short_html is None:
+            self._short_html = self.render_to_html_short()
+        return self._short_html
+
+    @short_html.setter
+    def short_html(self, value: Union[str, None]):
+        self._short_html = value
 
     def render_to_html(self):
         return render_to_string(
@@ -132,6 +224,23 @@ class BasicReport:
             'short_report.html',
             {'basic_report': self})
 
+    @staticmethod
+    def from_dict(report_dict: Dict) -> 'BasicReport':
+        """Restore BasicReport from HierarchicalReportNode.to_dict output. Its html is rendered anew."""
+        return BasicReport(
+            project=report_dict.get('project'),
+            project_status=DueAlert(report_dict.get('project_on_track', DueAlert.unknown.value)),
+            entity_uuid=report_dict.get('entity_uuid'),
+            entity_display_name=report_dict.get('entity_display_name'),
+            entity_avatars_urls=report_dict.get('entity_avatars_urls') or {},
+            due_dates_stats=TargetDatesStats.from_dict(report_dict.get('due_dates_stats', {})),
+            sprint_stats=TargetDatesStats.from_dict(report_dict.get('sprint_stats', {})),
+            velocity_report=VelocityReport.from_dict(
+                report_dict.get('entity_uuid'), report_dict.get('velocity_report', {})),
+            params=report_dict.get('params', {}),
+            params_str=report_dict.get('params_str', ''),
+            tms_name=report_dict.get('tms_name', ''))
+
     @staticmethod
     def empty_report(project: str):
         return BasicReport(
@@ -149,6 +258,65 @@ class BasicReport:
             aux='<h2>No data available to generate report for this project.</h2>')
 
 
+_template_fingerprints = {}
+
+
+def template_fingerprint(template_name: str, template) -> str:
+    """Return hash of the template source, so that cached fragments expire when the template changes."""
+    if template_name not in _template_fingerprints:
+        source = getattr(getattr(template, 'template', None), 'source', template_name)
+        _template_fingerprints[template_name] = hashlib.sha256(source.encode('utf-8')).hexdigest()[:16]
+    return _template_fingerprints[template_name]
+
+
+def report_fragment_key(report: BasicReport, template_name: str, template_hash: str = '') -> str:
+    """Return stable hash of everything basic_report.html and short_report.html render from the report."""
+    inputs = {
+        'template': [template_name, template_hash],
+        'project': report.project,
+        'entity': [report.entity_uuid, report.entity_display_name, report.entity_avatars_urls],
+        'due_dates_stats': report.due_dates_stats.to_dict(),
+        'sprint_stats': report.sprint_stats.to_dict(),
+        'velocity': [report.velocity_report.summary, sorted(report.velocity_report.images_for_email.keys())],
+        'aux': report.aux,
+        'params': [report.params, report.params_str, report.tms_name]}
+    payload = json.dumps(inputs, sort_keys=True, default=lambda o: getattr(o, '__dict__', str(o)))
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def render_reports(reports: List[BasicReport], full: bool = True, short: bool = True, cache=None) -> None:
+    """Render html (full) and short_html (short) of reports that are not rendered yet, loading templates once.
+
+    cache - optional fragment cache with get_many(keys) -> {key: html} and set_many({key: html}) methods;
+        fragments are looked up by report_fragment_key and rendered ones are added to the cache."""
+    templates = []
+    if full:
+        templates.append(('_html', 'basic_report.html'))
+    if short:
+        templates.append(('_short_html', 'short_report.html'))
+    pending = []
+    for attribute, template_name in templates:
+        template = get_template(template_name)
+        template_hash = template_fingerprint(template_name, template)
+        for report in reports:
+            if getattr(report, attribute) is None:
+                key = report_fragment_key(report, template_name, template_hash) if cache is not None else None
+                pending.append((report, attribute, template, key))
+    cached = {}
+    if cache is not None and pending:
+        cached = cache.get_many([key for report, attribute, template, key in pending])
+    rendered = {}
+    for report, attribute, template, key in pending:
+        html = cached.get(key) if key is not None else None
+        if html is None:
+            html = template.render({'basic_report': report})
+            if key is not None:
+                rendered[key] = html
+        setattr(report, attribute, html)
+    if cache is not None and rendered:
+        cache.set_many(rendered)
+
+
 class HierarchicalReportNode:
     """Tree data structure for hierarchical report.
 
@@ -169,26 +337,45 @@ class HierarchicalReportNode:
         self.report = report
         self.children = []
         self.entity_uuid = entity_uuid
+        # True for a stored report reused for a project without updates (see change_detection.py)
+        self.reused = False
+
+    @staticmethod
+    def from_dict(report_dict: Dict) -> 'HierarchicalReportNode':
+        """Restore report tree from to_dict output. Velocity dataframes other than df_sprint_stats and aux
+        are not restored."""
+        root = None
+        stack = [(report_dict, None)]
+        while stack:
+            node_dict, parent = stack.pop()
+            node = HierarchicalReportNode(BasicReport.from_dict(node_dict), node_dict.get('entity_uuid'))
+            if parent is None:
+                root = node
+            else:
+                parent.add_child(node)
+            stack += [(child_dict, node) for child_dict in reversed(node_dict.get('children', []))]
+        return root
 
     def add_child(self, report_node: 'HierarchicalReportNode'):
         self.children.append(report_node)
         report_node.parent = self
 
     def all_nodes(self) -> List['HierarchicalReportNode']:
+        """Return nodes of the tree in breadth-first order."""
         result = []
-        q = queue.Queue()
-        q.put(self)
-        while not q.empty():
-            node = q.get()
+        nodes = deque([self])
+        while nodes:
+            node = nodes.popleft()
             result.append(node)
-            for child in node.children:
-                q.put(child)
+            nodes.extend(node.children)
         return result
 
     def all_reports(self) -> List[BasicReport]:
         return [node.report for node in self.all_nodes()]
 
-    def to_dict(self) -> Dict:
+    def node_dict(self, include_html: bool = True, include_images: bool = True,
+                  include_dataframes: bool = False) -> Dict:
+        """Return JSON serializable report of this node without its children."""
         if not isinstance(self.report, BasicReport):
             raise TypeError('report must be BasicReport type. Got {} instead.'.format(type(self.report)))
         if not isinstance(self.report.due_dates_stats, TargetDatesStats):
@@ -198,17 +385,12 @@ class HierarchicalReportNode:
         due_dates_stats = self.report.due_dates_stats.to_dict()
         sprint_stats = self.report.sprint_stats.to_dict()
         try:
-            velocity_report_dict = self.report.velocity_report.to_dict()
+            velocity_report_dict = self.report.velocity_report.to_dict(
+                include_html=include_html, include_images=include_images, include_dataframes=include_dataframes)
         except Exception as e:
             logger.warning('cannot create dict for {}'.format(self.report.velocity_report))
             velocity_report_dict = {}
-        children_list = []
-        for child in self.children:
-            try:
-                children_list.append(child.to_dict())
-            except Exception as e:
-                logger.warning('cannot create dict for {}'.format(child))
-        return {
+        result = {
             'project': self.report.project,
             'project_on_track': self.report.project_on_track.value,
             'entity_uuid': self.report.entity_uuid,
@@ -221,6 +403,53 @@ class HierarchicalReportNode:
             'params': self.report.params,
             'params_str': self.report.params_str,
             'tms_name': self.report.tms_name,
-            'html': self.report.html,
-            'children': children_list
         }
+        if include_html:
+            result['html'] = self.report.html
+        return result
+
+    def to_dict(self, include_html: bool = True, include_images: bool = True,
+                include_dataframes: bool = False) -> Dict:
+        """Return JSON serializable tree. Without include_html no templates are rendered.
+
+        Nodes that cannot be serialized are skipped with their subtrees."""
+        options = dict(include_html=include_html, include_images=include_images, include_dataframes=include_dataframes)
+        root = self.node_dict(**options)
+        root['children'] = []
+        stack = [(child, root) for child in reversed(self.children)]
+        while stack:
+            node, parent_dict = stack.pop()
+            try:
+                node_dict = node.node_dict(**options)
+            except Exception as e:
+                logger.warning('cannot create dict for {}'.format(node))
+                continue
+            node_dict['children'] = []
+            parent_dict['children'].append(node_dict)
+            stack += [(child, node_dict) for child in reversed(node.children)]
+        return root
+
+    def write_json(self, fp, include_html: bool = True, include_images: bool = True,
+                   include_dataframes: bool = False) -> None:
+        """Write the tree as JSON of to_dict format to text file-like fp node by node.
+
+        Only one node dict is held in memory at a time."""
+        options = dict(include_html=include_html, include_images=include_images, include_dataframes=include_dataframes)
+        fp.write(json.dumps(self.node_dict(**options))[:-1] + ', "children": [')
+        # frames of open nodes: [iterator over children, whether a child was written]
+        stack = [[iter(self.children), False]]
+        while stack:
+            frame = stack[-1]
+            node = next(frame[0], None)
+            if node is None:
+                fp.write(']}')
+                stack.pop()
+                continue
+            try:
+                node_json = json.dumps(node.node_dict(**options))
+            except Exception as e:
+                logger.warning('cannot create dict for {}'.format(node))
+                continue
+            fp.write((', ' if frame[1] else '') + node_json[:-1] + ', "children": [')
+            frame[1] = True
+            stack.append([iter(node.children), False])
@@ -0,0 +1,84 @@
+"""Lightweight timing spans of a pipeline run.
+
+A SpanRecorder collects nested named spans with start/end times and counters
+(e.g. issues, pages) for one run, such as an estimation of a TMS.
+Instrumented code calls span(recorder, name) which works with recorder=None as well.
+"""
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Union
+
+
+class Span:
+    """Named time interval with counters, nested in the span with parent_index."""
+    __slots__ = ('name', 'index', 'parent_index', 'start_time', 'end_time', 'counters')
+
+    def __init__(self, name: str, index: int = None, parent_index: int = None, counters: Dict = None):
+        self.name = name
+        self.index = index
+        self.parent_index = parent_index
+        self.start_time = time.time()
+        self.end_time = None
+        self.counters = counters or {}
+
+    def add(self, **counters) -> None:
+        """Increment counters, e.g. span.add(issues=50, pages=1)."""
+        for key, value in counters.items():
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    @property
+    def duration_s(self) -> Union[float, None]:
+        return None if self.end_time is None else self.end_time - self.start_time
+
+
+class SpanRecorder:
+    """Collects spans of one run in start order."""
+
+    def __init__(self):
+        self.spans = []  # type: List[Span]
+        self._open = []  # type: List[Span]
+
+    @contextmanager
+    def span(self, name: str, **counters) -> Iterator[Span]:
+        parent_index = self._open[-1].index if self._open else None
+        new_span = Span(name, index=len(self.spans), parent_index=parent_index, counters=dict(counters))
+        self.spans.append(new_span)
+        self._open.append(new_span)
+        try:
+            yield new_span
+        finally:
+            new_span.end_time = time.time()
+            self._open.remove(new_span)
+
+    def to_columns(self) -> Dict[str, List]:
+        """Return spans as compact columns with times in ms relative to the first span."""
+        t0 = self.spans[0].start_time if self.spans else 0
+        return {
+            'name': [s.name for s in self.spans],
+            'parent': [s.parent_index for s in self.spans],
+            'start_ms': [int(round((s.start_time - t0) * 1000)) for s in self.spans],
+            'duration_ms': [None if s.end_time is None else int(round(s.duration_s * 1000)) for s in self.spans],
+            'counters': [s.counters or None for s in self.spans]}
+
+    def total_s(self) -> float:
+        """Return time between start of the first span and end of the last finished one."""
+        ends = [s.end_time for s in self.spans if s.end_time is not None]
+        if not ends:
+            return 0.
+        return max(ends) - self.spans[0].start_time
+
+
+@contextmanager
+def span(recorder: Union[SpanRecorder, None], name: str, **counters) -> Iterator[Span]:
+    """Record span with recorder. With recorder=None the span is not recorded."""
+    if recorder is None:
+        yield Span(name, counters=dict(counters))
+    else:
+        with recorder.span(name, **counters) as new_span:
+            yield new_span
+
+
+def columns_to_dicts(columns: Dict[str, List]) -> List[Dict]:
+    """Return list of span dicts from SpanRecorder.to_columns output."""
+    keys = list(columns.keys())
+    return [dict(zip(keys, values)) for values in zip(*[columns[k] for k in keys])]
@@ -1,4 +1,5 @@
-from etabotapp.TMSlib.interface import HierarchicalReportNode, BasicReport
+from etabotapp.TMSlib.interface import HierarchicalReportNode, BasicReport, render_reports
+import io
 import json
 import pandas as pd
 import datetime
@@ -17,3 +18,67 @@ def test_to_dict_json_serializable():
     d2 = hn.to_dict()
     hn_json2 = json.dumps(d2, allow_nan=False)
     assert isinstance(hn_json2, str)
+
+
+def test_from_dict_refreshes_overdue():
+    report = BasicReport.empty_report('Test')
+    report.due_dates_stats.tasks['on_track'] = [
+        {'task': 'past', 'due_date': '2020-01-01'}, {'task': 'future', 'due_date': '2030-01-01'}]
+    report.due_dates_stats.counts['on_track'] = 2
+    d = json.loads(json.dumps(HierarchicalReportNode(report, 'entity').to_dict()))
+    restored = HierarchicalReportNode.from_dict(d)
+    # html is re-rendered with the tasks added after the report was created
+    assert {k: v for k, v in restored.to_dict().items() if k != 'html'} == {k: v for k, v in d.items() if k != 'html'}
+    stats = restored.report.due_dates_stats
+    assert stats.refresh_overdue(datetime.datetime(2021, 1, 1)) == 1
+    assert [t['task'] for t in stats.tasks['overdue']] == ['past']
+    assert stats.counts['on_track'] == 1 and stats.counts['overdue'] == 1
+
+
+def test_rendering_is_lazy_and_memoized():
+    report = BasicReport.empty_report('Test')
+    assert report._html is None and report._short_html is None
+    d = HierarchicalReportNode(report, 'entity').to_dict(include_html=False)
+    assert 'html' not in d and 'html' not in d['velocity_report']
+    assert report._html is None and report.velocity_report._html is None
+    render_reports([report], full=False)
+    assert report._html is None and 'Test' in report._short_html
+    report.short_html = 'custom'
+    render_reports([report])
+    assert report.short_html == 'custom' and 'Test' in report.html
+
+
+def make_tree():
+    root = HierarchicalReportNode(BasicReport.empty_report('Root'), 'root')
+    for name in ['a', 'b']:
+        child = HierarchicalReportNode(BasicReport.empty_report(name), name)
+        root.add_child(child)
+        child.add_child(HierarchicalReportNode(BasicReport.empty_report(name + '1'), name + '1'))
+    return root
+
+
+def test_all_nodes_breadth_first():
+    assert [n.entity_uuid for n in make_tree().all_nodes()] == ['root', 'a', 'b', 'a1', 'b1']
+
+
+def test_write_json_matches_to_dict():
+    root = make_tree()
+    root.children[1].report = None  # cannot be serialized, skipped with its subtree
+    for options in [{}, {'include_html': False, 'include_images': False}]:
+        f = io.StringIO()
+        root.write_json(f, **options)
+        assert json.loads(f.getvalue()) == json.loads(json.dumps(root.to_dict(**options)))
+    d = root.to_dict(include_html=False, include_images=False)
+    assert [c['project'] for c in d['children']] == ['a']
+    assert 'html' not in d and 'images' not in d['children'][0]['velocity_report']
+
+
+def test_velocity_dataframe_columnar_round_trip():
+    hn = HierarchicalReportNode(BasicReport.empty_report('Test'), 'entity')
+    hn.report.velocity_report.df_sprint_stats = pd.DataFrame(
+        {'t': [datetime.datetime(2020, 3, 15), datetime.datetime(2020, 3, 29)], 'd': [np.int64(3), np.nan]})
+    d = json.loads(json.dumps(hn.to_dict(include_html=False, include_dataframes=True), allow_nan=False))
+    assert d['velocity_report']['df_sprint_stats'] == {
+        'index': [0, 1], 'columns': {'t': ['2020-03-15T00:00:00', '2020-03-29T00:00:00'], 'd': [3.0, None]}}
+    df = HierarchicalReportNode.from_dict(d).report.velocity_report.df_sprint_stats
+    assert list(df['t']) == ['2020-03-15T00:00:00', '2020-03-29T00:00:00'] and df['d'][0] == 3
@@ -0,0 +1,14 @@
+from etabotapp.TMSlib.JIRA_API import JiraUsage, jira_endpoint_class
+
+
+def test_jira_usage_columns():
+    usage = JiraUsage()
+    usage.add(jira_endpoint_class('https://x.atlassian.net/rest/api/2/search?jql=a'), 200, 1000, 0.5)
+    usage.add('search', 503, 0, 0.25)
+    usage.add('issue', 429, 20, 0.1)
+    assert usage.totals() == {'requests': 3, 'bytes': 1020, 'seconds': 0.85, 'retries': 2, 'throttled': 1}
+    columns = usage.to_columns()
+    assert columns['endpoint'] == ['issue', 'search']
+    assert columns['requests'] == [1, 2]
+    usage.add_columns(columns)
+    assert usage.totals()['requests'] == 6
@@ -0,0 +1,24 @@
+from etabotapp.TMSlib.spans import SpanRecorder, span, columns_to_dicts
+
+
+def test_nested_spans_with_counters():
+    recorder = SpanRecorder()
+    with recorder.span('estimate') as root:
+        with span(recorder, 'jql') as jql_span:
+            jql_span.add(issues=50, pages=1)
+            jql_span.add(issues=20, pages=1)
+        with span(recorder, 'email'):
+            pass
+    assert root.end_time is not None
+    spans = columns_to_dicts(recorder.to_columns())
+    assert [s['name'] for s in spans] == ['estimate', 'jql', 'email']
+    assert [s['parent'] for s in spans] == [None, 0, 0]
+    assert spans[1]['counters'] == {'issues': 70, 'pages': 2}
+    assert all(s['duration_ms'] >= 0 for s in spans)
+    assert recorder.total_s() >= 0
+
+
+def test_span_without_recorder():
+    with span(None, 'jql') as jql_span:
+        jql_span.add(issues=1)
+    assert jql_span.counters == {'issues': 1}
@@ -1,7 +1,22 @@
-from .models import Project, TMS, CeleryTask
+from .models import Project, TMS, CeleryTask, CeleryTaskDailyStats, JiraApiUsage, TaskLease, TaskProfile, TaskSpans,\
+    WaitingTask
+from etabotapp.TMSlib.spans import SpanRecorder, columns_to_dicts
+from etabotapp.TMSlib.JIRA_API import JiraUsage
+from etabotapp import metrics
+from etabotapp.query_stats import tracked_queries
+from django.contrib.auth.models import User
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, DurationField, ExpressionWrapper, F, Max, Min, Q, Sum
+from django.db.models.functions import TruncDate
 from kombu.utils.uuid import uuid
+from contextlib import contextmanager
+from typing import Dict, List, Union
 import datetime
 import functools
+import hashlib
+import json
+import time
 import traceback
 import logging
 import celery as clry
@@ -10,8 +25,57 @@ celery.config_from_object('django.conf:settings')
 
 logger = logging.getLogger('django')
 
+CUSTOM_SETTINGS = getattr(settings, 'CUSTOM_SETTINGS', {})
+# pending tasks older than this are considered lost and are not coalesced with
+COALESCE_WINDOW_S = CUSTOM_SETTINGS.get('coalesce_window_s', 3 * 3600)
+TMS_LEASE_TTL_S = CUSTOM_SETTINGS.get('tms_lease_ttl_s', 3 * 3600)
+TMS_LEASE_RETRY_COUNTDOWN_S = CUSTOM_SETTINGS.get('tms_lease_retry_countdown_s', 60)
+# maximum number of pending or running tracked tasks per owner, None for unlimited.
+# Tasks above the quota wait in WaitingTask and are sent once the owner's tasks finish.
+TENANT_CONCURRENCY_QUOTA = CUSTOM_SETTINGS.get('tenant_concurrency_quota', 4)
+# username -> weight, the quota of an owner is scaled by its weight
+TENANT_WEIGHTS = CUSTOM_SETTINGS.get('tenant_weights', {})
+INTERACTIVE_QUEUE = getattr(settings, 'CELERY_INTERACTIVE_QUEUE', None)
+# progress of a running task is written to its CeleryTask row at most once per this interval
+PROGRESS_MIN_INTERVAL_S = CUSTOM_SETTINGS.get('progress_min_interval_s', 5)
+# long-poll of task statuses is held at most this long and checks the tracking rows at this interval
+STATUS_LONG_POLL_MAX_WAIT_S = CUSTOM_SETTINGS.get('status_long_poll_max_wait_s', 25)
+STATUS_LONG_POLL_INTERVAL_S = CUSTOM_SETTINGS.get('status_long_poll_interval_s', 1)
+# CeleryTask rows older than this are compacted into CeleryTaskDailyStats and deleted
+CELERY_TASK_RETENTION_DAYS = CUSTOM_SETTINGS.get('celery_task_retention_days', 30)
+# results with longer JSON are not stored in CeleryTask.result
+TASK_RESULT_MAX_CHARS = CUSTOM_SETTINGS.get('task_result_max_chars', 10000)
+# CeleryTask status -> celery state reported by status endpoints
+CELERY_STATES = {
+    'PN': 'PENDING',
+    'WT': 'PENDING',
+    'DN': 'SUCCESS',
+    'FL': 'FAILURE',
+    'CN': 'REVOKED',
+    'X': 'PENDING'}
+BATCH_QUEUE = getattr(settings, 'CELERY_BATCH_QUEUE', None)
 
-def celery_task_record_creator(name, owner):
+
+class LeaseNotAcquired(Exception):
+    """Raised when a lease is held by another task."""
+
+
+def task_dedup_key(name, args) -> str:
+    """Return fingerprint of celery task name and positional arguments."""
+    payload = json.dumps([name, args], sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def find_equivalent_pending_task_id(dedup_key):
+    """Return task_id of a recent pending task with the same dedup_key or None."""
+    not_before = datetime.datetime.now() - datetime.timedelta(seconds=COALESCE_WINDOW_S)
+    return CeleryTask.objects.filter(
+        dedup_key=dedup_key,
+        status__in=['PN', 'WT'],
+        start_time__gte=not_before).order_by('-start_time').values_list('task_id', flat=True).first()
+
+
+def celery_task_record_creator(name, owner, dedup_key=None, meta_data=None, queue=None, status='PN'):
     unique_task_id = uuid()
     logger.info('celery_task_record_creator started for "{}" with owner "{}"'.format(name, owner))
     celery_task_record = CeleryTask.objects.create(
@@ -19,37 +83,442 @@ def celery_task_record_creator(name, owner):
         task_name=name,
         start_time=datetime.datetime.now(),
         end_time=None,
-        status='PN',
+        status=status,
         owner=owner,
-        meta_data=None
+        meta_data=meta_data,
+        dedup_key=dedup_key,
+        queue=queue
     )
     logger.info('celery_task_record_creator finished for "{}" with owner "{}"'.format(name, owner))
     return celery_task_record
 
 
-def send_celery_task_with_tracking(name, args, owner=None, **kwargs):
+def send_celery_task_with_tracking(name, args, owner=None, coalesce=False, meta_data=None, queue=None, **kwargs):
     """Create a record for tracking celery task and submit the celery task.
     :param owner:
+    :param coalesce: if True and an equivalent task (same name and args) is pending or running,
+        return its result instead of submitting a new task.
+    :param meta_data: initial meta_data of the tracking record (e.g. {'tms_id': 1})
+    :param queue: celery queue, e.g. INTERACTIVE_QUEUE or BATCH_QUEUE. Default is routed by task name.
     :args: tuple of positional arguments to ass to celery.send_task"""
     logger.info('send_celery_task_with_tracking started with owner "{}".'.format(owner))
-    celery_task_record = celery_task_record_creator(name=name, owner=owner)
-    kwargs['task_id'] = celery_task_record.task_id
+    dedup_key = None
+    if coalesce:
+        dedup_key = task_dedup_key(name, args)
+        existing_task_id = find_equivalent_pending_task_id(dedup_key)
+        if existing_task_id is not None:
+            logger.info('coalescing "{}" with pending celery task {}'.format(name, existing_task_id))
+            return celery.AsyncResult(existing_task_id)
+    if not TENANT_CONCURRENCY_QUOTA:
+        admitted = True
+        celery_task_record = celery_task_record_creator(
+            name=name, owner=owner, dedup_key=dedup_key, meta_data=meta_data, queue=queue)
+        kwargs['task_id'] = celery_task_record.task_id
+    else:
+        with transaction.atomic():
+            lock_owner(owner.pk)
+            admitted = owner_in_flight_count(owner.pk) < tenant_quota(owner)
+            celery_task_record = celery_task_record_creator(
+                name=name, owner=owner, dedup_key=dedup_key, meta_data=meta_data, queue=queue,
+                status='PN' if admitted else 'WT')
+            kwargs['task_id'] = celery_task_record.task_id
+            if not admitted:
+                WaitingTask.objects.create(
+                    task_id=celery_task_record.task_id,
+                    task_name=name,
+                    owner=owner,
+                    args=list(args),
+                    kwargs=kwargs,
+                    queue=queue,
+                    enqueued_at=celery_task_record.start_time)
+    metrics.inc('etabot_celery_tasks_sent_total', task=name.split('.')[-1], admitted=admitted)
+    if not admitted:
+        logger.info('owner "{}" is at concurrency quota, celery task {} "{}" is waiting'.format(
+            owner, celery_task_record.task_id, name))
+        return celery.AsyncResult(celery_task_record.task_id)
     logger.debug('sending celery task {}, {}, {}, {}'.format(name, args, kwargs, celery_task_record.task_id))
-    result = celery.send_task(name, args=args, kwargs=kwargs, task_id=celery_task_record.task_id)
+    result = celery.send_task(name, args=args, kwargs=kwargs, task_id=celery_task_record.task_id, queue=queue)
     return result
 
 
+def tenant_quota(owner) -> int:
+    """Return maximum number of in-flight tasks for the owner."""
+    weight = TENANT_WEIGHTS.get(owner.username, 1)
+    return max(1, int(round(TENANT_CONCURRENCY_QUOTA * weight)))
+
+
+def lock_owner(owner_id):
+    """Serialize quota decisions for the owner until the end of the current transaction."""
+    User.objects.select_for_update().filter(pk=owner_id).first()
+
+
+def owner_in_flight_count(owner_id) -> int:
+    """Return number of recent pending or running tracked tasks of the owner."""
+    not_before = datetime.datetime.now() - datetime.timedelta(seconds=COALESCE_WINDOW_S)
+    return CeleryTask.objects.filter(owner_id=owner_id, status='PN', start_time__gte=not_before).count()
+
+
+def dispatch_waiting_tasks(owner_ids=None) -> int:
+    """Send waiting tasks of owners within their quota, oldest first. Return number of sent tasks.
+
+    Owners with the lowest load relative to their weight are served first."""
+    waiting_tasks = WaitingTask.objects.all()
+    if owner_ids is not None:
+        waiting_tasks = waiting_tasks.filter(owner_id__in=owner_ids)
+    owners = list(User.objects.filter(pk__in=waiting_tasks.values('owner_id')))
+    owners.sort(key=lambda o: owner_in_flight_count(o.pk) / float(TENANT_WEIGHTS.get(o.username, 1)))
+    dispatched = 0
+    for owner in owners:
+        with transaction.atomic():
+            lock_owner(owner.pk)
+            capacity = tenant_quota(owner) - owner_in_flight_count(owner.pk)
+            if capacity <= 0:
+                continue
+            entries = list(WaitingTask.objects.filter(owner_id=owner.pk).order_by('enqueued_at')[:capacity])
+            task_ids = [entry.task_id for entry in entries]
+            # start_time is reset so that the in-flight window counts from the dispatch
+            CeleryTask.objects.filter(pk__in=task_ids, status='WT').update(
+                status='PN', start_time=datetime.datetime.now())
+            WaitingTask.objects.filter(pk__in=task_ids).delete()
+        for entry in entries:
+            logger.info('sending waiting celery task {} "{}" of owner "{}"'.format(
+                entry.task_id, entry.task_name, owner))
+            celery.send_task(
+                entry.task_name, args=entry.args, kwargs=entry.kwargs, task_id=entry.task_id, queue=entry.queue)
+        dispatched += len(entries)
+    return dispatched
+
+
+def tracked_signature(name, args, owner=None, queue=None, **kwargs):
+    """Create a record for tracking celery task and return its signature for canvas primitives (chord, group)."""
+    celery_task_record = celery_task_record_creator(name=name, owner=owner, queue=queue)
+    kwargs['task_id'] = celery_task_record.task_id
+    options = {'queue': queue} if queue is not None else {}
+    # chords collect header results from the result backend even when results are ignored otherwise
+    return celery.signature(
+        name, args=args, kwargs=kwargs, task_id=celery_task_record.task_id, ignore_result=False, **options)
+
+
+def send_celery_chord_with_tracking(header, callback, owner=None, queue=None):
+    """Submit tracked header tasks followed by a tracked callback receiving the list of their results.
+
+    :param header: list of (name, args, kwargs) tuples for tasks to run in parallel
+    :param callback: (name, args, kwargs) tuple. Header results are prepended to args.
+    :return: AsyncResult of the callback"""
+    logger.info('send_celery_chord_with_tracking started with owner "{}", {} header tasks.'.format(
+        owner, len(header)))
+    header_signatures = [
+        tracked_signature(name, args, owner=owner, queue=queue, **kwargs) for name, args, kwargs in header]
+    callback_name, callback_args, callback_kwargs = callback
+    callback_signature = tracked_signature(
+        callback_name, callback_args, owner=owner, queue=queue, **callback_kwargs)
+    return clry.chord(header_signatures)(callback_signature)
+
+
+class TaskProgress:
+    """Structured progress of a tracked task stored in CeleryTask.meta_data['progress'].
+
+    Counters are written with a single UPDATE at most once per min_interval_s, stage changes are written
+    immediately. Elapsed time and ETA are derived from projects done or, before that, issues fetched."""
+
+    def __init__(self, task_id, min_interval_s: float = PROGRESS_MIN_INTERVAL_S):
+        self.task_id = task_id
+        self.min_interval_s = min_interval_s
+        self.start_time = time.time()
+        self.last_write_time = None
+        self.meta_data = None
+        self.state = {
+            'stage': None,
+            'issues_fetched': 0,
+            'issues_total': None,
+            'projects_done': 0,
+            'projects_total': None}
+
+    def stage(self, name: str, **counters) -> None:
+        self.update(force=True, stage=name, **counters)
+
+    def add_issues(self, fetched: int, total: int = None) -> None:
+        self.state['issues_fetched'] += fetched
+        if total is not None:
+            self.state['issues_total'] = (self.state['issues_total'] or 0) + total
+        self.update()
+
+    def project_done(self) -> None:
+        self.update(projects_done=self.state['projects_done'] + 1)
+
+    def done_fraction(self) -> Union[float, None]:
+        if self.state['projects_total'] and self.state['projects_done']:
+            return min(1., self.state['projects_done'] / self.state['projects_total'])
+        if self.state['issues_total'] and self.state['issues_fetched']:
+            # fetching issues is roughly the first half of an estimation
+            return min(1., self.state['issues_fetched'] / self.state['issues_total']) / 2
+        return None
+
+    def update(self, force: bool = False, **counters) -> bool:
+        """Update counters and write them if forced or throttling interval passed. Return True if written."""
+        self.state.update(counters)
+        now = time.time()
+        if not force and self.last_write_time is not None and now - self.last_write_time < self.min_interval_s:
+            return False
+        self.last_write_time = now
+        elapsed_s = now - self.start_time
+        fraction = self.done_fraction()
+        progress = dict(self.state)
+        progress['elapsed_s'] = round(elapsed_s, 1)
+        progress['eta_s'] = round(elapsed_s * (1 - fraction) / fraction, 1) if fraction else None
+        progress['updated_at'] = datetime.datetime.utcnow().isoformat()
+        if self.meta_data is None:
+            self.meta_data = CeleryTask.objects.filter(pk=self.task_id).values_list(
+                'meta_data', flat=True).first() or {}
+        self.meta_data['progress'] = progress
+        CeleryTask.objects.filter(pk=self.task_id).update(meta_data=self.meta_data)
+        return True
+
+
+def save_task_spans(task_id, recorder: SpanRecorder, parent_task_id=None) -> None:
+    """Store spans of the run of task_id replacing spans of its previous attempt."""
+    TaskSpans.objects.update_or_create(
+        task_id=task_id,
+        defaults={
+            'parent_task_id': parent_task_id,
+            'created': datetime.datetime.now(),
+            'total_s': recorder.total_s(),
+            'spans': recorder.to_columns()})
+
+
+@contextmanager
+def recorded_spans(task_id, name: str, parent_task_id=None):
+    """Yield SpanRecorder with an open root span name. Spans are saved for task_id on exit, also on failure."""
+    recorder = SpanRecorder()
+    try:
+        with recorder.span(name):
+            yield recorder
+    finally:
+        if task_id is not None:
+            try:
+                save_task_spans(task_id, recorder, parent_task_id=parent_task_id)
+            except Exception as e:
+                logger.error('cannot save spans of celery task {} due to "{}"'.format(task_id, e))
+
+
+def get_task_spans(task_id) -> Dict[str, Dict]:
+    """Return spans of task_id and of tasks started by it (parent_task_id) by task_id."""
+    records = TaskSpans.objects.filter(Q(pk=task_id) | Q(parent_task_id=task_id)).order_by('created')
+    return {
+        record.task_id: {
+            'parent_task_id': record.parent_task_id,
+            'created': record.created,
+            'total_s': record.total_s,
+            'spans': columns_to_dicts(record.spans)}
+        for record in records}
+
+
+def save_jira_usage(task_id, tms: TMS, usage: JiraUsage) -> None:
+    """Store JIRA API usage of the run of task_id for tms adding up usage of its previous attempts."""
+    previous = JiraApiUsage.objects.filter(pk=task_id).values_list('endpoints', flat=True).first()
+    if previous:
+        usage.add_columns(previous)
+    JiraApiUsage.objects.update_or_create(
+        task_id=task_id,
+        defaults=dict(
+            owner_id=tms.owner_id,
+            tms_id=tms.id,
+            created=datetime.datetime.now(),
+            endpoints=usage.to_columns(),
+            **usage.totals()))
+
+
+@contextmanager
+def recorded_jira_usage(task_id, tms: TMS):
+    """Yield JiraUsage of the run saved for task_id on exit, also on failure."""
+    usage = JiraUsage()
+    try:
+        yield usage
+    finally:
+        if task_id is not None and usage.endpoints:
+            try:
+                save_jira_usage(task_id, tms, usage)
+            except Exception as e:
+                logger.error('cannot save JIRA API usage of celery task {} due to "{}"'.format(task_id, e))
+
+
+def jira_usage_by_tenant(owner=None, days: float = 30, now: datetime.datetime = None) -> List[Dict]:
+    """Return JIRA API usage totals per owner and TMS over the last days, most requests first."""
+    if now is None:
+        now = datetime.datetime.now()
+    usage = JiraApiUsage.objects.filter(created__gte=now - datetime.timedelta(days=days))
+    if owner is not None:
+        usage = usage.filter(owner=owner)
+    return list(usage.values('owner_id', 'owner__username', 'tms_id', 'tms__endpoint').annotate(
+        runs=Count('task_id'),
+        requests=Sum('requests'),
+        bytes=Sum('bytes'),
+        seconds=Sum('seconds'),
+        retries=Sum('retries'),
+        throttled=Sum('throttled'),
+        last_run=Max('created')).order_by('-requests'))
+
+
+def task_progress(task_id) -> Union[TaskProgress, None]:
+    """Return TaskProgress for a tracked task or None if task_id is None."""
+    return TaskProgress(task_id) if task_id is not None else None
+
+
+TASK_STATUS_FIELDS = ('task_id', 'status', 'start_time', 'end_time', 'meta_data', 'error', 'result')
+
+
+def task_status_dict(task_id, row: Union[Dict, None]) -> Dict:
+    """Return status of a tracked task from its CeleryTask values (TASK_STATUS_FIELDS).
+
+    Keeps the {<task_id>: <celery state>, <task_id>_result: <str>} format of CeleryTaskStatusView."""
+    if row is None:
+        return {task_id: 'UNKNOWN', '{}_result'.format(task_id): 'unknown task id'}
+    meta_data = row['meta_data'] or {}
+    error = row['error'] or meta_data.get('error_str')
+    return {
+        task_id: CELERY_STATES.get(row['status'], 'PENDING'),
+        '{}_result'.format(task_id): error or str(row['result']),
+        'status': row['status'],
+        'start_time': row['start_time'],
+        'end_time': row['end_time'],
+        'progress': meta_data.get('progress')}
+
+
+def task_status_rows(task_ids, owner=None) -> Dict[str, Dict]:
+    """Return CeleryTask values of task_ids (optionally of the owner only) by task_id in one query."""
+    records = CeleryTask.objects.filter(pk__in=task_ids)
+    if owner is not None:
+        records = records.filter(owner=owner)
+    rows = records.values(*TASK_STATUS_FIELDS)
+    return {row['task_id']: row for row in rows}
+
+
+def wait_for_task_statuses(task_ids, owner=None, wait_s: float = 0,
+                           interval_s: float = STATUS_LONG_POLL_INTERVAL_S) -> Dict[str, Dict]:
+    """Return statuses of task_ids as soon as any of them is finished or wait_s passed (long-poll)."""
+    deadline = time.time() + min(wait_s, STATUS_LONG_POLL_MAX_WAIT_S)
+    while True:
+        rows = task_status_rows(task_ids, owner=owner)
+        finished = any(row['status'] not in ('PN', 'WT') for row in rows.values())
+        if finished or len(rows) == 0 or time.time() + interval_s > deadline:
+            break
+        time.sleep(interval_s)
+    return {task_id: task_status_dict(task_id, rows.get(task_id)) for task_id in task_ids}
+
+
+def compact_celery_tasks(retention_days: float = CELERY_TASK_RETENTION_DAYS, now: datetime.datetime = None) -> int:
+    """Aggregate finished CeleryTask rows started before the retention window into daily stats and delete them.
+
+    The window starts at midnight so that each day is compacted at once. Pending and waiting rows are kept,
+    WaitingTask rows refer to them. Return number of deleted rows."""
+    if now is None:
+        now = datetime.datetime.now()
+    cutoff = (now - datetime.timedelta(days=retention_days)).replace(hour=0, minute=0, second=0, microsecond=0)
+    expired = CeleryTask.objects.filter(start_time__lt=cutoff).exclude(status__in=['PN', 'WT'])
+    duration = ExpressionWrapper(F('end_time') - F('start_time'), output_field=DurationField())
+    with transaction.atomic():
+        rows = expired.annotate(date=TruncDate('start_time')).values(
+            'date', 'task_name', 'owner_id', 'status').annotate(
+            count=Count('task_id'),
+            finished_count=Count('end_time'),
+            total_duration=Sum(duration),
+            max_duration=Max(duration)).order_by()
+        for row in rows:
+            stats, _ = CeleryTaskDailyStats.objects.select_for_update().get_or_create(
+                date=row['date'], task_name=row['task_name'], owner_id=row['owner_id'], status=row['status'])
+            stats.count += row['count']
+            stats.finished_count += row['finished_count']
+            if row['total_duration'] is not None:
+                stats.total_duration_s += row['total_duration'].total_seconds()
+                stats.max_duration_s = max(stats.max_duration_s, row['max_duration'].total_seconds())
+            stats.save()
+        deleted, _ = expired.delete()
+        TaskSpans.objects.filter(created__lt=cutoff).delete()
+        JiraApiUsage.objects.filter(created__lt=cutoff).delete()
+        TaskProfile.objects.filter(created__lt=cutoff).delete()
+    logger.info('compacted {} celery task records started before {}'.format(deleted, cutoff))
+    return deleted
+
+
+def get_task_queue(task_id):
+    """Return queue recorded for a tracked task or None."""
+    return CeleryTask.objects.filter(pk=task_id).values_list('queue', flat=True).first()
+
+
+def queue_depths():
+    """Return number of pending and waiting tracked tasks and start time of the oldest one per queue."""
+    rows = CeleryTask.objects.filter(status__in=['PN', 'WT']).values('queue').annotate(
+        pending=Count('task_id', filter=Q(status='PN')),
+        waiting=Count('task_id', filter=Q(status='WT')),
+        oldest_start_time=Min('start_time')).order_by('queue')
+    return {
+        row['queue'] or 'default': {
+            'pending': row['pending'],
+            'waiting': row['waiting'],
+            'oldest_start_time': row['oldest_start_time']}
+        for row in rows}
+
+
+def small_json_result(result):
+    """Return JSON compatible copy of result if it is short enough to store in CeleryTask.result, else None."""
+    if result is None:
+        return None
+    try:
+        result_json = json.dumps(result, default=str)
+    except (TypeError, ValueError) as e:
+        logger.debug('task result is not stored: {}'.format(e))
+        return None
+    if len(result_json) > TASK_RESULT_MAX_CHARS:
+        logger.debug('task result of {} chars is not stored'.format(len(result_json)))
+        return None
+    return json.loads(result_json)
+
+
+class Delegated:
+    """Result of a tracked task whose work is finished by another task, e.g. a chord callback.
+
+    The task stays pending until that task calls finish_celery_task for it."""
+
+    def __init__(self, result):
+        self.result = result
+
+
+def finish_celery_task(task_id, status: str, error: str = None, result=None) -> None:
+    """Record end of the tracked task and send waiting tasks of its owner."""
+    updated = CeleryTask.objects.filter(pk=task_id).update(
+        end_time=datetime.datetime.now(),
+        status=status,
+        error=error or None,
+        result=small_json_result(result))
+    if updated == 1:
+        logger.info('updated celery task_id={} with status={}'.format(task_id, status))
+        try:
+            dispatch_waiting_tasks(owner_ids=CeleryTask.objects.filter(pk=task_id).values('owner_id'))
+        except Exception as e:
+            logger.error('cannot dispatch waiting tasks due to "{}"'.format(e))
+    else:
+        logger.error('not unique celery_task_record found, updated {}'.format(updated))
+
+
 def celery_task_update(func):
     """Decorator for:
-    Updating a job in the database (as CeleryTask) """
+    Updating a job in the database (as CeleryTask).
+    A task returning Delegated is kept pending and returns the delegated result."""
     @functools.wraps(func)
     def inner(*args, **kwargs):
         error_str = ''
+        start_time = time.time()
         try:
             logger.debug('celery_task_update decorator is starting celery function. ')
-            result = func(*args, **kwargs)
+            with tracked_queries('task', func.__name__):
+                result = func(*args, **kwargs)
             result_status = 'DN'
             logger.info('Celery task function executed.')
+        except clry.exceptions.Retry:
+            logger.info('Celery task is scheduled for retry, keeping it pending.')
+            metrics.inc('etabot_celery_task_retries_total', task=func.__name__)
+            metrics.flush()
+            raise
         except Exception as e:
             traceback_str = str(traceback.format_exc())
             logger.error('Celery task failed due to "{}"'.format(e))
@@ -59,25 +528,57 @@ def celery_task_update(func):
             result = None
 
         # End timer
+        metrics.observe('etabot_celery_task_seconds', time.time() - start_time,
+                        task=func.__name__, status=result_status)
         task_id = kwargs.get("task_id")
-        if task_id is not None:
-            celery_task_records = CeleryTask.objects.all().filter(pk=task_id)
-            if len(celery_task_records) == 1:
-                celery_task_record = celery_task_records[0]
-                celery_task_record.end_time = datetime.datetime.now()
-                celery_task_record.status = result_status
-                meta_data = celery_task_record.meta_data
-                if meta_data is None:
-                    meta_data = {}
-                meta_data['error_str'] = error_str
-                celery_task_record.meta_data = meta_data
-                celery_task_record.save()
-                logger.info('updated celery task_id={} with status={}'.format(task_id, result_status))
-            else:
-                logger.error('not unique celery_task_record found, length={}'.format(len(celery_task_records)))
+        if isinstance(result, Delegated):
+            logger.info('celery task_id={} is finished by another task'.format(task_id))
+            result = result.result
+        elif task_id is not None:
+            finish_celery_task(task_id, result_status, error=error_str, result=result)
         else:
             logger.warning('no celery task id passed for tracking.')
+        # workers push metrics after each task for the metrics endpoint of the web app
+        metrics.flush()
         return result
 
     return inner
 
+
+def acquire_lease(key, task_id, ttl_s=TMS_LEASE_TTL_S) -> bool:
+    """Acquire lease on key for task_id. Return True if the lease is held by task_id."""
+    now = datetime.datetime.now()
+    with transaction.atomic():
+        TaskLease.objects.filter(key=key, expires_at__lt=now).delete()
+        lease, created = TaskLease.objects.get_or_create(
+            key=key,
+            defaults={
+                'task_id': task_id,
+                'expires_at': now + datetime.timedelta(seconds=ttl_s)})
+    return created or lease.task_id == task_id
+
+
+def release_lease(key, task_id) -> None:
+    TaskLease.objects.filter(key=key, task_id=task_id).delete()
+
+
+def tms_lease_key(tms_id) -> str:
+    return 'tms_{}'.format(tms_id)
+
+
+@contextmanager
+def tms_lease(tms_id, task_id, ttl_s=TMS_LEASE_TTL_S):
+    """Context manager keeping tasks for the same TMS from overlapping.
+
+    Raises LeaseNotAcquired if another task holds the lease."""
+    if task_id is None:
+        task_id = uuid()
+    key = tms_lease_key(tms_id)
+    if not acquire_lease(key, task_id, ttl_s=ttl_s):
+        raise LeaseNotAcquired('TMS id {} is leased by another task'.format(tms_id))
+    logger.info('acquired lease {} for task_id={}'.format(key, task_id))
+    try:
+        yield
+    finally:
+        release_lease(key, task_id)
+        logger.info('released lease {} for task_id={}'.format(key, task_id))
@@ -0,0 +1,87 @@
+"""Detection of projects unchanged since their last report.
+
+Before a scheduled estimation, each project with a stored report is checked with a
+count-only JQL query for issues updated since its report_date. Unchanged projects
+skip fetching, prediction and report generation: their stored hierarchical report
+is reused with due date alerts refreshed (tasks past due become overdue).
+Interactive estimations always recompute all projects.
+"""
+import datetime
+import logging
+import math
+from typing import Dict, List, Tuple, Union
+
+from django.conf import settings
+
+from etabotapp.TMSlib.interface import HierarchicalReportNode, TargetDatesStats
+from etabotapp.report_store import stored_hierarchical_report
+
+logger = logging.getLogger('django')
+
+CUSTOM_SETTINGS = getattr(settings, 'CUSTOM_SETTINGS', {})
+SKIP_UNCHANGED_PROJECTS = CUSTOM_SETTINGS.get('skip_unchanged_projects', True)
+# the updated window is extended by this margin to cover updates during the previous run
+CHANGE_DETECTION_MARGIN_MIN = CUSTOM_SETTINGS.get('change_detection_margin_min', 15)
+# projects are recomputed at least this often even without updates, e.g. for velocities of a new sprint
+MAX_REPORT_AGE_DAYS = CUSTOM_SETTINGS.get('max_report_age_days', 7)
+
+
+def report_datetime(project) -> Union[datetime.datetime, None]:
+    """Return UTC time of the stored report of the project or None if there is no usable report."""
+    project_settings = project.project_settings or {}
+    if project.latest_report_id is None:
+        return None
+    try:
+        return datetime.datetime.fromisoformat(project_settings.get('report_date'))
+    except (TypeError, ValueError):
+        return None
+
+
+def minutes_since(report_date: datetime.datetime, now: datetime.datetime) -> int:
+    return int(math.ceil((now - report_date).total_seconds() / 60.)) + CHANGE_DETECTION_MARGIN_MIN
+
+
+def cached_report(report_dict: Dict, now: datetime.datetime) -> HierarchicalReportNode:
+    """Return hierarchical report from its stored dict with tasks past due moved to overdue.
+
+    The report keeps the report_date of its project, so the project is recomputed after MAX_REPORT_AGE_DAYS.
+    Email images are not stored, so the email report of a reused report has no velocity charts."""
+    nodes = [report_dict]
+    while nodes:
+        node = nodes.pop()
+        due_dates_stats = TargetDatesStats.from_dict(node.get('due_dates_stats', {}))
+        if due_dates_stats.refresh_overdue(now) > 0:
+            node['due_dates_stats'] = due_dates_stats.to_dict()
+        nodes += node.get('children', [])
+    report = HierarchicalReportNode.from_dict(report_dict)
+    report.reused = True
+    return report
+
+
+def split_unchanged_projects(
+        tms_wrapper, projects_set, logs: List, now: datetime.datetime = None) -> Tuple[List, Dict]:
+    """Return (projects to estimate, {project name: cached report of unchanged project})."""
+    if now is None:
+        now = datetime.datetime.utcnow()
+    changed = []
+    cached_reports = {}
+    for project in projects_set:
+        report_date = report_datetime(project)
+        if report_date is None or now - report_date > datetime.timedelta(days=MAX_REPORT_AGE_DAYS):
+            changed.append(project)
+            continue
+        try:
+            updated_count = tms_wrapper.count_issues_updated_recently(project.name, minutes_since(report_date, now))
+        except Exception as e:
+            logger.warning('cannot check updates of project {} due to "{}"'.format(project, e))
+            changed.append(project)
+            continue
+        report_dict = stored_hierarchical_report(project) if updated_count == 0 else None
+        if report_dict is None:
+            changed.append(project)
+        else:
+            cached_reports[project.name] = cached_report(report_dict, now)
+    message = 'unchanged projects since last report: {}'.format(', '.join(cached_reports.keys()) or 'none')
+    logger.info(message)
+    logs.append((now, message))
+    return changed, cached_reports
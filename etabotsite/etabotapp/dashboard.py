@@ -0,0 +1,57 @@
+"""Dashboard bootstrap data of a user in one response.
+
+TMS connectivity, projects and headlines of their latest reports are read with two queries
+and kept in DashboardCache until a change of the user's TMSs, projects or reports
+(i.e. an edit or an estimation run) invalidates it.
+"""
+import datetime
+import logging
+from typing import Dict
+
+from .models import DashboardCache, Project, TMS
+
+logger = logging.getLogger('django')
+
+
+def build_dashboard(user) -> Dict:
+    tmss = []
+    for tms in TMS.objects.filter(owner=user).order_by('id').values(
+            'id', 'name', 'endpoint', 'type', 'connectivity_status'):
+        connectivity_status = tms.pop('connectivity_status') or {}
+        tms['status'] = connectivity_status.get('status')
+        tms['status_description'] = connectivity_status.get('description')
+        tmss.append(tms)
+    projects = []
+    for project in Project.objects.filter(owner=user).order_by('id').values(
+            'id', 'name', 'project_tms_id', 'project_settings__report_date', 'latest_report__version',
+            'latest_report__created', 'latest_report__summary'):
+        report = None
+        if project['latest_report__version'] is not None:
+            report = dict(
+                project['latest_report__summary'] or {},
+                version=project['latest_report__version'],
+                created=project['latest_report__created'].isoformat(),
+                report_date=project['project_settings__report_date'])
+        projects.append({
+            'id': project['id'],
+            'name': project['name'],
+            'project_tms': project['project_tms_id'],
+            'report': report})
+    return {
+        'user': {'id': user.pk, 'username': user.username},
+        'tms': tmss,
+        'projects': projects,
+        'created': datetime.datetime.utcnow().isoformat()}
+
+
+def get_dashboard(user) -> Dict:
+    """Return cached dashboard data of user, building and caching it if there is none."""
+    cache, _ = DashboardCache.objects.get_or_create(user=user)
+    if cache.data is not None:
+        return cache.data
+    data = build_dashboard(user)
+    # not stored if invalidated while building
+    DashboardCache.objects.filter(user=user, generation=cache.generation).update(
+        data=data, created=datetime.datetime.now())
+    logger.debug('built dashboard of user {}'.format(user))
+    return data
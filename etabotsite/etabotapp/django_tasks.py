@@ -5,11 +5,18 @@ import celery as clry
 from .models import Project, TMS, CeleryTask
 from .models import parse_projects_for_TMS
 from django.contrib.auth.models import User
+from django.conf import settings
+from django.utils import timezone
 import logging
+import traceback
 import etabotapp.eta_tasks as eta_tasks
+import etabotapp.estimation_schedule as estimation_schedule
+from etabotapp.pipeline_checkpoints import CheckpointStore
 import datetime
 from typing import Union, List
 from .celery_tracking import *
+from etabotapp.TMSlib.spans import span
+from etabotapp.profiling import profiled
 from etabotapp import email_toolbox, email_reports
 import etabotapp.TMSlib.TMS as TMSlib
 
@@ -17,27 +24,33 @@ celery = clry.Celery()
 celery.config_from_object('django.conf:settings')
 logger = logging.getLogger('django')
 
+ESTIMATE_TASK_NAME = 'etabotapp.django_tasks.estimate_ETA_for_TMS_project_set_ids'
+# split TMS estimation into parallel subtasks with at most this many projects each (None - no split)
+PROJECTS_PER_SUBTASK = getattr(settings, 'CUSTOM_SETTINGS', {}).get('projects_per_subtask')
+# failed estimations are retried from the last checkpointed stage
+ESTIMATE_MAX_RETRIES = getattr(settings, 'CUSTOM_SETTINGS', {}).get('estimate_max_retries', 3)
+ESTIMATE_RETRY_COUNTDOWN_S = getattr(settings, 'CUSTOM_SETTINGS', {}).get('estimate_retry_countdown_s', 300)
+
 
 @shared_task
 def estimate_all(task_id=None, **kwargs):  # Put kwargs into a decorator
     """Estimate ETA for all tasks for all users."""
 
+    logger.info('purged {} expired pipeline checkpoints'.format(CheckpointStore.purge_expired()))
     tms_set = TMS.objects.all()
     logger.info('starting generating ETAs for the following TMS entries ({}): {}, task_id={}'.format(
         len(tms_set), tms_set, task_id))
     global_params = {
-        'push_updates_to_tms': True
+        'push_updates_to_tms': True,
+        # scheduled runs reuse reports of projects without issue updates
+        'skip_unchanged': True
     }
     results = []
     tmss_str = []
     for tms in tms_set:
         projects = Project.objects.all().filter(project_tms_id=tms.id)
         projects_ids = [p.id for p in projects]
-        result = send_celery_task_with_tracking(
-            'etabotapp.django_tasks.estimate_ETA_for_TMS_project_set_ids',
-            (tms.id, projects_ids, global_params),
-            owner=tms.owner,
-            parent_task_id=task_id)
+        result = send_estimate_for_tms(tms, projects_ids, global_params, parent_task_id=task_id)
         logger.info('submitted celery job {} for tms {}, projects {}'.format(result.task_id, tms, projects))
         results.append(result)
         tmss_str.append(str(tms))
@@ -50,18 +63,88 @@ def estimate_all(task_id=None, **kwargs):  # Put kwargs into a decorator
     return True
 
 
+def send_estimate_for_tms(tms, projects_ids, global_params, parent_task_id=None, queue=BATCH_QUEUE):
+    return send_celery_task_with_tracking(
+        ESTIMATE_TASK_NAME,
+        (tms.id, projects_ids, global_params),
+        owner=tms.owner,
+        meta_data={'tms_id': tms.id},
+        queue=queue,
+        parent_task_id=parent_task_id)
+
+
+@shared_task
+def estimate_due(task_id=None, **kwargs):
+    """Estimate ETA for TMSs whose local morning is approaching (timezone-staggered estimate_all).
+
+    Called periodically by celery beat; see estimation_schedule."""
+    now = timezone.now()
+    if task_id is None:
+        task_id = 'staggered_update_{}'.format(now.strftime('%Y-%m-%d_%H-%M-%S'))
+    tms_set = TMS.objects.all().prefetch_related('project_set')
+    recent_tasks = CeleryTask.objects.filter(
+        task_name=ESTIMATE_TASK_NAME,
+        start_time__gte=now - datetime.timedelta(days=2))
+    in_flight = recent_tasks.filter(
+        status='PN',
+        start_time__gte=now - datetime.timedelta(seconds=COALESCE_WINDOW_S)).count()
+    last_dispatch_times = {}
+    for tms_id, start_time in recent_tasks.values_list('meta_data__tms_id', 'start_time'):
+        if tms_id is not None and start_time > last_dispatch_times.get(tms_id, start_time - datetime.timedelta(1)):
+            last_dispatch_times[tms_id] = start_time
+    candidates = [
+        (tms,
+         estimation_schedule.tms_utc_offset_hours([p.work_hours for p in tms.project_set.all()]),
+         last_dispatch_times.get(tms.id))
+        for tms in tms_set]
+    due_tms = estimation_schedule.select_due(now, candidates, in_flight)
+    global_params = {
+        'push_updates_to_tms': True,
+        # scheduled runs reuse reports of projects without issue updates
+        'skip_unchanged': True
+    }
+    for tms in due_tms:
+        projects_ids = [p.id for p in tms.project_set.all()]
+        result = send_estimate_for_tms(tms, projects_ids, global_params, parent_task_id=task_id)
+        logger.info('submitted celery job {} for tms {}, projects {}'.format(result.task_id, tms, projects_ids))
+    logger.info('estimate_due submitted {} of {} TMSs, {} estimations were in flight, task_id={}'.format(
+        len(due_tms), len(candidates), in_flight, task_id))
+    return len(due_tms)
+
+
+@shared_task
+def dispatch_waiting(**kwargs):
+    """Send tasks waiting for owner quota, e.g. after running tasks of the owner were lost."""
+    dispatched = dispatch_waiting_tasks()
+    logger.info('dispatch_waiting sent {} waiting tasks'.format(dispatched))
+    return dispatched
+
+
+@shared_task
+def purge_celery_tasks(**kwargs):
+    """Compact celery task records older than the retention window into daily stats."""
+    return compact_celery_tasks()
+
+
+def is_transient_error(e: Exception) -> bool:
+    """Return True for errors worth retrying an estimation from its last checkpoint.
+
+    Network errors, including SMTP (smtplib.SMTPException) and HTTP connection errors
+    (requests.RequestException), are OSErrors; JIRA errors are transient for throttling and server errors."""
+    if isinstance(e, OSError):
+        return True
+    status_code = getattr(e, 'status_code', None)
+    return isinstance(status_code, int) and (status_code == 429 or status_code >= 500)
+
+
 def get_tms_by_id(tms_id) -> Union[TMS, None]:
     logger.info('searching for TMS with id: {}'.format(tms_id))
-    tms_list = TMS.objects.all().filter(
-            pk=tms_id)
-    logger.info('found TMSs: {}'.format(tms_list))
-    if len(tms_list) > 1:
-        raise NameError('TMS id "{}" is not unique'.format(tms_id))
-    elif tms_list is None or len(tms_list) == 0:
+    # owner and token are used by every task for the connection and the email report
+    tms = TMS.objects.select_related('owner', 'oauth2_token').filter(pk=tms_id).first()
+    if tms is None:
         logger.warning('no TMS found with id {}'.format(tms_id))
-        return None
     else:
-        tms = tms_list[0]
+        logger.info('found TMS: {}'.format(tms))
     return tms
 
 
@@ -77,10 +160,18 @@ def generate_critical_path(
     logging.debug('tms_id = {}, final_nodes="{}", params={}'.format(tms_id, final_nodes, params))
     tms = get_tms_by_id(tms_id)
     logs = []
-    tms_wrapper = TMSlib.TMSWrapper(tms, logs=logs)
-    email_msg = TMSlib.cp.generate_critical_paths_email_report_for_tms(
-        tms_wrapper=tms_wrapper, final_nodes=final_nodes, params=params)
-    email_reports.EmailReportProcess.send_email(email_msg)
+    progress = task_progress(task_id)
+    if progress is not None:
+        progress.stage('critical_path')
+    with recorded_spans(task_id, 'generate_critical_path') as spans, recorded_jira_usage(task_id, tms) as usage:
+        tms_wrapper = TMSlib.TMSWrapper(tms, logs=logs, progress=progress, spans=spans, usage=usage)
+        with span(spans, 'critical_path'):
+            email_msg = TMSlib.cp.generate_critical_paths_email_report_for_tms(
+                tms_wrapper=tms_wrapper, final_nodes=final_nodes, params=params)
+        if progress is not None:
+            progress.stage('email')
+        with span(spans, 'email'):
+            email_reports.EmailReportProcess.send_email(email_msg)
     logging.info('generate_critical_path finished task_id = {}'.format(task_id))
 
 
@@ -105,11 +196,142 @@ def estimate_ETA_for_TMS_project_set_ids(
         logger.error('Simulating failure: estimate_ETA_for_TMS_project_set_ids')
         raise NameError('Simulating failure')
 
-    eta_tasks.estimate_ETA_for_TMS(tms, projects_set, **params)
+    projects_per_subtask = params.get('projects_per_subtask', PROJECTS_PER_SUBTASK)
+    if projects_per_subtask and len(projects_set_ids) > projects_per_subtask:
+        return fan_out_estimate_ETA_for_TMS(tms, projects_set_ids, params, projects_per_subtask, task_id)
+
+    profile = params.get('profile', False)
+    params = {k: v for k, v in params.items() if k != 'profile'}
+    checkpoints = CheckpointStore(task_id) if task_id is not None else None
+    try:
+        with tms_lease(tms_id, task_id), \
+                recorded_spans(task_id, 'estimate_ETA_for_TMS', parent_task_id=parent_task_id) as spans, \
+                recorded_jira_usage(task_id, tms) as usage, \
+                profiled(task_id, 'estimate_ETA_for_TMS', enabled=profile):
+            eta_tasks.estimate_ETA_for_TMS(
+                tms, projects_set, checkpoints=checkpoints, progress=task_progress(task_id), spans=spans,
+                usage=usage, run_id=task_id, **params)
+    except LeaseNotAcquired as e:
+        logger.info('{}, retrying in {} s'.format(e, TMS_LEASE_RETRY_COUNTDOWN_S))
+        raise estimate_ETA_for_TMS_project_set_ids.retry(
+            countdown=TMS_LEASE_RETRY_COUNTDOWN_S,
+            max_retries=TMS_LEASE_TTL_S // TMS_LEASE_RETRY_COUNTDOWN_S)
+    except Exception as e:
+        if checkpoints is None or not is_transient_error(e):
+            raise
+        logger.warning('estimate_ETA_for_TMS failed due to "{}", retrying from last checkpoint in {} s'.format(
+            e, ESTIMATE_RETRY_COUNTDOWN_S))
+        raise estimate_ETA_for_TMS_project_set_ids.retry(
+            exc=e, countdown=ESTIMATE_RETRY_COUNTDOWN_S, max_retries=ESTIMATE_MAX_RETRIES)
     logger.info('estimate_ETA_for_TMS_project_set_ids celery task_id={}, parent_task_id={} finished'.format(
         task_id, parent_task_id))
 
 
+def fan_out_estimate_ETA_for_TMS(tms, projects_set_ids, params, projects_per_subtask, task_id):
+    """Split TMS estimation into subtasks per group of projects with merge_estimates_for_TMS as chord callback.
+
+    The TMS lease is handed over to the callback which releases it once results are merged.
+    The estimation task stays pending until the callback finishes it."""
+    callback_task_id_holder = 'chord_of_{}'.format(task_id)
+    if not acquire_lease(tms_lease_key(tms.id), callback_task_id_holder):
+        logger.info('TMS id {} is leased by another task, retrying in {} s'.format(
+            tms.id, TMS_LEASE_RETRY_COUNTDOWN_S))
+        raise estimate_ETA_for_TMS_project_set_ids.retry(
+            countdown=TMS_LEASE_RETRY_COUNTDOWN_S,
+            max_retries=TMS_LEASE_TTL_S // TMS_LEASE_RETRY_COUNTDOWN_S)
+    subtask_params = {k: v for k, v in params.items() if k != 'projects_per_subtask'}
+    groups = [
+        projects_set_ids[i:i + projects_per_subtask]
+        for i in range(0, len(projects_set_ids), projects_per_subtask)]
+    header = [(
+        'etabotapp.django_tasks.estimate_ETA_for_TMS_project_subset',
+        (tms.id, group, subtask_params),
+        {'parent_task_id': task_id}) for group in groups]
+    callback = (
+        'etabotapp.django_tasks.merge_estimates_for_TMS',
+        (tms.id, projects_set_ids, callback_task_id_holder),
+        {'parent_task_id': task_id})
+    # subtasks stay in the queue of the estimation being split, interactive or batch
+    result = send_celery_chord_with_tracking(header, callback, owner=tms.owner, queue=get_task_queue(task_id))
+    logger.info('submitted {} subtasks for tms {} with merge task {}'.format(len(groups), tms, result.task_id))
+    return Delegated(result.task_id)
+
+
+@shared_task
+@celery_task_update
+def estimate_ETA_for_TMS_project_subset(
+        tms_id,
+        projects_set_ids,
+        params,
+        task_id=None,
+        parent_task_id=None):
+    """Generate ETAs for a subset of TMS projects, return partial result for merge_estimates_for_TMS."""
+    logger.info('estimate_ETA_for_TMS_project_subset celery task_id={}, parent_task_id={} started'.format(
+        task_id, parent_task_id))
+    tms = get_tms_by_id(tms_id)
+    if tms is None:
+        raise NameError('cannot find TMS with id {}'.format(tms_id))
+    projects_set = Project.objects.all().filter(pk__in=projects_set_ids)
+    profile = params.get('profile', False)
+    params = {k: v for k, v in params.items() if k != 'profile'}
+    checkpoints = CheckpointStore(task_id) if task_id is not None else None
+    try:
+        with recorded_spans(task_id, 'estimate_ETA_for_TMS_partial', parent_task_id=parent_task_id) as spans, \
+                recorded_jira_usage(task_id, tms) as usage, \
+                profiled(task_id, 'estimate_ETA_for_TMS_partial', enabled=profile):
+            # subsets and the merge task store report versions of their common parent run
+            result = eta_tasks.estimate_ETA_for_TMS_partial(
+                tms, projects_set, checkpoints=checkpoints, progress=task_progress(task_id), spans=spans,
+                usage=usage, run_id=parent_task_id, **params)
+    except Exception as e:
+        if checkpoints is None or not is_transient_error(e):
+            raise
+        logger.warning('estimate_ETA_for_TMS_partial failed due to "{}", retrying from last checkpoint in {} s'.format(
+            e, ESTIMATE_RETRY_COUNTDOWN_S))
+        raise estimate_ETA_for_TMS_project_subset.retry(
+            exc=e, countdown=ESTIMATE_RETRY_COUNTDOWN_S, max_retries=ESTIMATE_MAX_RETRIES)
+    logger.info('estimate_ETA_for_TMS_project_subset celery task_id={}, parent_task_id={} finished'.format(
+        task_id, parent_task_id))
+    return result
+
+
+@shared_task
+@celery_task_update
+def merge_estimates_for_TMS(
+        partials,
+        tms_id,
+        projects_set_ids,
+        lease_holder,
+        task_id=None,
+        parent_task_id=None):
+    """Chord callback: combine partial estimates into one email report, release the TMS lease
+    and finish the split estimation task (parent_task_id)."""
+    logger.info('merge_estimates_for_TMS celery task_id={}, parent_task_id={} started'.format(
+        task_id, parent_task_id))
+    try:
+        tms = get_tms_by_id(tms_id)
+        if tms is None:
+            raise NameError('cannot find TMS with id {}'.format(tms_id))
+        projects_set = Project.objects.all().filter(pk__in=projects_set_ids)
+        with recorded_spans(task_id, 'merge_partial_estimates', parent_task_id=parent_task_id) as spans:
+            failed = eta_tasks.merge_partial_estimates(
+                tms, projects_set, partials, spans=spans, run_id=parent_task_id)
+    except Exception as e:
+        if parent_task_id is not None:
+            finish_celery_task(parent_task_id, 'FL', error='merge task {} failed due to "{}"\n{}'.format(
+                task_id, e, traceback.format_exc()))
+        raise
+    finally:
+        release_lease(tms_lease_key(tms_id), lease_holder)
+    if parent_task_id is not None:
+        if failed:
+            finish_celery_task(parent_task_id, 'FL', error='{} of {} subtasks failed'.format(failed, len(partials)))
+        else:
+            finish_celery_task(parent_task_id, 'DN')
+    logger.info('merge_estimates_for_TMS celery task_id={}, parent_task_id={} finished'.format(
+        task_id, parent_task_id))
+
+
 @shared_task
 @celery_task_update
 def parse_projects_for_tms_id(
@@ -120,7 +342,14 @@ def parse_projects_for_tms_id(
     tms = get_tms_by_id(tms_id)
     if tms is None:
         raise NameError('cannot find TMS with id {}'.format(tms_id))
-    result = parse_projects_for_TMS(tms, **params)
+    try:
+        with tms_lease(tms_id, task_id):
+            result = parse_projects_for_TMS(tms, **params)
+    except LeaseNotAcquired as e:
+        logger.info('{}, retrying in {} s'.format(e, TMS_LEASE_RETRY_COUNTDOWN_S))
+        raise parse_projects_for_tms_id.retry(
+            countdown=TMS_LEASE_RETRY_COUNTDOWN_S,
+            max_retries=TMS_LEASE_TTL_S // TMS_LEASE_RETRY_COUNTDOWN_S)
     tms.connectivity_status['description'] = '{} Import projects result: {}. \n {}'.format(
         datetime.datetime.utcnow().isoformat(),
         result,
@@ -131,13 +360,18 @@ def parse_projects_for_tms_id(
 @shared_task
 @celery_task_update
 def send_daily_project_report(task_id=None, **kwargs):
-    """Generate Daily Email Reports for all Users"""
+    """Generate Daily Email Reports for all Users.
+
+    Owners, TMSs and projects are loaded in two queries; each TMS is estimated in its own tracked task
+    so that a slow TMS does not delay reports of other users."""
     logger.info("Sending Emails to all users for Daily Reports!")
-    userlist = User.objects.all()
-    for user in userlist:
-        tms_list = TMS.objects.all().filter(owner=user)
-        logger.debug("TMS: {}".format(len(tms_list)))
-        for tms in tms_list:
-            project_set = Project.objects.all().filter(project_tms_id=tms.id)
-            if project_set:
-                eta_tasks.estimate_ETA_for_TMS(tms, project_set, **kwargs)
+    tms_list = TMS.objects.all().select_related('owner').prefetch_related('project_set').order_by('owner_id')
+    results = []
+    for tms in tms_list:
+        projects_ids = [p.id for p in tms.project_set.all()]
+        if projects_ids:
+            result = send_estimate_for_tms(tms, projects_ids, kwargs, parent_task_id=task_id)
+            logger.info('submitted celery job {} for daily report of tms {}'.format(result.task_id, tms))
+            results.append(result)
+    logger.info('send_daily_project_report submitted {} TMS estimations, task_id={}'.format(len(results), task_id))
+    return [result.task_id for result in results]
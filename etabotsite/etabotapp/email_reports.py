@@ -6,9 +6,12 @@ This script contains all the class information needed to send daily
 email reports to users.
 
 """
+import base64
+import email
 import logging
 import socket
 from datetime import datetime
+from email.message import Message
 
 import pandas as pd
 from typing import List, Dict, Tuple, Union
@@ -18,7 +21,8 @@ from django.template.loader import render_to_string
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
 import etabotapp.email_toolbox as email_toolbox
-from etabotapp.TMSlib.interface import HierarchicalReportNode, BasicReport
+from etabotapp.TMSlib.interface import HierarchicalReportNode, BasicReport, render_reports
+from etabotapp.report_cache import report_fragment_cache
 
 logger = logging.getLogger()
 
@@ -51,16 +55,41 @@ def logs2html(logs: Union[None, List[Tuple[datetime, str]]]):
     return logs_html
 
 
+def report_render_context(report: BasicReport) -> Dict:
+    """Return JSON serializable part of BasicReport used by report_email.html and full_report.html."""
+    aux = report.aux if isinstance(report.aux, dict) else {}
+    return {
+        'html': report.html,
+        'short_html': report.short_html,
+        'entity_display_name': report.entity_display_name,
+        'params': report.params,
+        'aux': {k: v for k, v in aux.items() if isinstance(v, str)},
+        'velocity_report': {
+            'html': report.velocity_report.html,
+            'images': report.velocity_report.images,
+            'images_for_email': {cid: '' for cid in report.velocity_report.images_for_email.keys()}
+        }
+    }
+
+
+def image2str(image: Message) -> str:
+    """Encode email image attachment for passing between celery tasks."""
+    return base64.b64encode(image.as_bytes()).decode('ascii')
+
+
+def str2image(image_str: str) -> Message:
+    return email.message_from_bytes(base64.b64decode(image_str))
+
+
 class EmailReportProcess(object):
     @staticmethod
-    def send_email(msg):
-        email_toolbox.EmailWorker.send_email(msg)
+    def send_email(msg, raise_on_failure=False):
+        email_toolbox.EmailWorker.send_email(msg, raise_on_failure=raise_on_failure)
 
     @staticmethod
     def generate_html_report(user, reports: Dict[str, HierarchicalReportNode], logs=None) -> (str, str):
         """Return (report_email, full_report) tuple."""
         formatted_reports = []
-        html_logs = logs2html(logs)
         for project, project_report in reports.items():
             project_formatted_reports = []
             for basic_report in project_report.all_reports():
@@ -73,13 +102,23 @@ class EmailReportProcess(object):
                 ))
 
             formatted_reports = formatted_reports + project_formatted_reports
+        render_reports(formatted_reports, cache=report_fragment_cache())
+        return EmailReportProcess.render_html_reports(user, formatted_reports, logs=logs, projects=reports.keys())
+
+    @staticmethod
+    def render_html_reports(
+            user, formatted_reports: List[Union[BasicReport, Dict]], logs=None, projects=None) -> (str, str):
+        """Return (report_email, full_report) tuple.
+
+        formatted_reports - BasicReport objects or their report_render_context dicts."""
+        html_logs = logs2html(logs)
         if len(formatted_reports) == 0:
             report = BasicReport.empty_report('Something went wrong. Our apologies.')
             report.short_html = '<h1>Something went wrong. Our apologies.</h1><br><h2>Logs:</h2><br>' + html_logs
             formatted_reports.append(report)
             email_toolbox.EmailWorker.send_email(email_toolbox.EmailWorker.format_email_msg(
                 'no-reply@etabot.ai', 'hello@etabot.ai', 'no reports generated',
-                'user: "{}" \n projects: "{}"\n logs: {}'.format(user.username, reports.keys(), html_logs)
+                'user: "{}" \n projects: "{}"\n logs: {}'.format(user.username, projects, html_logs)
             ))
         report_email = render_to_string('report_email.html', {
             'username': user.username,
@@ -7,6 +7,8 @@ import logging
 import smtplib
 import time
 
+from etabotapp import metrics
+
 from django.conf import settings
 from django.contrib.auth.models import User
 from django.template.loader import render_to_string
@@ -24,7 +26,8 @@ EMAIL_PORT = getattr(settings, "EMAIL_PORT", None)
 
 class EmailWorker(object):
     @staticmethod
-    def send_email(msg):
+    def send_email(msg, raise_on_failure=False):
+        start_time = time.time()
         try:
             logging.debug('starting send_email.')
             server = smtplib.SMTP(EMAIL_HOST, EMAIL_PORT)
@@ -37,9 +40,13 @@ class EmailWorker(object):
             server.send_message(msg)
             del server
 
+            metrics.observe('etabot_smtp_send_seconds', time.time() - start_time)
             logging.info('Successfully sent email')
         except Exception as ex:
+            metrics.inc('etabot_smtp_errors_total')
             logging.error('Failed to send email due to "{}"'.format(ex))
+            if raise_on_failure:
+                raise
 
     @staticmethod
     def format_email_msg(
@@ -0,0 +1,108 @@
+"""Timezone-staggered scheduling of periodic estimations.
+
+Each TMS is estimated shortly before the local morning of its projects' time zone
+(Project.work_hours["Time Zone"]) instead of all TMSs at once. The periodic
+dispatcher submits due TMSs while keeping the number of in-flight estimations
+under a global ceiling; TMSs above the ceiling stay due until the next tick.
+"""
+import datetime
+import logging
+import re
+from typing import Dict, List, Tuple, Union
+
+import pytz
+from django.conf import settings
+
+logger = logging.getLogger('django')
+
+CUSTOM_SETTINGS = getattr(settings, 'CUSTOM_SETTINGS', {})
+# local hour by which reports should be ready
+REPORT_LOCAL_HOUR = CUSTOM_SETTINGS.get('eta_report_local_hour', 7)
+# estimation starts this many hours before REPORT_LOCAL_HOUR
+ESTIMATE_LEAD_TIME_H = CUSTOM_SETTINGS.get('eta_lead_time_h', 2)
+# used for projects without a recognized time zone (midnight Pacific is 8am UTC)
+DEFAULT_UTC_OFFSET_H = CUSTOM_SETTINGS.get('eta_default_utc_offset_h', -8)
+# maximum number of estimations in flight across all tenants
+MAX_CONCURRENT_ESTIMATES = CUSTOM_SETTINGS.get('eta_max_concurrent_estimates', 20)
+# a TMS whose scheduled time passed longer ago than this is skipped until its next slot
+CATCH_UP_WINDOW_H = CUSTOM_SETTINGS.get('eta_catch_up_window_h', 12)
+
+UTC_OFFSET_RE = re.compile(r'^(?:GMT|UTC)?\s*([+-])\s*(\d{1,2})(?::?(\d{2}))?$', re.IGNORECASE)
+
+
+def parse_utc_offset_hours(time_zone: Union[str, None], now: datetime.datetime = None) -> Union[float, None]:
+    """Return UTC offset in hours for strings like "GMT +8", "UTC-05:30" or "America/Los_Angeles".
+
+    Returns None if time_zone is not recognized."""
+    if not isinstance(time_zone, str) or not time_zone.strip():
+        return None
+    time_zone = time_zone.strip()
+    if time_zone.upper() in ('GMT', 'UTC'):
+        return 0.
+    match = UTC_OFFSET_RE.match(time_zone)
+    if match:
+        sign = 1 if match.group(1) == '+' else -1
+        return sign * (int(match.group(2)) + int(match.group(3) or 0) / 60.)
+    try:
+        tz = pytz.timezone(time_zone)
+    except pytz.UnknownTimeZoneError:
+        logger.debug('unknown time zone "{}"'.format(time_zone))
+        return None
+    if now is None:
+        now = datetime.datetime.utcnow()
+    return tz.utcoffset(now.replace(tzinfo=None)).total_seconds() / 3600.
+
+
+def tms_utc_offset_hours(projects_work_hours: List[Dict]) -> float:
+    """Return UTC offset of the TMS: the easternmost time zone of its projects as its morning comes first."""
+    offsets = []
+    for work_hours in projects_work_hours:
+        if isinstance(work_hours, dict):
+            offset = parse_utc_offset_hours(work_hours.get('Time Zone'))
+            if offset is not None:
+                offsets.append(offset)
+    if len(offsets) == 0:
+        return DEFAULT_UTC_OFFSET_H
+    return max(offsets)
+
+
+def last_scheduled_time(
+        now: datetime.datetime,
+        utc_offset_h: float,
+        report_local_hour: float = REPORT_LOCAL_HOUR,
+        lead_time_h: float = ESTIMATE_LEAD_TIME_H) -> datetime.datetime:
+    """Return the most recent UTC time (<= now) when estimation for the given UTC offset should start."""
+    midnight = now.replace(hour=0, minute=0, second=0, microsecond=0)
+    scheduled = midnight + datetime.timedelta(hours=report_local_hour - lead_time_h - utc_offset_h)
+    while scheduled > now:
+        scheduled -= datetime.timedelta(days=1)
+    while scheduled + datetime.timedelta(days=1) <= now:
+        scheduled += datetime.timedelta(days=1)
+    return scheduled
+
+
+def select_due(
+        now: datetime.datetime,
+        candidates: List[Tuple[object, float, Union[datetime.datetime, None]]],
+        in_flight: int,
+        max_concurrent: int = MAX_CONCURRENT_ESTIMATES,
+        catch_up_window_h: float = CATCH_UP_WINDOW_H) -> List[object]:
+    """Return items to estimate now, most overdue first, within the concurrency ceiling.
+
+    :param candidates: (item, utc_offset_h, last_dispatch_time or None) tuples
+    :param in_flight: number of estimations currently pending or running
+    """
+    due = []
+    for item, utc_offset_h, last_dispatch_time in candidates:
+        scheduled = last_scheduled_time(now, utc_offset_h)
+        if now - scheduled > datetime.timedelta(hours=catch_up_window_h):
+            continue
+        if last_dispatch_time is not None and last_dispatch_time >= scheduled:
+            continue
+        due.append((scheduled, item))
+    due.sort(key=lambda x: x[0])
+    capacity = max(0, max_concurrent - in_flight)
+    if len(due) > capacity:
+        logger.info('{} estimations due, {} in flight: postponing {} due to concurrency ceiling {}'.format(
+            len(due), in_flight, len(due) - capacity, max_concurrent))
+    return [item for scheduled, item in due[:capacity]]
@@ -5,10 +5,17 @@ import etabotapp.TMSlib.TMS as TMSlib
 import logging
 import etabotapp.email_reports as email_reports
 
-from typing import List, Tuple
+from typing import List, Tuple, Dict, Union
 
-from etabotapp.TMSlib.interface import HierarchicalReportNode
+from etabotapp.TMSlib.interface import HierarchicalReportNode, render_reports
 from etabotapp.models import TMS, Project
+from etabotapp.pipeline_checkpoints import CheckpointStore, run_stage
+from etabotapp.celery_tracking import TaskProgress
+from etabotapp.TMSlib.spans import SpanRecorder, span
+from etabotapp.TMSlib.JIRA_API import JiraUsage
+from etabotapp.report_cache import report_fragment_cache
+from etabotapp.report_store import save_project_report
+from etabotapp.change_detection import SKIP_UNCHANGED_PROJECTS, split_unchanged_projects
 from datetime import datetime
 logger = logging.getLogger()
 
@@ -41,34 +48,43 @@ def save_project_velocities(tms_wrapper, projects_set) -> List[str]:
     return project_names
 
 
-def estimate_ETA_for_TMS(
-        tms: TMS, projects_set: List[Project], **kwargs) -> None:
-    """Estimates ETA for a given TMS and projects_set. This will generate and send reports, update velocities,
-    push ETAs to destinations.
-
-    Arguments:
-        tms - Django model of TMS.
+def generate_status_reports_for_TMS(
+        tms: TMS, projects_set: List[Project], logs: List[Tuple[datetime, str]],
+        progress: TaskProgress = None,
+        spans: SpanRecorder = None,
+        usage: JiraUsage = None,
+        skip_unchanged: bool = False,
+        **kwargs) -> Dict[str, HierarchicalReportNode]:
+    """Fetch tasks, update velocities, estimate ETAs and generate status reports for a given TMS and projects_set.
 
-    Todo:
-    add an option not to refresh velocities
-    https://etabot.atlassian.net/browse/ET-521
+    With skip_unchanged, projects without issue updates since their last report reuse it (see change_detection.py).
     """
-    logs = []
-    logger.debug(
-        'estimate_ETA_for_TMS started for TMS {}, projects: {}'.format(
-            tms, projects_set))
     logs.append((datetime.utcnow(), 'TMS {} connectivity_status: {}'.format(str(tms), tms.connectivity_status)))
-    tms_wrapper = TMSlib.TMSWrapper(tms, logs=logs)
+    tms_wrapper = TMSlib.TMSWrapper(tms, logs=logs, progress=progress, spans=spans, usage=usage)
     logs.append((datetime.utcnow(), 'tms wrapper initialized'))
-    tms_wrapper.init_ETApredict(projects_set, **kwargs)
+    cached_reports = {}
+    if skip_unchanged and SKIP_UNCHANGED_PROJECTS:
+        with span(spans, 'change_detection', projects=len(projects_set)) as detection_span:
+            projects_set, cached_reports = split_unchanged_projects(tms_wrapper, projects_set, logs)
+            detection_span.add(unchanged=len(cached_reports))
+        if len(projects_set) == 0:
+            return cached_reports
+    if progress is not None:
+        progress.stage('fetching_issues', projects_total=len(projects_set))
+    with span(spans, 'fetch_issues'):
+        tms_wrapper.init_ETApredict(projects_set, **kwargs)
     logs.append((datetime.utcnow(), 'ETA prediction module initialized'))
-    project_names = save_project_velocities(tms_wrapper, projects_set)
+    with span(spans, 'save_velocities'):
+        project_names = save_project_velocities(tms_wrapper, projects_set)
     logs.append((datetime.utcnow(), 'project names detected: {}'.format(project_names)))
 
-    tms_wrapper.estimate_tasks(
-        project_names=project_names,
-        logs=logs,
-        **kwargs)
+    if progress is not None:
+        progress.stage('estimating')
+    with span(spans, 'eta_prediction'):
+        tms_wrapper.estimate_tasks(
+            project_names=project_names,
+            logs=logs,
+            **kwargs)
     if tms_wrapper.ETApredict_obj is None:
         logs.append((datetime.utcnow(), 'Error: ETApredict_obj is None'))
     elif tms_wrapper.ETApredict_obj.df_tasks_with_ETAs is None:
@@ -76,52 +92,228 @@ def estimate_ETA_for_TMS(
     else:
         logs.append((datetime.utcnow(), 'generated ETAs for {} tasks'.format(
             tms_wrapper.ETApredict_obj.df_tasks_with_ETAs.shape[0])))
-    raw_status_reports = tms_wrapper.generate_projects_status_report(
-        project_names=project_names, **kwargs)
+    if progress is not None:
+        progress.stage('status_reports')
+    with span(spans, 'report_generation', projects=len(project_names)):
+        raw_status_reports = tms_wrapper.generate_projects_status_report(
+            project_names=project_names, **kwargs)
     logs.append((datetime.utcnow(), 'generated {} status reports for: {}'.format(
         len(raw_status_reports), ', '.join(list(raw_status_reports.keys())))))
+    raw_status_reports.update(cached_reports)
+    return raw_status_reports
 
-    email_report, full_report = email_reports.EmailReportProcess.generate_html_report(
-        tms.owner, raw_status_reports, logs=logs)
+
+def collect_email_images(raw_status_reports: Dict[str, HierarchicalReportNode]) -> List:
     images = []
     for report_name, report_node in raw_status_reports.items():
         for report in report_node.all_reports():
             for image in report.velocity_report.images_for_email.values():
                 images.append(image)
+    return images
 
-    email_msg = email_reports.EmailReportProcess.format_email_msg(
-        tms.owner, html_report=email_report, images=images)
 
-    email_reports.EmailReportProcess.send_email(email_msg)
+def reused_project_names(raw_status_reports: Dict[str, HierarchicalReportNode]) -> List[str]:
+    """Return names of projects whose stored report was reused instead of recomputed."""
+    return [name for name, report_node in raw_status_reports.items() if getattr(report_node, 'reused', False)]
+
+
+def save_project_reports(
+        projects_set: List[Project],
+        full_report: Union[str, None] = None,
+        raw_status_reports: Union[Dict[str, HierarchicalReportNode], None] = None,
+        progress: TaskProgress = None,
+        run_id: Union[str, None] = None,
+        reused_projects: Union[List[str], None] = None) -> None:
+    """Store full_report and/or hierarchical reports of projects_set in the report store
+    (see report_store.py) as versions of run_id and report_date in project_settings.
+
+    report_date of reused_projects (names of projects with a reused report) is kept."""
+    if reused_projects is None:
+        reused_projects = reused_project_names(raw_status_reports) if raw_status_reports is not None else []
     logger.info('updating projects_set: {}'.format(projects_set))
     for project in projects_set:
         project_settings = project.project_settings
-        project_settings['report'] = full_report
-        project_settings['report_date'] = str(datetime.utcnow())
-        logger.info('updated report for project: {} with date: {}'.format(project, project_settings['report_date']))
-        if project.name in raw_status_reports:
+        if project_settings is None:
+            project_settings = {}
+        hierarchical_report = None
+        if full_report is not None and project.name not in reused_projects:
+            project_settings['report_date'] = str(datetime.utcnow())
+            logger.info('updated report for project: {} with date: {}'.format(
+                project, project_settings['report_date']))
+        if raw_status_reports is None:
+            pass
+        elif project.name in raw_status_reports:
             hierarchical_report = raw_status_reports[project.name]
             if isinstance(hierarchical_report, HierarchicalReportNode):
                 logger.info('updating hierarchical_report for project {}'.format(project.name))
-                project_settings['hierarchical_report'] = hierarchical_report.to_dict()
-                logger.info('updated hierarchical_report for project {}'.format(project.name))
                 # todo: https://etabot.atlassian.net/browse/ET-879
-                # del project_settings['hierarchical_report']['velocity_report']['df_sprint_stats']
-                # del project_settings['hierarchical_report']['velocity_report']['df_velocity_vs_time']
-                # del project_settings['hierarchical_report']['velocity_report']['df_velocity_stats']
+                # store df_velocity_vs_time and df_velocity_stats
             else:
                 logger.warning('hierarchical_report ({}) is not of HierarchicalReportNode type'.format(
                     type(hierarchical_report)
                 ))
+                hierarchical_report = None
         else:
             logger.warning('no project {} in raw_status_reports {}'.format(project.name, raw_status_reports.keys()))
+        if full_report is not None or hierarchical_report is not None:
+            save_project_report(
+                project, run_id=run_id, full_report=full_report, hierarchical_report=hierarchical_report)
         # logger.debug("saving project settings: {}".format(project_settings))
-        # logger.debug("saving project settings hierarchical_report: {}".format(
-        #     project_settings.get('hierarchical_report')))
         project.project_settings = project_settings
 
         project.save()
         logger.info('saved project {} to DB.'.format(project.name))
+        if progress is not None:
+            progress.project_done()
+
+
+def generate_status_reports_with_logs(
+        tms: TMS, projects_set: List[Project], progress: TaskProgress = None, spans: SpanRecorder = None,
+        usage: JiraUsage = None, **kwargs) -> Tuple[Dict, List]:
+    logs = []
+    raw_status_reports = generate_status_reports_for_TMS(
+        tms, projects_set, logs, progress=progress, spans=spans, usage=usage, **kwargs)
+    return raw_status_reports, logs
+
+
+def render_reports_for_email(tms: TMS, raw_status_reports: Dict[str, HierarchicalReportNode], logs) -> Tuple:
+    email_report, full_report = email_reports.EmailReportProcess.generate_html_report(
+        tms.owner, raw_status_reports, logs=logs)
+    return email_report, full_report, collect_email_images(raw_status_reports)
+
+
+def send_report_email(tms: TMS, email_report: str, images: List, raise_on_failure=False) -> bool:
+    email_msg = email_reports.EmailReportProcess.format_email_msg(
+        tms.owner, html_report=email_report, images=images)
+    email_reports.EmailReportProcess.send_email(email_msg, raise_on_failure=raise_on_failure)
+    return True
+
+
+def estimate_ETA_for_TMS(
+        tms: TMS, projects_set: List[Project], checkpoints: CheckpointStore = None,
+        progress: TaskProgress = None, spans: SpanRecorder = None, usage: JiraUsage = None,
+        run_id: str = None, **kwargs) -> None:
+    """Estimates ETA for a given TMS and projects_set. This will generate and send reports, update velocities,
+    push ETAs to destinations.
+
+    Arguments:
+        tms - Django model of TMS.
+        checkpoints - optional CheckpointStore for resuming from the last completed stage:
+            status_reports (fetch, predict, report generation), html_reports, saving, email.
+            Reports are persisted before the email is sent. Checkpoints are cleared once the email is sent.
+        progress - optional TaskProgress of the running celery task.
+        spans - optional SpanRecorder for timing of connect, JQL queries, prediction, reports, email, DB.
+        usage - optional JiraUsage accounting JIRA API calls of the run.
+        run_id - optional id of the run (celery task id) the stored report versions belong to.
+
+    Todo:
+    add an option not to refresh velocities
+    https://etabot.atlassian.net/browse/ET-521
+    """
+    logger.debug(
+        'estimate_ETA_for_TMS started for TMS {}, projects: {}'.format(
+            tms, projects_set))
+    raw_status_reports, logs = run_stage(
+        checkpoints, 'status_reports', generate_status_reports_with_logs, tms, projects_set,
+        progress=progress, spans=spans, usage=usage, **kwargs)
+    if progress is not None:
+        progress.stage('html_reports')
+    with span(spans, 'rendering'):
+        email_report, full_report, images = run_stage(
+            checkpoints, 'html_reports', render_reports_for_email, tms, raw_status_reports, logs)
+    if progress is not None:
+        progress.stage('saving', projects_total=len(projects_set), projects_done=0)
+    with span(spans, 'db_persistence', projects=len(projects_set)):
+        run_stage(
+            checkpoints, 'saving', save_project_reports, projects_set, full_report, raw_status_reports,
+            progress=progress, run_id=run_id)
+    if progress is not None:
+        progress.stage('email')
+    # with checkpoints a failed email is retried without repeating the previous stages
+    with span(spans, 'email', images=len(images)):
+        run_stage(
+            checkpoints, 'email', send_report_email, tms, email_report, images,
+            raise_on_failure=checkpoints is not None)
+    if checkpoints is not None:
+        checkpoints.clear()
 
     logger.debug('estimate_ETA_for_TMS finished')
 
+
+def estimate_ETA_for_TMS_partial(
+        tms: TMS, projects_set: List[Project], checkpoints: CheckpointStore = None,
+        progress: TaskProgress = None, spans: SpanRecorder = None, usage: JiraUsage = None,
+        run_id: str = None, **kwargs) -> Dict:
+    """Estimates ETA for a subset of TMS projects without sending the email report.
+
+    Velocities and hierarchical reports are stored for projects_set.
+    Returns JSON serializable partial result to be combined by merge_partial_estimates.
+    """
+    logger.debug(
+        'estimate_ETA_for_TMS_partial started for TMS {}, projects: {}'.format(
+            tms, projects_set))
+    raw_status_reports, logs = run_stage(
+        checkpoints, 'status_reports', generate_status_reports_with_logs, tms, projects_set,
+        progress=progress, spans=spans, usage=usage, **kwargs)
+    basic_reports = []
+    for project_report in raw_status_reports.values():
+        basic_reports += project_report.all_reports()
+    with span(spans, 'rendering', reports=len(basic_reports)):
+        render_reports(basic_reports, cache=report_fragment_cache())
+        reports = [email_reports.report_render_context(report) for report in basic_reports]
+    if progress is not None:
+        progress.stage('saving', projects_total=len(projects_set), projects_done=0)
+    with span(spans, 'db_persistence', projects=len(projects_set)):
+        save_project_reports(projects_set, raw_status_reports=raw_status_reports, progress=progress, run_id=run_id)
+    logger.debug('estimate_ETA_for_TMS_partial finished')
+    result = {
+        'project_names': list(raw_status_reports.keys()),
+        'reused_project_names': reused_project_names(raw_status_reports),
+        'reports': reports,
+        'images': [email_reports.image2str(image) for image in collect_email_images(raw_status_reports)],
+        'logs': [(t.isoformat(), message) for t, message in logs]
+    }
+    if checkpoints is not None:
+        checkpoints.clear()
+    return result
+
+
+def merge_partial_estimates(
+        tms: TMS, projects_set: List[Project], partials: List[Union[Dict, None]],
+        spans: SpanRecorder = None, run_id: str = None) -> int:
+    """Combine results of estimate_ETA_for_TMS_partial into one email report and store full report.
+
+    With run_id of the partial estimates the full report is added to their report versions.
+    Only projects of successful partial estimates are saved, failed ones (None) keep their reports
+    and report_date. Return number of failed partial estimates."""
+    logs = []
+    reports = []
+    images = []
+    project_names = []
+    reused_projects = []
+    failed = 0
+    for partial in partials:
+        if partial is None:
+            failed += 1
+            logs.append((datetime.utcnow(), 'Error: estimate for a subset of projects failed'))
+            continue
+        logs += [(datetime.fromisoformat(t), message) for t, message in partial['logs']]
+        reports += partial['reports']
+        images += [email_reports.str2image(image) for image in partial['images']]
+        project_names += partial['project_names']
+        reused_projects += partial.get('reused_project_names', [])
+    logs.append((datetime.utcnow(), 'merged {} partial estimates with {} reports for: {}'.format(
+        len(partials), len(reports), ', '.join(project_names))))
+
+    with span(spans, 'rendering'):
+        email_report, full_report = email_reports.EmailReportProcess.render_html_reports(
+            tms.owner, reports, logs=logs, projects=project_names)
+    estimated_projects = [project for project in projects_set if project.name in project_names]
+    with span(spans, 'db_persistence', projects=len(estimated_projects)):
+        save_project_reports(estimated_projects, full_report, run_id=run_id, reused_projects=reused_projects)
+    with span(spans, 'email', images=len(images)):
+        email_msg = email_reports.EmailReportProcess.format_email_msg(
+            tms.owner, html_report=email_report, images=images)
+        email_reports.EmailReportProcess.send_email(email_msg)
+    logger.debug('merge_partial_estimates finished with {} failed partial estimates'.format(failed))
+    return failed
@@ -0,0 +1,207 @@
+"""In-process metrics registry: counters, gauges and histograms.
+
+Every process (gunicorn worker, celery worker) updates its own registry and
+periodically adds it to the snapshot of its host in METRICS_DIR, so counters
+outlive short-lived processes (celery runs each task in a new child process) and
+the number of snapshots stays one per container. The metrics endpoint merges the
+snapshots of all hosts and renders them in the Prometheus text format.
+METRICS_DIR (metrics_dir setting) has to be shared by the web and celery containers,
+the docker-compose files mount the pmp-metrics volume at /usr/src/app/metrics for it.
+"""
+import fcntl
+import json
+import logging
+import os
+import socket
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Tuple
+
+from django.conf import settings
+
+logger = logging.getLogger('django')
+
+CUSTOM_SETTINGS = getattr(settings, 'CUSTOM_SETTINGS', {})
+METRICS_DIR = CUSTOM_SETTINGS.get('metrics_dir', os.path.join(tempfile.gettempdir(), 'etabot_metrics'))
+# snapshot of the process registry is written at most once per this interval
+METRICS_FLUSH_INTERVAL_S = CUSTOM_SETTINGS.get('metrics_flush_interval_s', 10)
+# snapshots of hosts that stopped updating for this long are removed
+METRICS_SNAPSHOT_TTL_S = CUSTOM_SETTINGS.get('metrics_snapshot_ttl_s', 7 * 24 * 3600)
+DEFAULT_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300, 900, 3600)
+
+COUNTER = 'counter'
+GAUGE = 'gauge'
+HISTOGRAM = 'histogram'
+
+
+def labels_key(labels: Dict) -> str:
+    return json.dumps(sorted((k, str(v)) for k, v in labels.items()))
+
+
+class MetricsRegistry:
+    """Thread-safe registry of metrics of one process since its last flush.
+
+    Values are stored as {name: {'type': ..., 'values': {labels_key: value}}} where histogram value is
+    {'buckets': [counts per DEFAULT_BUCKETS bound], 'sum': float, 'count': int}."""
+
+    def __init__(self, snapshot_dir: str = METRICS_DIR, flush_interval_s: float = METRICS_FLUSH_INTERVAL_S):
+        self.metrics = {}
+        self.lock = threading.Lock()
+        self.snapshot_dir = snapshot_dir
+        self.flush_interval_s = flush_interval_s
+        self.last_flush_time = time.time()
+
+    def _values(self, name: str, metric_type: str) -> Dict:
+        metric = self.metrics.setdefault(name, {'type': metric_type, 'values': {}})
+        return metric['values']
+
+    def inc(self, name: str, value: float = 1, **labels) -> None:
+        with self.lock:
+            values = self._values(name, COUNTER)
+            key = labels_key(labels)
+            values[key] = values.get(key, 0) + value
+        self.maybe_flush()
+
+    def set_gauge(self, name: str, value: float, **labels) -> None:
+        with self.lock:
+            self._values(name, GAUGE)[labels_key(labels)] = value
+        self.maybe_flush()
+
+    def observe(self, name: str, value: float, **labels) -> None:
+        with self.lock:
+            values = self._values(name, HISTOGRAM)
+            key = labels_key(labels)
+            histogram = values.setdefault(key, {'buckets': [0] * len(DEFAULT_BUCKETS), 'sum': 0., 'count': 0})
+            for i, bound in enumerate(DEFAULT_BUCKETS):
+                if value <= bound:
+                    histogram['buckets'][i] += 1
+            histogram['sum'] += value
+            histogram['count'] += 1
+        self.maybe_flush()
+
+    @contextmanager
+    def timer(self, name: str, **labels) -> Iterator[None]:
+        """Observe duration of the block in seconds in histogram name."""
+        start_time = time.time()
+        try:
+            yield
+        finally:
+            self.observe(name, time.time() - start_time, **labels)
+
+    def snapshot(self) -> Dict:
+        with self.lock:
+            return json.loads(json.dumps(self.metrics))
+
+    def snapshot_path(self) -> str:
+        return os.path.join(self.snapshot_dir, '{}.json'.format(socket.gethostname()))
+
+    def maybe_flush(self) -> None:
+        if time.time() - self.last_flush_time >= self.flush_interval_s:
+            self.flush()
+
+    def flush(self) -> None:
+        """Add the registry to the snapshot of the host for the metrics endpoint and reset it."""
+        self.last_flush_time = time.time()
+        with self.lock:
+            pending, self.metrics = self.metrics, {}
+        if not pending:
+            return
+        try:
+            os.makedirs(self.snapshot_dir, exist_ok=True)
+            path = self.snapshot_path()
+            # processes of the host take turns updating its snapshot
+            with open(path + '.lock', 'w') as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                snapshot = {}
+                if os.path.isfile(path):
+                    with open(path) as f:
+                        snapshot = json.load(f)
+                tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+                with open(tmp_path, 'w') as f:
+                    json.dump(merge_snapshots([snapshot, pending], replace_gauges=True), f)
+                os.replace(tmp_path, path)
+        except Exception as e:
+            logger.warning('cannot write metrics snapshot due to "{}"'.format(e))
+            with self.lock:
+                self.metrics = merge_snapshots([pending, self.metrics], replace_gauges=True)
+
+
+def merge_snapshots(snapshots: List[Dict], replace_gauges: bool = False) -> Dict:
+    """Sum counters and histograms of snapshots. Gauges of the same labels are summed too
+    or, with replace_gauges, taken from the last snapshot."""
+    merged = {}
+    for snapshot in snapshots:
+        for name, metric in snapshot.items():
+            merged_metric = merged.setdefault(name, {'type': metric['type'], 'values': {}})
+            for key, value in metric['values'].items():
+                if metric['type'] == HISTOGRAM:
+                    merged_value = merged_metric['values'].setdefault(
+                        key, {'buckets': [0] * len(DEFAULT_BUCKETS), 'sum': 0., 'count': 0})
+                    merged_value['buckets'] = [a + b for a, b in zip(merged_value['buckets'], value['buckets'])]
+                    merged_value['sum'] += value['sum']
+                    merged_value['count'] += value['count']
+                elif metric['type'] == GAUGE and replace_gauges:
+                    merged_metric['values'][key] = value
+                else:
+                    merged_metric['values'][key] = merged_metric['values'].get(key, 0) + value
+    return merged
+
+
+def read_snapshots(snapshot_dir: str = METRICS_DIR, ttl_s: float = METRICS_SNAPSHOT_TTL_S) -> List[Dict]:
+    """Return snapshots of all hosts, removing the expired ones."""
+    snapshots = []
+    if not os.path.isdir(snapshot_dir):
+        return snapshots
+    expiration_time = time.time() - ttl_s
+    for file_name in os.listdir(snapshot_dir):
+        if not file_name.endswith('.json'):
+            continue
+        path = os.path.join(snapshot_dir, file_name)
+        try:
+            if os.path.getmtime(path) < expiration_time:
+                os.remove(path)
+                if os.path.exists(path + '.lock'):
+                    os.remove(path + '.lock')
+                continue
+            with open(path) as f:
+                snapshots.append(json.load(f))
+        except Exception as e:
+            logger.warning('cannot read metrics snapshot {} due to "{}"'.format(path, e))
+    return snapshots
+
+
+def format_labels(labels: List[Tuple[str, str]]) -> str:
+    if not labels:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(
+        k, v.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')) for k, v in labels) + '}'
+
+
+def render_text(metrics: Dict) -> str:
+    """Render metrics in the Prometheus text exposition format."""
+    lines = []
+    for name in sorted(metrics.keys()):
+        metric = metrics[name]
+        lines.append('# TYPE {} {}'.format(name, metric['type']))
+        for key in sorted(metric['values'].keys()):
+            labels = [tuple(label) for label in json.loads(key)]
+            value = metric['values'][key]
+            if metric['type'] == HISTOGRAM:
+                for bound, count in zip(DEFAULT_BUCKETS, value['buckets']):
+                    lines.append('{}_bucket{} {}'.format(name, format_labels(labels + [('le', str(bound))]), count))
+                lines.append('{}_bucket{} {}'.format(name, format_labels(labels + [('le', '+Inf')]), value['count']))
+                lines.append('{}_sum{} {}'.format(name, format_labels(labels), value['sum']))
+                lines.append('{}_count{} {}'.format(name, format_labels(labels), value['count']))
+            else:
+                lines.append('{}{} {}'.format(name, format_labels(labels), value))
+    return '\n'.join(lines) + '\n'
+
+
+registry = MetricsRegistry()
+inc = registry.inc
+set_gauge = registry.set_gauge
+observe = registry.observe
+timer = registry.timer
+flush = registry.flush
@@ -0,0 +1,53 @@
+"""Django middleware of etabotapp."""
+import time
+import uuid
+
+from etabotapp import metrics
+from etabotapp import profiling
+from etabotapp import query_stats
+
+
+class MetricsMiddleware:
+    """Observe latency of every request per view, method and status class."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        start_time = time.time()
+        response = self.get_response(request)
+        resolver_match = getattr(request, 'resolver_match', None)
+        view = resolver_match.view_name if resolver_match is not None else 'unresolved'
+        metrics.observe(
+            'etabot_http_request_seconds', time.time() - start_time,
+            view=view, method=request.method, status='{}xx'.format(response.status_code // 100))
+        return response
+
+
+class ProfilingMiddleware:
+    """Profile requests of staff users with header X-Etabot-Profile: 1.
+
+    The id of the stored profile is returned in header X-Etabot-Profile-Id."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not request.META.get(profiling.PROFILE_HEADER) or not profiling.request_user_is_staff(request):
+            return self.get_response(request)
+        run_id = 'request-{}'.format(uuid.uuid4().hex)
+        with profiling.profiled(run_id, '{} {}'.format(request.method, request.path)):
+            response = self.get_response(request)
+        response[profiling.PROFILE_ID_HEADER] = run_id
+        return response
+
+
+class QueryStatsMiddleware:
+    """Count DB queries of every request and log N+1 patterns and slow queries (see query_stats.py)."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with query_stats.tracked_queries('request', '{} {}'.format(request.method, request.path)):
+            return self.get_response(request)
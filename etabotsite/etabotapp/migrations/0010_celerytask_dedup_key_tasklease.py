@@ -0,0 +1,26 @@
+# Generated by Django 4.2.20 on 2026-10-19 12:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('etabotapp', '0009_auto_20221024_0606'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TaskLease',
+            fields=[
+                ('key', models.CharField(max_length=100, primary_key=True, serialize=False)),
+                ('task_id', models.CharField(max_length=100)),
+                ('expires_at', models.DateTimeField()),
+            ],
+        ),
+        migrations.AddField(
+            model_name='celerytask',
+            name='dedup_key',
+            field=models.CharField(db_index=True, max_length=64, null=True),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.20 on 2026-10-19 12:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('etabotapp', '0010_celerytask_dedup_key_tasklease'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='celerytask',
+            name='queue',
+            field=models.CharField(db_index=True, max_length=100, null=True),
+        ),
+    ]
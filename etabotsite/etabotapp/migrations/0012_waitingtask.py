@@ -0,0 +1,33 @@
+# Generated by Django 4.2.20 on 2026-10-19 12:45
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('etabotapp', '0011_celerytask_queue'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='celerytask',
+            name='status',
+            field=models.CharField(choices=[('PN', 'Pending'), ('CN', 'Canceled'), ('DN', 'Done'), ('FL', 'Failed'), ('WT', 'Waiting for owner quota'), ('X', 'Other')], max_length=100),
+        ),
+        migrations.CreateModel(
+            name='WaitingTask',
+            fields=[
+                ('task_id', models.CharField(max_length=100, primary_key=True, serialize=False)),
+                ('task_name', models.CharField(max_length=100)),
+                ('args', models.JSONField(null=True)),
+                ('kwargs', models.JSONField(null=True)),
+                ('queue', models.CharField(max_length=100, null=True)),
+                ('enqueued_at', models.DateTimeField(db_index=True)),
+                ('owner', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='waitingTasks', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+    ]
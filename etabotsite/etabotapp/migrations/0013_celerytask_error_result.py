@@ -0,0 +1,23 @@
+# Generated by Django 4.2.20 on 2026-10-19 12:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('etabotapp', '0012_waitingtask'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='celerytask',
+            name='error',
+            field=models.TextField(null=True),
+        ),
+        migrations.AddField(
+            model_name='celerytask',
+            name='result',
+            field=models.JSONField(null=True),
+        ),
+    ]
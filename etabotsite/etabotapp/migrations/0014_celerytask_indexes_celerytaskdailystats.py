@@ -0,0 +1,46 @@
+# Generated by Django 4.2.20 on 2026-10-19 12:54
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('etabotapp', '0013_celerytask_error_result'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CeleryTaskDailyStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('task_name', models.CharField(max_length=100)),
+                ('status', models.CharField(max_length=100)),
+                ('count', models.IntegerField(default=0)),
+                ('finished_count', models.IntegerField(default=0)),
+                ('total_duration_s', models.FloatField(default=0)),
+                ('max_duration_s', models.FloatField(default=0)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='celerytask',
+            index=models.Index(fields=['owner', 'start_time'], name='etabotapp_c_owner_i_644a2d_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='celerytask',
+            index=models.Index(fields=['status', 'start_time'], name='etabotapp_c_status_c04a8d_idx'),
+        ),
+        migrations.AddField(
+            model_name='celerytaskdailystats',
+            name='owner',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='celeryTaskDailyStats', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AlterUniqueTogether(
+            name='celerytaskdailystats',
+            unique_together={('date', 'task_name', 'owner', 'status')},
+        ),
+    ]
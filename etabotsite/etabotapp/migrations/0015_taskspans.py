@@ -0,0 +1,23 @@
+# Generated by Django 4.2.20 on 2026-10-19 12:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('etabotapp', '0014_celerytask_indexes_celerytaskdailystats'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TaskSpans',
+            fields=[
+                ('task_id', models.CharField(max_length=100, primary_key=True, serialize=False)),
+                ('parent_task_id', models.CharField(db_index=True, max_length=100, null=True)),
+                ('created', models.DateTimeField(db_index=True)),
+                ('total_s', models.FloatField()),
+                ('spans', models.JSONField()),
+            ],
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 4.2.20 on 2026-10-19 13:02
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('etabotapp', '0015_taskspans'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='JiraApiUsage',
+            fields=[
+                ('task_id', models.CharField(max_length=100, primary_key=True, serialize=False)),
+                ('created', models.DateTimeField(db_index=True)),
+                ('requests', models.IntegerField(default=0)),
+                ('bytes', models.BigIntegerField(default=0)),
+                ('seconds', models.FloatField(default=0)),
+                ('retries', models.IntegerField(default=0)),
+                ('throttled', models.IntegerField(default=0)),
+                ('endpoints', models.JSONField()),
+                ('owner', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='jiraApiUsage', to=settings.AUTH_USER_MODEL)),
+                ('tms', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='jiraApiUsage', to='etabotapp.tms')),
+            ],
+        ),
+    ]
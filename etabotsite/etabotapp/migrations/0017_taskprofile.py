@@ -0,0 +1,24 @@
+# Generated by Django 4.2.20 on 2026-10-19 13:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('etabotapp', '0016_jiraapiusage'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TaskProfile',
+            fields=[
+                ('task_id', models.CharField(max_length=100, primary_key=True, serialize=False)),
+                ('name', models.CharField(max_length=200)),
+                ('created', models.DateTimeField(db_index=True)),
+                ('duration_s', models.FloatField()),
+                ('summary', models.JSONField()),
+                ('stats', models.BinaryField()),
+            ],
+        ),
+    ]
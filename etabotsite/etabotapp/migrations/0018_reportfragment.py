@@ -0,0 +1,21 @@
+# Generated by Django 4.2.20 on 2026-10-19 13:22
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('etabotapp', '0017_taskprofile'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReportFragment',
+            fields=[
+                ('key', models.CharField(max_length=64, primary_key=True, serialize=False)),
+                ('html', models.TextField()),
+                ('last_used', models.DateTimeField(db_index=True)),
+            ],
+        ),
+    ]
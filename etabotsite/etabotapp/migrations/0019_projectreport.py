@@ -0,0 +1,59 @@
+# Generated by Django 4.2.20 on 2026-10-19 13:32
+
+import json
+import zlib
+
+from django.db import migrations, models
+import django.db.models.deletion
+from django.utils import timezone
+
+
+def compress_json(value):
+    return None if value is None else zlib.compress(json.dumps(value).encode('utf-8'))
+
+
+def move_reports_from_project_settings(apps, schema_editor):
+    Project = apps.get_model('etabotapp', 'Project')
+    ProjectReport = apps.get_model('etabotapp', 'ProjectReport')
+    for project in Project.objects.filter(project_settings__isnull=False).iterator():
+        project_settings = project.project_settings
+        if not isinstance(project_settings, dict) or not (
+                'report' in project_settings or 'hierarchical_report' in project_settings):
+            continue
+        project.latest_report = ProjectReport.objects.create(
+            project=project, version=1, created=timezone.now(),
+            full_report=compress_json(project_settings.pop('report', None)),
+            hierarchical_report=compress_json(project_settings.pop('hierarchical_report', None)))
+        project.project_settings = project_settings
+        project.save(update_fields=['latest_report', 'project_settings'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('etabotapp', '0018_reportfragment'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProjectReport',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('version', models.IntegerField()),
+                ('run_id', models.CharField(max_length=100, null=True)),
+                ('created', models.DateTimeField()),
+                ('full_report', models.BinaryField(null=True)),
+                ('hierarchical_report', models.BinaryField(null=True)),
+                ('project', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='reports', to='etabotapp.project')),
+            ],
+            options={
+                'unique_together': {('project', 'version')},
+            },
+        ),
+        migrations.AddField(
+            model_name='project',
+            name='latest_report',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='etabotapp.projectreport'),
+        ),
+        migrations.RunPython(move_reports_from_project_settings, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 4.2.20 on 2026-10-19 13:38
+
+import json
+import zlib
+
+from django.db import migrations, models
+
+
+def fill_report_summaries(apps, schema_editor):
+    ProjectReport = apps.get_model('etabotapp', 'ProjectReport')
+    for project_report in ProjectReport.objects.filter(hierarchical_report__isnull=False).iterator():
+        report_dict = json.loads(zlib.decompress(bytes(project_report.hierarchical_report)).decode('utf-8'))
+        if not isinstance(report_dict, dict):
+            continue
+        project_report.summary = {
+            'project_on_track': report_dict.get('project_on_track'),
+            'due_dates_counts': report_dict.get('due_dates_stats', {}).get('counts', {}),
+            'sprint_counts': report_dict.get('sprint_stats', {}).get('counts', {})}
+        project_report.save(update_fields=['summary'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('etabotapp', '0019_projectreport'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='projectreport',
+            name='summary',
+            field=models.JSONField(null=True),
+        ),
+        migrations.RunPython(fill_report_summaries, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,58 @@
+# Generated by Django 4.2.20 on 2026-10-19 13:52
+
+import gzip
+import hashlib
+import json
+import zlib
+
+from django.db import migrations, models
+
+
+def decompress_json(data):
+    return None if data is None else json.loads(zlib.decompress(bytes(data)).decode('utf-8'))
+
+
+def build_report_payloads(apps, schema_editor):
+    ProjectReport = apps.get_model('etabotapp', 'ProjectReport')
+    for project_report in ProjectReport.objects.all().iterator():
+        payload = gzip.compress(json.dumps({
+            'project': project_report.project_id,
+            'version': project_report.version,
+            'run_id': project_report.run_id,
+            'created': project_report.created.isoformat(),
+            'summary': project_report.summary,
+            'report': decompress_json(project_report.full_report),
+            'hierarchical_report': decompress_json(project_report.hierarchical_report)}).encode('utf-8'))
+        project_report.payload = payload
+        project_report.etag = '{}-{}-{}'.format(
+            project_report.project_id, project_report.version, hashlib.sha1(payload).hexdigest()[:16])
+        project_report.save(update_fields=['payload', 'etag'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('etabotapp', '0020_projectreport_summary'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='projectreport',
+            name='payload',
+            field=models.BinaryField(null=True),
+        ),
+        migrations.AddField(
+            model_name='projectreport',
+            name='etag',
+            field=models.CharField(max_length=100, null=True),
+        ),
+        migrations.RunPython(build_report_payloads, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name='projectreport',
+            name='full_report',
+        ),
+        migrations.RemoveField(
+            model_name='projectreport',
+            name='hierarchical_report',
+        ),
+    ]
@@ -0,0 +1,67 @@
+# Generated by Django 4.2.20 on 2026-10-19 13:58
+
+from collections import deque
+import gzip
+import json
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def index_report_nodes(apps, schema_editor):
+    ProjectReport = apps.get_model('etabotapp', 'ProjectReport')
+    ReportNode = apps.get_model('etabotapp', 'ReportNode')
+    for project_report in ProjectReport.objects.filter(payload__isnull=False).iterator():
+        tree = json.loads(gzip.decompress(bytes(project_report.payload)).decode('utf-8')).get('hierarchical_report')
+        if not isinstance(tree, dict):
+            continue
+        rows = []
+        nodes = deque([(tree, None)])
+        while nodes:
+            node_dict, parent = nodes.popleft()
+            children = node_dict.get('children', [])
+            node = {k: v for k, v in node_dict.items() if k != 'children'}
+            row = ReportNode(
+                project_report=project_report, position=len(rows),
+                parent_position=parent.position if parent is not None else None,
+                entity_uuid=node.get('entity_uuid'), node=node, children=[])
+            rows.append(row)
+            if parent is not None:
+                parent.children.append({
+                    'position': row.position,
+                    'entity_uuid': node.get('entity_uuid'),
+                    'entity_display_name': node.get('entity_display_name'),
+                    'entity_avatars_urls': node.get('entity_avatars_urls'),
+                    'project_on_track': node.get('project_on_track'),
+                    'due_dates_counts': node.get('due_dates_stats', {}).get('counts', {}),
+                    'sprint_counts': node.get('sprint_stats', {}).get('counts', {}),
+                    'children_count': len(children)})
+            nodes.extend((child, row) for child in children)
+        ReportNode.objects.bulk_create(rows, batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('etabotapp', '0021_projectreport_payload'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReportNode',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('position', models.IntegerField()),
+                ('parent_position', models.IntegerField(null=True)),
+                ('entity_uuid', models.CharField(max_length=200, null=True)),
+                ('node', models.JSONField()),
+                ('children', models.JSONField()),
+                ('project_report', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='nodes', to='etabotapp.projectreport')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['project_report', 'entity_uuid'], name='etabotapp_r_project_0723c5_idx')],
+                'unique_together': {('project_report', 'position')},
+            },
+        ),
+        migrations.RunPython(index_report_nodes, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 4.2.20 on 2026-10-19 14:04
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('etabotapp', '0022_reportnode'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DashboardCache',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='dashboardCache', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('generation', models.IntegerField(default=0)),
+                ('data', models.JSONField(null=True)),
+                ('created', models.DateTimeField(null=True)),
+            ],
+        ),
+    ]
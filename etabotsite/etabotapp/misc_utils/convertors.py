@@ -27,3 +27,24 @@ def df_to_dict_for_json(df: pd.DataFrame) -> dict:
     res = df.applymap(value2safejson).to_dict()
     logging.debug(res)
     return res
+
+
+def value2columnar_json(x):
+    """Return JSON safe value of a dataframe cell, dates as ISO strings so that they survive a round trip."""
+    if isinstance(x, (datetime.datetime, datetime.date)):
+        return x.isoformat()
+    if isinstance(x, np.generic):
+        x = x.item()
+    return nan2None(x)
+
+
+def df_to_columns_for_json(df: pd.DataFrame) -> dict:
+    """Encode dataframe column by column: {'index': [...], 'columns': {column: [values]}}."""
+    return {
+        'index': [value2columnar_json(x) for x in df.index],
+        'columns': {str(column): [value2columnar_json(x) for x in df[column]] for column in df.columns}}
+
+
+def columns_to_df(columns_dict: dict) -> pd.DataFrame:
+    """Decode output of df_to_columns_for_json. Dates stay ISO strings."""
+    return pd.DataFrame(columns_dict.get('columns', {}), index=columns_dict.get('index'))
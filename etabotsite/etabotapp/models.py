@@ -15,7 +15,7 @@ print('loaded TMSlib data_conversion, Atlassian_API ')
 
 from django.db import models
 from django.db.models import JSONField
-from django.db.models.signals import post_save, pre_save
+from django.db.models.signals import post_delete, post_save, pre_save
 from django.contrib.auth.models import User
 from rest_framework.authtoken.models import Token
 from django.dispatch import receiver
@@ -125,29 +125,15 @@ def update_oauth_token(name, token, refresh_token=None, access_token=None):
         return
 
     # update old token
-    TMSs = TMS.objects.filter(oauth2_token=item.id)
-    logger.debug('found TMSs with this oauth2 token: {}'.format(TMSs))
-    for tms_instance in TMSs:
-        logger.debug(vars(tms_instance))
-        logger.debug(tms_instance.oauth2_token)        
-        logger.debug(vars(tms_instance.oauth2_token))
     item.access_token = token['access_token']
     item.refresh_token = token.get('refresh_token')
     item.expires_at = token['expires_at']
     logger.info('saving token')
     item.save()
     logger.info('token saved')
-    logger.debug('TMSs after saving token:')
-    for tms_instance in TMSs:
-        logger.debug(vars(tms_instance))
-        logger.debug(tms_instance.oauth2_token)        
-        logger.debug(vars(tms_instance.oauth2_token))
-    TMSs = TMS.objects.filter(oauth2_token=item.id)
-    logger.debug('TMSs after saving token and repeat search:')
-    for tms_instance in TMSs:
-        logger.debug(vars(tms_instance))
-        logger.debug(tms_instance.oauth2_token)
-        logger.debug(vars(tms_instance.oauth2_token))
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug('TMSs with updated oauth2 token: {}'.format(
+            list(TMS.objects.filter(oauth2_token=item.id).values_list('id', flat=True))))
     logger.info('update_oauth_token is done.')
 
 
@@ -212,6 +198,9 @@ class Project(models.Model):
     vacation_days = JSONField()
     velocities = JSONField(null=True)
     project_settings = JSONField(null=True)
+    # reports are stored separately (see report_store.py)
+    latest_report = models.ForeignKey('ProjectReport', null=True, blank=True, related_name='+',
+                                      on_delete=models.SET_NULL)
     # jobs = JSONField(null=True)
 
     def __str__(self):
@@ -233,6 +222,7 @@ class CeleryTask(models.Model):
             ('CN', 'Canceled'),
             ('DN', 'Done'),
             ('FL', 'Failed'),
+            ('WT', 'Waiting for owner quota'),
             ('X', 'Other')
         ], max_length=100
     )
@@ -241,6 +231,159 @@ class CeleryTask(models.Model):
                               on_delete=models.CASCADE)
 
     meta_data = JSONField(null=True)
+    # fingerprint of task name and arguments for coalescing equivalent requests
+    dedup_key = models.CharField(max_length=64, null=True, db_index=True)
+    # celery queue the task was routed to, e.g. interactive or batch
+    queue = models.CharField(max_length=100, null=True, db_index=True)
+    # error with traceback of a failed task and small JSON result of a finished one
+    error = models.TextField(null=True)
+    result = JSONField(null=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['owner', 'start_time']),
+            models.Index(fields=['status', 'start_time']),
+        ]
+
+
+class TaskSpans(models.Model):
+    """Timing spans of the last run of a tracked celery task (columns of TMSlib.spans.SpanRecorder)."""
+    task_id = models.CharField(max_length=100, primary_key=True)
+    parent_task_id = models.CharField(max_length=100, null=True, db_index=True)
+    created = models.DateTimeField(db_index=True)
+    total_s = models.FloatField()
+    spans = JSONField()
+
+
+class TaskProfile(models.Model):
+    """Profile of the last profiled run of a celery task or an API request (see profiling.py)."""
+    task_id = models.CharField(max_length=100, primary_key=True)
+    name = models.CharField(max_length=200)
+    created = models.DateTimeField(db_index=True)
+    duration_s = models.FloatField()
+    summary = JSONField()
+    # zlib compressed pstats data as written by pstats.Stats.dump_stats
+    stats = models.BinaryField()
+
+
+class JiraApiUsage(models.Model):
+    """JIRA API calls of the last run of a tracked celery task for a TMS (columns of JIRA_API.JiraUsage)."""
+    task_id = models.CharField(max_length=100, primary_key=True)
+    owner = models.ForeignKey('auth.User', related_name='jiraApiUsage',
+                              on_delete=models.CASCADE)
+    tms = models.ForeignKey(TMS, related_name='jiraApiUsage', on_delete=models.CASCADE)
+    created = models.DateTimeField(db_index=True)
+    requests = models.IntegerField(default=0)
+    bytes = models.BigIntegerField(default=0)
+    seconds = models.FloatField(default=0)
+    retries = models.IntegerField(default=0)
+    throttled = models.IntegerField(default=0)
+    endpoints = JSONField()
+
+
+class ReportFragment(models.Model):
+    """Rendered report html keyed by hash of its inputs (see report_cache.py)."""
+    key = models.CharField(max_length=64, primary_key=True)
+    html = models.TextField()
+    last_used = models.DateTimeField(db_index=True)
+
+
+class ProjectReport(models.Model):
+    """Reports of a project produced by an estimation run (see report_store.py)."""
+    project = models.ForeignKey(Project, related_name='reports', on_delete=models.CASCADE)
+    version = models.IntegerField()
+    # celery task id of the estimation run
+    run_id = models.CharField(max_length=100, null=True)
+    created = models.DateTimeField()
+    # gzip compressed JSON served by the report API, including the full html report
+    # and HierarchicalReportNode.to_dict (see report_store.report_payload)
+    payload = models.BinaryField(null=True)
+    # strong validator of payload: <project id>-<version>-<hash of payload>
+    etag = models.CharField(max_length=100, null=True)
+    # status and counts of the top level report node for project lists (see report_store.report_summary)
+    summary = JSONField(null=True)
+
+    class Meta:
+        unique_together = ('project', 'version')
+
+
+class ReportNode(models.Model):
+    """Node of a stored hierarchical report for the subtree API (see report_store.report_nodes)."""
+    project_report = models.ForeignKey(ProjectReport, related_name='nodes', on_delete=models.CASCADE)
+    # breadth-first position in the report tree, 0 for the root
+    position = models.IntegerField()
+    parent_position = models.IntegerField(null=True)
+    entity_uuid = models.CharField(max_length=200, null=True)
+    # HierarchicalReportNode.node_dict and summaries of the children
+    node = JSONField()
+    children = JSONField()
+
+    class Meta:
+        unique_together = ('project_report', 'position')
+        indexes = [
+            models.Index(fields=['project_report', 'entity_uuid']),
+        ]
+
+
+class CeleryTaskDailyStats(models.Model):
+    """Daily aggregate of CeleryTask rows removed by the retention purge."""
+    date = models.DateField()
+    task_name = models.CharField(max_length=100)
+    owner = models.ForeignKey('auth.User', related_name='celeryTaskDailyStats',
+                              on_delete=models.CASCADE)
+    status = models.CharField(max_length=100)
+    count = models.IntegerField(default=0)
+    # over tasks with end_time
+    finished_count = models.IntegerField(default=0)
+    total_duration_s = models.FloatField(default=0)
+    max_duration_s = models.FloatField(default=0)
+
+    class Meta:
+        unique_together = ('date', 'task_name', 'owner', 'status')
+
+
+class TaskLease(models.Model):
+    """Exclusive time-limited lease on a shared resource (e.g. a TMS) held by a celery task."""
+    key = models.CharField(max_length=100, primary_key=True)
+    task_id = models.CharField(max_length=100)
+    expires_at = models.DateTimeField()
+
+
+class WaitingTask(models.Model):
+    """Celery task held back until its owner is within the concurrency quota."""
+    task_id = models.CharField(max_length=100, primary_key=True)
+    task_name = models.CharField(max_length=100)
+    owner = models.ForeignKey('auth.User', related_name='waitingTasks',
+                              on_delete=models.CASCADE)
+    args = JSONField(null=True)
+    kwargs = JSONField(null=True)
+    queue = models.CharField(max_length=100, null=True)
+    enqueued_at = models.DateTimeField(db_index=True)
+
+
+class DashboardCache(models.Model):
+    """Dashboard bootstrap data of a user (see dashboard.py), dropped when the user's TMSs, projects or reports change.
+
+    generation is increased by every invalidation, data built before it is not stored."""
+    user = models.OneToOneField('auth.User', primary_key=True, related_name='dashboardCache',
+                                on_delete=models.CASCADE)
+    generation = models.IntegerField(default=0)
+    data = JSONField(null=True)
+    created = models.DateTimeField(null=True)
+
+    @staticmethod
+    def invalidate(user_id) -> None:
+        DashboardCache.objects.filter(user_id=user_id).update(
+            generation=models.F('generation') + 1, data=None, created=None)
+
+
+@receiver(post_save, sender=Project)
+@receiver(post_delete, sender=Project)
+@receiver(post_save, sender=TMS)
+@receiver(post_delete, sender=TMS)
+def invalidate_dashboard_cache(sender, instance=None, **kwargs):
+    DashboardCache.invalidate(instance.owner_id)
+
 
 # This receiver handles token creation immediately a new user is created.
 @receiver(post_save, sender=User)
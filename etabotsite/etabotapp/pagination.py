@@ -0,0 +1,17 @@
+from rest_framework.pagination import CursorPagination
+
+
+class OptionalCursorPagination(CursorPagination):
+    """Cursor pagination by id applied only to requests with ?page_size=<n> or ?cursor=<cursor>.
+
+    Without them the full list is returned as before, so clients expecting plain lists keep working."""
+    ordering = 'id'
+    page_size = 100
+    page_size_query_param = 'page_size'
+    max_page_size = 1000
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if self.page_size_query_param not in request.query_params and \
+                self.cursor_query_param not in request.query_params:
+            return None
+        return super().paginate_queryset(queryset, request, view=view)
@@ -0,0 +1,92 @@
+"""Local checkpoints of estimation pipeline stages.
+
+Intermediate outputs of a pipeline (e.g. status reports, rendered reports) are pickled
+to a local directory keyed by celery task id, so that a retry of the same task
+resumes from the last completed stage instead of repeating the expensive ones.
+"""
+import logging
+import os
+import pickle
+import shutil
+import tempfile
+import time
+
+from django.conf import settings
+
+logger = logging.getLogger('django')
+
+CUSTOM_SETTINGS = getattr(settings, 'CUSTOM_SETTINGS', {})
+CHECKPOINTS_DIR = CUSTOM_SETTINGS.get(
+    'checkpoints_dir', os.path.join(tempfile.gettempdir(), 'etabot_checkpoints'))
+# checkpoints of runs that never completed are purged after this period
+CHECKPOINTS_TTL_S = CUSTOM_SETTINGS.get('checkpoints_ttl_s', 2 * 24 * 3600)
+
+
+class CheckpointStore:
+    """Pickled stage outputs of a single pipeline run."""
+
+    def __init__(self, key: str, root: str = CHECKPOINTS_DIR):
+        self.key = str(key)
+        self.root = root
+        self.path = os.path.join(root, self.key)
+
+    def _stage_path(self, stage: str) -> str:
+        return os.path.join(self.path, '{}.pickle'.format(stage))
+
+    def has(self, stage: str) -> bool:
+        return os.path.isfile(self._stage_path(stage))
+
+    def load(self, stage: str):
+        with open(self._stage_path(stage), 'rb') as f:
+            return pickle.load(f)
+
+    def save(self, stage: str, value) -> bool:
+        """Return True if value was checkpointed. Unpicklable values are skipped."""
+        os.makedirs(self.path, exist_ok=True)
+        tmp_path = self._stage_path(stage) + '.tmp'
+        try:
+            with open(tmp_path, 'wb') as f:
+                pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+        except Exception as e:
+            logger.warning('cannot checkpoint stage "{}" of {} due to "{}"'.format(stage, self.key, e))
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return False
+        os.replace(tmp_path, self._stage_path(stage))
+        return True
+
+    def clear(self) -> None:
+        shutil.rmtree(self.path, ignore_errors=True)
+
+    @staticmethod
+    def purge_expired(root: str = CHECKPOINTS_DIR, ttl_s: float = CHECKPOINTS_TTL_S) -> int:
+        """Remove checkpoints not updated for ttl_s seconds. Return number of removed runs."""
+        if not os.path.isdir(root):
+            return 0
+        removed = 0
+        expiration_time = time.time() - ttl_s
+        for key in os.listdir(root):
+            path = os.path.join(root, key)
+            if os.path.isdir(path) and os.path.getmtime(path) < expiration_time:
+                shutil.rmtree(path, ignore_errors=True)
+                removed += 1
+        return removed
+
+
+def run_stage(checkpoints, stage: str, func, *args, **kwargs):
+    """Return checkpointed output of stage if available, otherwise run func and checkpoint its output.
+
+    checkpoints - CheckpointStore or None to run without checkpointing."""
+    if checkpoints is None:
+        return func(*args, **kwargs)
+    if checkpoints.has(stage):
+        try:
+            result = checkpoints.load(stage)
+            logger.info('resumed stage "{}" from checkpoint {}'.format(stage, checkpoints.key))
+            return result
+        except Exception as e:
+            logger.warning('cannot load checkpoint of stage "{}" for {} due to "{}"'.format(
+                stage, checkpoints.key, e))
+    result = func(*args, **kwargs)
+    checkpoints.save(stage, result)
+    return result
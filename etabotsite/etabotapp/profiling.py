@@ -0,0 +1,134 @@
+"""Opt-in profiling of celery tasks and API requests.
+
+A profiled run executes under cProfile and tracemalloc. Top functions by cumulative
+and own time, top allocation sites and the compressed pstats data of the run are
+stored in TaskProfile under the id of the run (the CeleryTask id for tasks).
+Estimation tasks are profiled with "profile": true in their params, API requests of
+staff users with header "X-Etabot-Profile: 1". Without the flag profiling costs a flag check.
+"""
+import cProfile
+import datetime
+import logging
+import marshal
+import pstats
+import time
+import tracemalloc
+import zlib
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Union
+
+from django.conf import settings
+from rest_framework import exceptions
+from rest_framework.settings import api_settings
+
+from .models import TaskProfile
+
+logger = logging.getLogger('django')
+
+CUSTOM_SETTINGS = getattr(settings, 'CUSTOM_SETTINGS', {})
+PROFILE_TOP_N = CUSTOM_SETTINGS.get('profile_top_n', 30)
+PROFILE_HEADER = 'HTTP_X_ETABOT_PROFILE'
+PROFILE_ID_HEADER = 'X-Etabot-Profile-Id'
+
+
+class RunProfiler:
+    """cProfile and tracemalloc profiler of one run."""
+
+    def __init__(self, top_n: int = PROFILE_TOP_N):
+        self.top_n = top_n
+        self.profiler = cProfile.Profile()
+        self.started_tracemalloc = False
+        self.start_time = None
+        self.duration_s = None
+        self.snapshot = None
+        self.peak_memory_bytes = None
+
+    def start(self) -> None:
+        self.started_tracemalloc = not tracemalloc.is_tracing()
+        if self.started_tracemalloc:
+            tracemalloc.start()
+        self.start_time = time.time()
+        self.profiler.enable()
+
+    def stop(self) -> None:
+        self.profiler.disable()
+        self.duration_s = time.time() - self.start_time
+        self.snapshot = tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, '<frozen importlib._bootstrap>')))
+        self.peak_memory_bytes = tracemalloc.get_traced_memory()[1]
+        if self.started_tracemalloc:
+            tracemalloc.stop()
+
+    def top_functions(self, stats: pstats.Stats, sort_index: int) -> List[Dict]:
+        """Return top_n functions sorted by own (2) or cumulative (3) time."""
+        rows = sorted(stats.stats.items(), key=lambda item: item[1][sort_index], reverse=True)[:self.top_n]
+        return [{
+            'function': pstats.func_std_string(func),
+            'calls': nc,
+            'self_s': round(tt, 4),
+            'cumulative_s': round(ct, 4)} for func, (cc, nc, tt, ct, callers) in rows]
+
+    def top_allocations(self) -> List[Dict]:
+        return [{
+            'site': '{}:{}'.format(stat.traceback[0].filename, stat.traceback[0].lineno),
+            'size_kb': round(stat.size / 1024., 1),
+            'count': stat.count} for stat in self.snapshot.statistics('lineno')[:self.top_n]]
+
+    def summary(self) -> Dict:
+        stats = pstats.Stats(self.profiler)
+        return {
+            'duration_s': round(self.duration_s, 3),
+            'peak_memory_kb': round(self.peak_memory_bytes / 1024., 1),
+            'top_cumulative': self.top_functions(stats, 3),
+            'top_self': self.top_functions(stats, 2),
+            'top_allocations': self.top_allocations()}
+
+    def stats_data(self) -> bytes:
+        """Return compressed pstats data, decompressed it can be loaded with pstats or snakeviz."""
+        return zlib.compress(marshal.dumps(pstats.Stats(self.profiler).stats))
+
+
+def save_profile(run_id: str, name: str, profiler: RunProfiler) -> None:
+    TaskProfile.objects.update_or_create(
+        task_id=run_id,
+        defaults={
+            'name': name[:200],
+            'created': datetime.datetime.now(),
+            'duration_s': profiler.duration_s,
+            'summary': profiler.summary(),
+            'stats': profiler.stats_data()})
+
+
+@contextmanager
+def profiled(run_id: Union[str, None], name: str, enabled: bool = True) -> Iterator[Union[RunProfiler, None]]:
+    """Profile the block and save its profile for run_id, also on failure. Yields None if not enabled."""
+    if not enabled or run_id is None:
+        yield None
+        return
+    profiler = RunProfiler()
+    profiler.start()
+    try:
+        yield profiler
+    finally:
+        profiler.stop()
+        try:
+            save_profile(run_id, name, profiler)
+            logger.info('saved profile of {} "{}" in {:.1f}s'.format(run_id, name, profiler.duration_s))
+        except Exception as e:
+            logger.error('cannot save profile of {} due to "{}"'.format(run_id, e))
+
+
+def request_user_is_staff(request) -> bool:
+    """Return True if request is authenticated by session or by the API authentication as a staff user."""
+    user = getattr(request, 'user', None)
+    if user is not None and user.is_authenticated:
+        return user.is_staff
+    for authentication_class in api_settings.DEFAULT_AUTHENTICATION_CLASSES:
+        try:
+            user_auth = authentication_class().authenticate(request)
+        except exceptions.AuthenticationFailed:
+            return False
+        if user_auth is not None:
+            return user_auth[0].is_staff
+    return False
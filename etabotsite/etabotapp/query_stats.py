@@ -0,0 +1,117 @@
+"""DB query instrumentation of API requests and tracked celery tasks.
+
+Every query executed within tracked_queries is counted with its duration and the
+first etabotapp code line it originates from. At the end of the block the totals
+are logged and exported as metrics; SQL repeated at least N_PLUS_ONE_THRESHOLD
+times (typically a query per row of another query) and slow queries are logged
+as warnings with their origin.
+"""
+import logging
+import os
+import sys
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Tuple
+
+from django.conf import settings
+from django.db import connection
+
+from etabotapp import metrics
+
+logger = logging.getLogger('django')
+
+CUSTOM_SETTINGS = getattr(settings, 'CUSTOM_SETTINGS', {})
+QUERY_STATS_ENABLED = CUSTOM_SETTINGS.get('query_stats_enabled', True)
+# same SQL executed this many times within a request or task is reported as N+1 pattern
+N_PLUS_ONE_THRESHOLD = CUSTOM_SETTINGS.get('query_n_plus_one_threshold', 10)
+SLOW_QUERY_MS = CUSTOM_SETTINGS.get('slow_query_ms', 500)
+# number of the most repeated queries logged
+QUERY_STATS_TOP_N = CUSTOM_SETTINGS.get('query_stats_top_n', 3)
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__)) + os.sep
+SKIPPED_FILES = {os.path.abspath(__file__), os.path.join(APP_DIR, 'middleware.py')}
+
+
+def query_origin() -> str:
+    """Return file:line of the innermost etabotapp frame outside of the instrumentation."""
+    frame = sys._getframe(1)
+    while frame is not None:
+        file_name = frame.f_code.co_filename
+        if file_name.startswith(APP_DIR) and file_name not in SKIPPED_FILES:
+            return '{}:{}'.format(file_name[len(APP_DIR):], frame.f_lineno)
+        frame = frame.f_back
+    return 'unknown'
+
+
+class QueryStats:
+    """Connection execute wrapper counting queries, DB time and repeated SQL."""
+
+    def __init__(self, slow_query_ms: float = SLOW_QUERY_MS):
+        self.slow_query_ms = slow_query_ms
+        self.count = 0
+        self.total_s = 0.
+        self.by_sql = {}  # type: Dict[str, List]
+        self.slow_queries = []  # type: List[Tuple[float, str, str]]
+
+    def __call__(self, execute, sql, params, many, context):
+        start_time = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration_s = time.perf_counter() - start_time
+            self.count += 1
+            self.total_s += duration_s
+            sql_stats = self.by_sql.get(sql)
+            if sql_stats is None:
+                # [count, total seconds, origin of the first execution]
+                self.by_sql[sql] = [1, duration_s, query_origin()]
+            else:
+                sql_stats[0] += 1
+                sql_stats[1] += duration_s
+            if duration_s * 1000 >= self.slow_query_ms:
+                self.slow_queries.append((duration_s, sql, query_origin()))
+
+    @property
+    def duplicates(self) -> int:
+        """Number of queries repeating SQL executed before."""
+        return self.count - len(self.by_sql)
+
+    def repeated(self, threshold: int = N_PLUS_ONE_THRESHOLD) -> List[Tuple[str, int, float, str]]:
+        """Return (sql, count, total seconds, origin) executed at least threshold times, most repeated first."""
+        return sorted(
+            [(sql, count, total_s, origin) for sql, (count, total_s, origin) in self.by_sql.items()
+             if count >= threshold],
+            key=lambda x: x[1], reverse=True)
+
+    def report(self, scope: str, name: str) -> None:
+        """Log totals and offenders of the block and export them as metrics."""
+        metrics.inc('etabot_db_queries_total', self.count, scope=scope)
+        metrics.inc('etabot_db_seconds_total', self.total_s, scope=scope)
+        logger.debug('{} "{}": {} queries ({} duplicate) in {:.3f}s'.format(
+            scope, name, self.count, self.duplicates, self.total_s))
+        repeated = self.repeated()
+        if repeated:
+            metrics.inc('etabot_db_n_plus_one_total', scope=scope)
+        for sql, count, total_s, origin in repeated[:QUERY_STATS_TOP_N]:
+            logger.warning('{} "{}": possible N+1, query repeated {} times ({:.3f}s) from {}: {}'.format(
+                scope, name, count, total_s, origin, sql[:300]))
+        for duration_s, sql, origin in self.slow_queries[:QUERY_STATS_TOP_N]:
+            logger.warning('{} "{}": slow query {:.3f}s from {}: {}'.format(
+                scope, name, duration_s, origin, sql[:300]))
+
+
+@contextmanager
+def tracked_queries(scope: str, name: str) -> Iterator[QueryStats]:
+    """Count queries of the block, e.g. scope "request" or "task", and report them on exit."""
+    if not QUERY_STATS_ENABLED:
+        yield None
+        return
+    stats = QueryStats()
+    try:
+        with connection.execute_wrapper(stats):
+            yield stats
+    finally:
+        try:
+            stats.report(scope, name)
+        except Exception as e:
+            logger.error('cannot report query stats of {} "{}" due to "{}"'.format(scope, name, e))
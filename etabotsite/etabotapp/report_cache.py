@@ -0,0 +1,57 @@
+"""Content-hash cache of rendered report fragments.
+
+basic_report.html and short_report.html of a BasicReport are stored under the hash
+of the report inputs (TMSlib.interface.report_fragment_key), so reports that did not
+change since the previous run are not rendered again. The cache is bounded: the
+least recently used fragments above REPORT_FRAGMENT_CACHE_MAX_ENTRIES are evicted.
+"""
+import logging
+from typing import Dict, List
+
+from django.conf import settings
+from django.utils import timezone
+
+from .models import ReportFragment
+
+logger = logging.getLogger('django')
+
+CUSTOM_SETTINGS = getattr(settings, 'CUSTOM_SETTINGS', {})
+REPORT_FRAGMENT_CACHE_ENABLED = CUSTOM_SETTINGS.get('report_fragment_cache_enabled', True)
+REPORT_FRAGMENT_CACHE_MAX_ENTRIES = CUSTOM_SETTINGS.get('report_fragment_cache_max_entries', 20000)
+
+
+class ReportFragmentCache:
+    """DB backed LRU cache of rendered report html, used by TMSlib.interface.render_reports."""
+
+    def __init__(self, max_entries: int = REPORT_FRAGMENT_CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+
+    def get_many(self, keys: List[str]) -> Dict[str, str]:
+        fragments = dict(ReportFragment.objects.filter(pk__in=keys).values_list('key', 'html'))
+        if fragments:
+            ReportFragment.objects.filter(pk__in=list(fragments.keys())).update(last_used=timezone.now())
+        logger.debug('report fragment cache: {} of {} fragments found'.format(len(fragments), len(keys)))
+        return fragments
+
+    def set_many(self, fragments: Dict[str, str]) -> None:
+        now = timezone.now()
+        ReportFragment.objects.bulk_create(
+            [ReportFragment(key=key, html=html, last_used=now) for key, html in fragments.items()],
+            ignore_conflicts=True)
+        self.evict()
+
+    def evict(self) -> int:
+        """Delete least recently used fragments above max_entries. Return number of deleted fragments."""
+        # fragments of a batch share last_used, so the excess is selected by key and not by a time cutoff
+        stale_keys = list(ReportFragment.objects.order_by('-last_used', 'key').values_list(
+            'key', flat=True)[self.max_entries:])
+        if not stale_keys:
+            return 0
+        deleted, _ = ReportFragment.objects.filter(pk__in=stale_keys).delete()
+        logger.info('evicted {} least recently used report fragments'.format(deleted))
+        return deleted
+
+
+def report_fragment_cache():
+    """Return the fragment cache for render_reports or None if it is disabled."""
+    return ReportFragmentCache() if REPORT_FRAGMENT_CACHE_ENABLED else None
@@ -0,0 +1,275 @@
+"""Versioned store of project reports.
+
+Each estimation run stores the full html report and the hierarchical report of a project
+as a ProjectReport version referenced by Project.latest_report, so the project rows and
+the project list API stay small. Reports are fetched on demand from api/projects/<id>/report/.
+Only the PROJECT_REPORT_VERSIONS latest versions are kept.
+
+The report API document is gzip compressed once when the report is written (payload)
+and served as is with a strong ETag, so unchanged reports are answered with 304.
+Nodes of the hierarchical report are indexed as ReportNode rows with summaries of their
+children, so a report can be explored one node at a time (api/projects/<id>/report/node/).
+"""
+import datetime
+import gzip
+import hashlib
+import json
+import logging
+import zlib
+from collections import deque
+from typing import Dict, List, Union
+
+from django.conf import settings
+from django.http import HttpResponse, JsonResponse
+
+from .models import DashboardCache, Project, ProjectReport, ReportNode
+from etabotapp.TMSlib.interface import HierarchicalReportNode
+
+logger = logging.getLogger('django')
+
+CUSTOM_SETTINGS = getattr(settings, 'CUSTOM_SETTINGS', {})
+PROJECT_REPORT_VERSIONS = CUSTOM_SETTINGS.get('project_report_versions', 3)
+# embed the latest reports in project_settings of the project API like before the store,
+# the UI reads project_settings.report and hierarchical_report from the project list
+EMBED_PROJECT_REPORTS = CUSTOM_SETTINGS.get('embed_project_reports', True)
+# keys of project_settings that used to hold the reports
+REPORT_KEYS = ('report', 'hierarchical_report')
+GZIP_WBITS = zlib.MAX_WBITS | 16
+
+
+class CompressingWriter:
+    """Text file-like object gzip compressing everything written to it."""
+
+    def __init__(self):
+        self.compressor = zlib.compressobj(wbits=GZIP_WBITS)
+        self.chunks = []
+
+    def write(self, s: str) -> None:
+        self.chunks.append(self.compressor.compress(s.encode('utf-8')))
+
+    def getvalue(self) -> bytes:
+        self.chunks.append(self.compressor.flush())
+        return b''.join(self.chunks)
+
+
+def report_payload(
+        project_report: ProjectReport,
+        full_report: Union[str, None],
+        hierarchical_report: Union[HierarchicalReportNode, Dict, None]) -> bytes:
+    """Return gzip compressed JSON document of the report API for project_report."""
+    writer = CompressingWriter()
+    header = json.dumps({
+        'project': project_report.project_id,
+        'version': project_report.version,
+        'run_id': project_report.run_id,
+        'created': project_report.created.isoformat(),
+        'summary': project_report.summary,
+        'report': full_report})
+    writer.write(header[:-1] + ', "hierarchical_report": ')
+    if isinstance(hierarchical_report, HierarchicalReportNode):
+        hierarchical_report.write_json(writer, include_dataframes=True)
+    else:
+        writer.write(json.dumps(hierarchical_report))
+    writer.write('}')
+    return writer.getvalue()
+
+
+def payload_etag(project_report: ProjectReport) -> str:
+    return '{}-{}-{}'.format(
+        project_report.project_id, project_report.version, hashlib.sha1(project_report.payload).hexdigest()[:16])
+
+
+def load_payload(project_report: Union[ProjectReport, None]) -> Dict:
+    """Return the report API document of project_report or {}."""
+    if project_report is None or project_report.payload is None:
+        return {}
+    return json.loads(gzip.decompress(bytes(project_report.payload)).decode('utf-8'))
+
+
+def report_summary(hierarchical_report: HierarchicalReportNode) -> Dict:
+    """Return status and task counts of the top level node of the report tree."""
+    report = hierarchical_report.report
+    return {
+        'project_on_track': report.project_on_track.value,
+        'due_dates_counts': report.due_dates_stats.counts,
+        'sprint_counts': report.sprint_stats.counts}
+
+
+def child_summary(position: int, node_dict: Dict, children_count: int) -> Dict:
+    return {
+        'position': position,
+        'entity_uuid': node_dict.get('entity_uuid'),
+        'entity_display_name': node_dict.get('entity_display_name'),
+        'entity_avatars_urls': node_dict.get('entity_avatars_urls'),
+        'project_on_track': node_dict.get('project_on_track'),
+        'due_dates_counts': node_dict.get('due_dates_stats', {}).get('counts', {}),
+        'sprint_counts': node_dict.get('sprint_stats', {}).get('counts', {}),
+        'children_count': children_count}
+
+
+def report_nodes(project_report: ProjectReport, hierarchical_report: HierarchicalReportNode) -> List[ReportNode]:
+    """Return index rows of the report tree nodes in breadth-first order.
+
+    Nodes are stored like in the payload; nodes that cannot be serialized are skipped with their subtrees."""
+    rows = []
+    nodes = deque([(hierarchical_report, None)])
+    while nodes:
+        node, parent = nodes.popleft()
+        try:
+            node_dict = node.node_dict(include_dataframes=True)
+        except Exception as e:
+            logger.warning('cannot create dict for {}'.format(node))
+            continue
+        row = ReportNode(
+            project_report=project_report, position=len(rows),
+            parent_position=parent.position if parent is not None else None,
+            entity_uuid=node_dict.get('entity_uuid'), node=node_dict, children=[])
+        rows.append(row)
+        if parent is not None:
+            parent.children.append(child_summary(row.position, node_dict, len(node.children)))
+        nodes.extend((child, row) for child in node.children)
+    return rows
+
+
+def index_report_nodes(
+        project_report: ProjectReport,
+        hierarchical_report: Union[HierarchicalReportNode, None],
+        previous: Union[ProjectReport, None]) -> None:
+    """Index nodes of hierarchical_report or, if it is carried over, copy the index of previous version."""
+    if hierarchical_report is not None:
+        ReportNode.objects.filter(project_report=project_report).delete()
+        rows = report_nodes(project_report, hierarchical_report)
+    elif previous is not None and previous.pk != project_report.pk:
+        rows = [ReportNode(project_report=project_report, **values) for values in previous.nodes.values(
+            'position', 'parent_position', 'entity_uuid', 'node', 'children')]
+    else:
+        return
+    ReportNode.objects.bulk_create(rows, batch_size=500)
+
+
+def save_project_report(
+        project: Project,
+        run_id: Union[str, None] = None,
+        full_report: Union[str, None] = None,
+        hierarchical_report: Union[HierarchicalReportNode, None] = None) -> ProjectReport:
+    """Store reports of project as its new latest version.
+
+    Reports of the same run_id (e.g. hierarchical reports of a subset task and the full report of
+    the merge task) update the latest version in place. Reports not given are carried over from
+    the previous version."""
+    tree = hierarchical_report
+    latest = ProjectReport.objects.filter(project=project).order_by('-version').first()
+    if latest is not None and run_id is not None and latest.run_id == run_id:
+        project_report = latest
+    else:
+        project_report = ProjectReport(
+            project=project,
+            version=latest.version + 1 if latest is not None else 1,
+            run_id=run_id,
+            summary=latest.summary if latest is not None else None)
+    if full_report is None or hierarchical_report is None:
+        previous = load_payload(latest)
+        full_report = previous.get('report') if full_report is None else full_report
+        if hierarchical_report is None:
+            hierarchical_report = previous.get('hierarchical_report')
+    if isinstance(hierarchical_report, HierarchicalReportNode):
+        project_report.summary = report_summary(hierarchical_report)
+    project_report.created = datetime.datetime.now()
+    project_report.payload = report_payload(project_report, full_report, hierarchical_report)
+    project_report.etag = payload_etag(project_report)
+    project_report.save()
+    index_report_nodes(project_report, tree, latest)
+    Project.objects.filter(pk=project.pk).update(latest_report=project_report)
+    project.latest_report = project_report
+    DashboardCache.invalidate(project.owner_id)
+    prune_project_reports(project)
+    logger.info('stored report version {} of project {} ({} bytes)'.format(
+        project_report.version, project, len(project_report.payload)))
+    return project_report
+
+
+def prune_project_reports(project: Project, versions: int = PROJECT_REPORT_VERSIONS) -> int:
+    """Delete all but the latest versions of project reports. Return number of deleted versions."""
+    stale_ids = list(ProjectReport.objects.filter(project=project).order_by('-version').values_list(
+        'pk', flat=True)[versions:])
+    if not stale_ids:
+        return 0
+    deleted, _ = ProjectReport.objects.filter(pk__in=stale_ids).delete()
+    return deleted
+
+
+def stored_hierarchical_report(project: Project) -> Union[Dict, None]:
+    """Return to_dict of the latest hierarchical report of project or None."""
+    if project.latest_report_id is None:
+        return None
+    return load_payload(project.latest_report).get('hierarchical_report')
+
+
+def report_settings(project_report: Union[ProjectReport, None]) -> Dict:
+    """Return reports in the former project_settings format: {'report': html, 'hierarchical_report': dict}."""
+    payload = load_payload(project_report)
+    return {key: payload[key] for key in REPORT_KEYS if key in payload}
+
+
+def find_project_report(project: Project, version: Union[int, None] = None) -> Union[ProjectReport, None]:
+    """Return the latest or the given version of project reports without loading its payload."""
+    project_reports = ProjectReport.objects.defer('payload').filter(project=project)
+    if version is None:
+        return project_reports.filter(pk=project.latest_report_id).first()
+    return project_reports.filter(version=version).first()
+
+
+def if_none_match(request, etag: str) -> bool:
+    """Return True if If-None-Match header of request matches the quoted etag."""
+    header = request.META.get('HTTP_IF_NONE_MATCH', '')
+    return header.strip() == '*' or etag in [tag.strip() for tag in header.split(',')]
+
+
+def report_response(request, project_report: ProjectReport) -> HttpResponse:
+    """Serve payload of project_report gzip encoded if the client accepts it, 304 if its ETag matches.
+
+    Encodings have distinct strong ETags."""
+    accepts_gzip = 'gzip' in request.META.get('HTTP_ACCEPT_ENCODING', '')
+    etag = '"{}{}"'.format(project_report.etag, '-gzip' if accepts_gzip else '')
+    if if_none_match(request, etag):
+        response = HttpResponse(status=304)
+    elif accepts_gzip:
+        response = HttpResponse(bytes(project_report.payload), content_type='application/json')
+        response['Content-Encoding'] = 'gzip'
+    else:
+        response = HttpResponse(gzip.decompress(bytes(project_report.payload)), content_type='application/json')
+    response['ETag'] = etag
+    response['Vary'] = 'Accept-Encoding'
+    # reports are private and revalidated on every visit
+    response['Cache-Control'] = 'private, no-cache'
+    return response
+
+
+def report_node_response(
+        request, project_report: ProjectReport, entity_uuid: Union[str, None] = None,
+        position: Union[int, None] = None) -> HttpResponse:
+    """Serve a node of the report tree with summaries of its children instead of their subtrees.
+
+    The node is found by breadth-first position or as the first node of entity_uuid, the root by default."""
+    nodes = ReportNode.objects.filter(project_report=project_report)
+    if position is not None:
+        nodes = nodes.filter(position=position)
+    elif entity_uuid is not None:
+        nodes = nodes.filter(entity_uuid=entity_uuid)
+    else:
+        nodes = nodes.filter(position=0)
+    etag_suffix = nodes.order_by('position').values_list('position', flat=True).first()
+    if etag_suffix is None:
+        return JsonResponse({'error': 'no report node {}'.format(
+            entity_uuid if position is None else position)}, status=404)
+    etag = '"{}-n{}"'.format(project_report.etag, etag_suffix)
+    if if_none_match(request, etag):
+        response = HttpResponse(status=304)
+    else:
+        row = nodes.get(position=etag_suffix)
+        response = JsonResponse(dict(
+            row.node, children=row.children, position=row.position, parent_position=row.parent_position,
+            version=project_report.version))
+    response['ETag'] = etag
+    response['Cache-Control'] = 'private, no-cache'
+    return response
@@ -5,18 +5,58 @@ from django.contrib.auth.models import User
 
 from .constants import PROJECTS_AVAILABLE
 from .models import Project, TMS
+from .report_store import REPORT_KEYS, report_settings
 from .models import oauth
 from django.conf import settings
 import logging
 import etabotapp.TMSlib.TMS as TMSlib
 from etabotapp.TMSlib.JIRA_API import update_available_projects_for_TMS
 from copy import copy
+from typing import Dict, List, Set, Union
 import etabotapp.response_regex as rr
 
 LOCAL_MODE = getattr(settings, "LOCAL_MODE", False)
 logger = logging.getLogger('django')
 
 
+def requested_fields(request) -> Union[Set[str], None]:
+    """Return field names of ?fields=<name>,<name> of the request or None for all fields."""
+    if request is None or not request.query_params.get('fields'):
+        return None
+    return {name.strip() for name in request.query_params['fields'].split(',') if name.strip()}
+
+
+class SparseFieldsMixin:
+    """Serializer of only the fields requested with ?fields= in GET requests.
+
+    values_sources maps field names to lookups of queryset.values() so that list endpoints
+    can serialize the same fields without building model instances (values_rows, values_data)."""
+    values_sources = {}
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        request = self.context.get('request')
+        fields = requested_fields(request) if request is not None and request.method == 'GET' else None
+        if fields is not None:
+            for name in set(self.fields) - fields:
+                self.fields.pop(name)
+
+    @classmethod
+    def values_fields(cls, fields: Union[Set[str], None] = None) -> List[str]:
+        return [name for name in cls.values_sources if fields is None or name in fields]
+
+    @classmethod
+    def values_rows(cls, queryset, fields: Union[Set[str], None] = None):
+        """Return queryset.values() with the lookups of fields and id, which cursor pagination needs."""
+        lookups = [cls.values_sources[name] for name in cls.values_fields(fields)]
+        return queryset.values(*lookups, *(['id'] if 'id' not in lookups else []))
+
+    @classmethod
+    def values_data(cls, rows, fields: Union[Set[str], None] = None) -> List[Dict]:
+        names = cls.values_fields(fields)
+        return [{name: row[cls.values_sources[name]] for name in names} for row in rows]
+
+
 class UserSerializer(serializers.ModelSerializer):
     """Serializer to map the Model instance into JSON format."""
     email_validators = []
@@ -83,11 +123,21 @@ class OAuth2TokenSerializer(serializers.ModelSerializer):
 #     #     return user
 
 
-class TMSSerializer(serializers.ModelSerializer):
+class TMSSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     """Serializer to map the model instance into json format."""
     owner = serializers.ReadOnlyField(source='owner.username')
     connectivity_status = serializers.JSONField()
     logger.debug('TMSSerializer owner: {}'.format(owner))
+    values_sources = {
+        'id': 'id',
+        'owner': 'owner__username',
+        'endpoint': 'endpoint',
+        'username': 'username',
+        'password': 'password',
+        'type': 'type',
+        'params': 'params',
+        'name': 'name',
+        'connectivity_status': 'connectivity_status'}
 
     class Meta:
         """Map this serializer to a model and their fields."""
@@ -196,13 +246,29 @@ hello@etabot.ai')
         logger.info('validate_Atlassian_API_key finished.')
 
 
-class ProjectSerializer(serializers.ModelSerializer):
+class ProjectSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     """Serializer to map the model instance into json format."""
     owner = serializers.ReadOnlyField(source='owner.username')
     work_hours = serializers.JSONField()
     vacation_days = serializers.JSONField()
     velocities = serializers.JSONField()
     project_settings = serializers.JSONField()
+    # status and task counts of the latest report (see report_store.report_summary)
+    report_summary = serializers.SerializerMethodField()
+    values_sources = {
+        'id': 'id',
+        'project_tms': 'project_tms_id',
+        'name': 'name',
+        'owner': 'owner__username',
+        'mode': 'mode',
+        'open_status': 'open_status',
+        'grace_period': 'grace_period',
+        'work_hours': 'work_hours',
+        'vacation_days': 'vacation_days',
+        'velocities': 'velocities',
+        'project_settings': 'project_settings',
+        'latest_report': 'latest_report_id',
+        'report_summary': 'latest_report__summary'}
 
     class Meta:
         """Map this serializer to a model and their fields."""
@@ -218,5 +284,24 @@ class ProjectSerializer(serializers.ModelSerializer):
             'work_hours',
             'vacation_days',
             'velocities',
-            'project_settings')
+            'project_settings',
+            'latest_report',
+            'report_summary')
+        read_only_fields = ('latest_report',)
         # read_only_fields = ('mode', 'name')
+
+    def get_report_summary(self, instance):
+        return instance.latest_report.summary if instance.latest_report_id is not None else None
+
+    def validate_project_settings(self, value):
+        """Reports are written by estimations to the report store only."""
+        if isinstance(value, dict):
+            value = {k: v for k, v in value.items() if k not in REPORT_KEYS}
+        return value
+
+    def to_representation(self, instance):
+        """Latest reports are embedded in project_settings only with context embed_reports."""
+        data = super().to_representation(instance)
+        if self.context.get('embed_reports') and isinstance(data.get('project_settings'), dict):
+            data['project_settings'] = dict(data['project_settings'], **report_settings(instance.latest_report))
+        return data
@@ -18,8 +18,15 @@ from etabotapp import django_tasks as dt
 from etabotapp import celery_tracking as ct
 from django.conf import settings
 import logging
-from etabotapp.models import CeleryTask
-from unittest.mock import MagicMock
+from etabotapp.models import CeleryTask, CeleryTaskDailyStats, TaskProfile, WaitingTask
+from etabotapp import profiling
+from unittest.mock import MagicMock, patch
+import datetime
+import os
+import pstats
+import pytz
+import tempfile
+import zlib
 
 test_tms_data = getattr(settings, "TEST_TMS_DATA", {})
 
@@ -93,3 +100,242 @@ class TestCeleryTasks(TestCase):
         self.assertEqual(objects_in_db[0].meta_data, meta_data)
 
         # todo: add tests for populating end_time when the tasks are done
+
+    def test_send_celery_task_with_tracking_coalesces_pending_tasks(self):
+        """Ensure equivalent pending tasks are coalesced and finished ones are not."""
+        args = (self.tms.id, [self.project.id], {})
+        first = ct.send_celery_task_with_tracking(
+            'etabotapp.django_tasks.estimate_ETA_for_TMS_project_set_ids',
+            args, owner=self.tms.owner, coalesce=True)
+        second = ct.send_celery_task_with_tracking(
+            'etabotapp.django_tasks.estimate_ETA_for_TMS_project_set_ids',
+            args, owner=self.tms.owner, coalesce=True)
+        self.assertEqual(first.task_id, second.task_id)
+        self.assertEqual(CeleryTask.objects.count(), 1)
+
+        other_params = ct.send_celery_task_with_tracking(
+            'etabotapp.django_tasks.estimate_ETA_for_TMS_project_set_ids',
+            (self.tms.id, [self.project.id], {'push_updates_to_tms': True}), owner=self.tms.owner, coalesce=True)
+        self.assertNotEqual(first.task_id, other_params.task_id)
+
+        CeleryTask.objects.filter(pk=first.task_id).update(status='DN')
+        third = ct.send_celery_task_with_tracking(
+            'etabotapp.django_tasks.estimate_ETA_for_TMS_project_set_ids',
+            args, owner=self.tms.owner, coalesce=True)
+        self.assertNotEqual(first.task_id, third.task_id)
+
+    def test_tms_lease_is_exclusive(self):
+        """Ensure a TMS lease cannot be acquired by another task until released or expired."""
+        with ct.tms_lease(self.tms.id, 'task_a'):
+            with self.assertRaises(ct.LeaseNotAcquired):
+                with ct.tms_lease(self.tms.id, 'task_b'):
+                    pass
+        with ct.tms_lease(self.tms.id, 'task_b'):
+            pass
+        self.assertTrue(ct.acquire_lease(ct.tms_lease_key(self.tms.id), 'task_c', ttl_s=-1))
+        self.assertTrue(ct.acquire_lease(ct.tms_lease_key(self.tms.id), 'task_d'))
+
+    def test_estimate_due_dispatches_each_tms_once_per_day(self):
+        """Ensure the staggered dispatcher submits a due TMS once and skips it on the next tick."""
+        # projects without a time zone use the default offset: due at 7am - 2h lead time in GMT-8
+        now = datetime.datetime(2020, 1, 15, 13, 30, tzinfo=pytz.utc)
+        with patch('etabotapp.django_tasks.timezone.now', return_value=now):
+            self.assertEqual(dt.estimate_due(), 1)
+            record = CeleryTask.objects.get(task_name=dt.ESTIMATE_TASK_NAME)
+            self.assertEqual(record.meta_data, {'tms_id': self.tms.id})
+            self.assertEqual(record.queue, ct.BATCH_QUEUE)
+            self.assertEqual(dt.estimate_due(), 0)
+
+    def test_queue_depths_per_queue(self):
+        """Ensure the queue of a tracked task is recorded and pending tasks are counted per queue."""
+        ct.send_celery_task_with_tracking(
+            'etabotapp.django_tasks.parse_projects_for_tms_id',
+            (self.tms.id, {}), owner=self.tms.owner, queue=ct.INTERACTIVE_QUEUE)
+        ct.send_celery_task_with_tracking(
+            'etabotapp.django_tasks.parse_projects_for_tms_id',
+            (self.tms.id, {'other': 1}), owner=self.tms.owner, queue=ct.INTERACTIVE_QUEUE)
+        dt.send_estimate_for_tms(self.tms, [self.project.id], {})
+        depths = ct.queue_depths()
+        self.assertEqual(depths[ct.INTERACTIVE_QUEUE]['pending'], 2)
+        self.assertEqual(depths[ct.BATCH_QUEUE]['pending'], 1)
+
+    def test_owner_quota_holds_back_excess_tasks(self):
+        """Ensure tasks above the owner quota wait and are sent once the owner's tasks finish."""
+        other_user = User.objects.create_user('otheruser', 'otheruser@example.com', 'testpassword')
+        name = 'etabotapp.django_tasks.parse_projects_for_tms_id'
+        with patch.object(ct, 'TENANT_CONCURRENCY_QUOTA', 1):
+            first = ct.send_celery_task_with_tracking(name, (self.tms.id, {}), owner=self.user)
+            second = ct.send_celery_task_with_tracking(name, (self.tms.id, {'a': 1}), owner=self.user, coalesce=True)
+            other = ct.send_celery_task_with_tracking(name, (self.tms.id, {}), owner=other_user)
+            self.assertEqual(CeleryTask.objects.get(pk=first.task_id).status, 'PN')
+            self.assertEqual(CeleryTask.objects.get(pk=second.task_id).status, 'WT')
+            self.assertEqual(CeleryTask.objects.get(pk=other.task_id).status, 'PN')
+            self.assertEqual(ct.queue_depths()['default']['waiting'], 1)
+            coalesced = ct.send_celery_task_with_tracking(
+                name, (self.tms.id, {'a': 1}), owner=self.user, coalesce=True)
+            self.assertEqual(coalesced.task_id, second.task_id)
+
+            self.assertEqual(ct.dispatch_waiting_tasks(), 0)
+            CeleryTask.objects.filter(pk=first.task_id).update(status='DN')
+            self.assertEqual(ct.dispatch_waiting_tasks(), 1)
+            self.assertEqual(CeleryTask.objects.get(pk=second.task_id).status, 'PN')
+            self.assertFalse(WaitingTask.objects.exists())
+
+    def test_task_progress_is_throttled_and_reported_in_status(self):
+        """Ensure progress is written to the tracking record at throttled intervals and served as status."""
+        result = ct.send_celery_task_with_tracking(
+            'etabotapp.django_tasks.estimate_ETA_for_TMS_project_set_ids',
+            (self.tms.id, [self.project.id], {}), owner=self.user, meta_data={'tms_id': self.tms.id})
+        progress = ct.TaskProgress(result.task_id, min_interval_s=3600)
+        progress.stage('fetching_issues', projects_total=2)
+        progress.add_issues(50, total=200)
+        record = CeleryTask.objects.get(pk=result.task_id)
+        self.assertEqual(record.meta_data['progress']['issues_fetched'], 0)
+        self.assertEqual(record.meta_data['tms_id'], self.tms.id)
+        progress.stage('saving')
+        progress.project_done()
+        row = ct.task_status_rows([result.task_id])[result.task_id]
+        status_dict = ct.task_status_dict(result.task_id, row)
+        self.assertEqual(status_dict[result.task_id], 'PENDING')
+        self.assertEqual(status_dict['progress']['stage'], 'saving')
+        self.assertEqual(status_dict['progress']['issues_fetched'], 50)
+        self.assertEqual(status_dict['progress']['issues_total'], 200)
+
+    def test_wait_for_task_statuses_returns_when_any_task_is_finished(self):
+        """Ensure batch statuses are reported per task id and the long-poll returns once a task is finished."""
+        name = 'etabotapp.django_tasks.parse_projects_for_tms_id'
+        first = ct.send_celery_task_with_tracking(name, (self.tms.id, {}), owner=self.user)
+        second = ct.send_celery_task_with_tracking(name, (self.tms.id, {'a': 1}), owner=self.user)
+        task_ids = [first.task_id, second.task_id, 'unknown_id']
+        statuses = ct.wait_for_task_statuses(task_ids, owner=self.user, wait_s=0.2, interval_s=0.05)
+        self.assertEqual(statuses[first.task_id][first.task_id], 'PENDING')
+        self.assertEqual(statuses['unknown_id']['unknown_id'], 'UNKNOWN')
+
+        CeleryTask.objects.filter(pk=second.task_id).update(status='DN')
+        with patch.object(ct.time, 'sleep') as sleep:
+            statuses = ct.wait_for_task_statuses(task_ids, owner=self.user, wait_s=10)
+            sleep.assert_not_called()
+        self.assertEqual(statuses[second.task_id][second.task_id], 'SUCCESS')
+        other_user = User.objects.create_user('otheruser', 'otheruser@example.com', 'testpassword')
+        statuses = ct.wait_for_task_statuses(task_ids, owner=other_user)
+        self.assertEqual(statuses[second.task_id][second.task_id], 'UNKNOWN')
+
+    def test_celery_task_update_stores_status_error_and_result(self):
+        """Ensure task completion is tracked with a single UPDATE including error or small result."""
+        @ct.celery_task_update
+        def succeeding_task(task_id=None):
+            return {'projects': 2}
+
+        @ct.celery_task_update
+        def failing_task(task_id=None):
+            raise NameError('Simulating failure')
+
+        name = 'etabotapp.django_tasks.parse_projects_for_tms_id'
+        first = ct.send_celery_task_with_tracking(name, (self.tms.id, {}), owner=self.user)
+        second = ct.send_celery_task_with_tracking(name, (self.tms.id, {'a': 1}), owner=self.user)
+        # UPDATE of the record and lookup of waiting tasks of its owner
+        with self.assertNumQueries(2):
+            succeeding_task(task_id=first.task_id)
+        failing_task(task_id=second.task_id)
+        statuses = ct.wait_for_task_statuses([first.task_id, second.task_id])
+        self.assertEqual(statuses[first.task_id][first.task_id], 'SUCCESS')
+        self.assertEqual(statuses[first.task_id]['{}_result'.format(first.task_id)], "{'projects': 2}")
+        self.assertEqual(statuses[second.task_id][second.task_id], 'FAILURE')
+        self.assertIn('Simulating failure', statuses[second.task_id]['{}_result'.format(second.task_id)])
+
+    def test_split_estimation_is_pending_until_merged(self):
+        """Ensure a split estimation is finished by its merge task, as done or failed."""
+        project = Project.objects.create(
+            owner=self.user, project_tms=self.tms, name='Second', mode='scrum', open_status='ToDo',
+            grace_period=24, work_hours={}, vacation_days=[], project_settings={})
+        projects_ids = [self.project.id, project.id]
+        for failed, merge_error, status in [
+                (0, None, 'DN'), (1, None, 'FL'), (0, NameError('Simulating failure'), 'FL')]:
+            parent = dt.send_estimate_for_tms(self.tms, projects_ids, {'projects_per_subtask': 1})
+            with patch.object(dt, 'send_celery_chord_with_tracking', return_value=MagicMock(task_id='merge')):
+                result = dt.estimate_ETA_for_TMS_project_set_ids(
+                    self.tms.id, projects_ids, {'projects_per_subtask': 1}, task_id=parent.task_id)
+            self.assertEqual(result, 'merge')
+            self.assertEqual(CeleryTask.objects.get(pk=parent.task_id).status, 'PN')
+            with patch.object(et, 'merge_partial_estimates', return_value=failed, side_effect=merge_error):
+                dt.merge_estimates_for_TMS(
+                    [None, None], self.tms.id, projects_ids, 'chord_of_{}'.format(parent.task_id),
+                    parent_task_id=parent.task_id)
+            record = CeleryTask.objects.get(pk=parent.task_id)
+            self.assertEqual(record.status, status)
+            self.assertIsNotNone(record.end_time)
+            if failed:
+                self.assertIn('1 of 2 subtasks failed', record.error)
+        self.assertIn('Simulating failure', record.error)
+
+    def test_compact_celery_tasks_into_daily_stats(self):
+        """Ensure records older than the retention window are aggregated per day and deleted."""
+        name = 'etabotapp.django_tasks.parse_projects_for_tms_id'
+        old_time = datetime.datetime(2020, 1, 1, 10, 0)
+        for i in range(3):
+            result = ct.send_celery_task_with_tracking(name, (self.tms.id, {'i': i}), owner=self.user)
+            CeleryTask.objects.filter(pk=result.task_id).update(
+                start_time=old_time, end_time=old_time + datetime.timedelta(seconds=10 * (i + 1)), status='DN')
+        recent = ct.send_celery_task_with_tracking(name, (self.tms.id, {}), owner=self.user)
+        waiting = ct.send_celery_task_with_tracking(name, (self.tms.id, {'waiting': 1}), owner=self.user)
+        CeleryTask.objects.filter(pk=waiting.task_id).update(start_time=old_time, status='WT')
+
+        self.assertEqual(ct.compact_celery_tasks(retention_days=30, now=datetime.datetime(2020, 3, 1)), 3)
+        # unfinished tasks are kept
+        self.assertEqual(
+            set(CeleryTask.objects.values_list('task_id', flat=True)), {recent.task_id, waiting.task_id})
+        stats = CeleryTaskDailyStats.objects.get()
+        self.assertEqual((stats.date, stats.task_name, stats.status), (old_time.date(), name, 'DN'))
+        self.assertEqual(stats.count, 3)
+        self.assertEqual(stats.total_duration_s, 60)
+        self.assertEqual(stats.max_duration_s, 30)
+
+    def test_recorded_spans_are_saved_per_run(self):
+        """Ensure spans of a run are saved for the task, also on failure, and queried with child tasks."""
+        with ct.recorded_spans('parent_task', 'estimate_all') as spans:
+            with spans.span('dispatch') as dispatch_span:
+                dispatch_span.add(tms=1)
+        try:
+            with ct.recorded_spans('child_task', 'estimate_ETA_for_TMS', parent_task_id='parent_task') as spans:
+                with spans.span('jql'):
+                    raise NameError('Simulating failure')
+        except NameError:
+            pass
+        task_spans = ct.get_task_spans('parent_task')
+        self.assertEqual(set(task_spans.keys()), {'parent_task', 'child_task'})
+        self.assertEqual([s['name'] for s in task_spans['child_task']['spans']], ['estimate_ETA_for_TMS', 'jql'])
+        self.assertEqual(task_spans['parent_task']['spans'][1]['counters'], {'tms': 1})
+
+    def test_jira_usage_is_accumulated_per_run_and_aggregated_per_tenant(self):
+        """Ensure JIRA API usage of retried runs adds up and is aggregated per owner and TMS."""
+        for attempt in range(2):
+            with ct.recorded_jira_usage('usage_task', self.tms) as usage:
+                usage.add('search', 200, 1000, 0.5)
+                usage.add('search', 429, 10, 0.1)
+        with ct.recorded_jira_usage('other_task', self.tms) as usage:
+            usage.add('agile/board', 200, 100, 0.2)
+        with ct.recorded_jira_usage('idle_task', self.tms):
+            pass
+        usage_rows = ct.jira_usage_by_tenant(owner=self.user)
+        self.assertEqual(len(usage_rows), 1)
+        self.assertEqual(usage_rows[0]['runs'], 2)
+        self.assertEqual(usage_rows[0]['requests'], 5)
+        self.assertEqual(usage_rows[0]['bytes'], 2120)
+        self.assertEqual(usage_rows[0]['throttled'], 2)
+        self.assertEqual(usage_rows[0]['retries'], 2)
+
+    def test_profiled_run_is_saved_only_when_enabled(self):
+        """Ensure a profiled run stores top functions, allocation sites and loadable pstats data."""
+        with profiling.profiled('plain_task', 'estimate', enabled=False) as profiler:
+            self.assertIsNone(profiler)
+        self.assertFalse(TaskProfile.objects.filter(pk='plain_task').exists())
+        with profiling.profiled('profiled_task', 'estimate'):
+            data = [str(i) * 10 for i in range(10000)]
+        profile = TaskProfile.objects.get(pk='profiled_task')
+        self.assertGreater(len(profile.summary['top_cumulative']), 0)
+        self.assertGreater(len(profile.summary['top_allocations']), 0)
+        self.assertEqual(len(data), 10000)
+        stats_path = os.path.join(tempfile.mkdtemp(), 'profiled_task.prof')
+        with open(stats_path, 'wb') as f:
+            f.write(zlib.decompress(bytes(profile.stats)))
+        self.assertGreater(pstats.Stats(stats_path).total_calls, 0)
@@ -0,0 +1,78 @@
+"""test suite for change_detection.py."""
+
+import datetime
+from email.mime.image import MIMEImage
+from unittest.mock import MagicMock
+
+from django.contrib.auth.models import User
+from django.test import TestCase
+
+from etabotapp import change_detection
+from etabotapp import email_reports, eta_tasks
+from etabotapp.models import Project, TMS
+from etabotapp.report_store import save_project_report
+from etabotapp.TMSlib.interface import BasicReport, HierarchicalReportNode
+
+
+class TestChangeDetection(TestCase):
+    """Test suite for change_detection.py."""
+
+    def setUp(self):
+        self.user = User.objects.create_user('testuser', 'testuser@example.com', 'testpassword')
+        self.tms = TMS.objects.create(owner=self.user, endpoint='https://tms.example.com', type='JI')
+        self.now = datetime.datetime(2020, 1, 15, 12, 0)
+        self.projects = [
+            Project.objects.create(
+                owner=self.user, project_tms=self.tms, name=name, mode='scrum', open_status='ToDo',
+                grace_period=24, work_hours={}, vacation_days=[], project_settings=project_settings)
+            for name, project_settings in [
+                ('Quiet', {'report_date': '2020-01-14 12:00:00.000000'}),
+                ('Busy', {'report_date': '2020-01-14 12:00:00.000000'}),
+                ('New', {}),
+                ('Stale', {'report_date': '2019-12-01 12:00:00.000000'})]]
+        for project in self.projects:
+            if project.name != 'New':
+                save_project_report(
+                    project, hierarchical_report=HierarchicalReportNode(BasicReport.empty_report('Quiet'), 'entity'))
+
+    def test_split_unchanged_projects(self):
+        tms_wrapper = MagicMock()
+        tms_wrapper.count_issues_updated_recently.side_effect = lambda name, minutes: 3 if name == 'Busy' else 0
+        logs = []
+        changed, cached_reports = change_detection.split_unchanged_projects(
+            tms_wrapper, self.projects, logs, now=self.now)
+        self.assertEqual([p.name for p in changed], ['Busy', 'New', 'Stale'])
+        self.assertEqual(list(cached_reports.keys()), ['Quiet'])
+        self.assertIsInstance(cached_reports['Quiet'], HierarchicalReportNode)
+        tms_wrapper.count_issues_updated_recently.assert_any_call(
+            'Quiet', 24 * 60 + change_detection.CHANGE_DETECTION_MARGIN_MIN)
+        self.assertEqual(tms_wrapper.count_issues_updated_recently.call_count, 2)
+
+    def test_reused_report_keeps_report_date_until_max_age(self):
+        quiet = self.projects[0]
+        tms_wrapper = MagicMock()
+        tms_wrapper.count_issues_updated_recently.return_value = 0
+        _, cached_reports = change_detection.split_unchanged_projects(tms_wrapper, [quiet], [], now=self.now)
+        eta_tasks.save_project_reports([quiet], '<p>full</p>', cached_reports, run_id='run')
+        quiet.refresh_from_db()
+        self.assertEqual(quiet.project_settings['report_date'], '2020-01-14 12:00:00.000000')
+        self.assertEqual(quiet.reports.count(), 2)
+        # without updates the project is recomputed once its report is too old
+        later = self.now + datetime.timedelta(days=change_detection.MAX_REPORT_AGE_DAYS)
+        changed, cached_reports = change_detection.split_unchanged_projects(tms_wrapper, [quiet], [], now=later)
+        self.assertEqual((changed, cached_reports), ([quiet], {}))
+
+    def test_reused_report_email_has_no_charts(self):
+        fresh = HierarchicalReportNode(BasicReport.empty_report('Busy'), 'entity')
+        fresh.report.velocity_report.images_for_email = {'chart': MIMEImage(b'GIF89a', 'gif')}
+        email_report, _ = email_reports.EmailReportProcess.render_html_reports(self.user, fresh.all_reports())
+        self.assertIn('cid:chart', email_report)
+        tms_wrapper = MagicMock()
+        tms_wrapper.count_issues_updated_recently.return_value = 0
+        _, cached_reports = change_detection.split_unchanged_projects(
+            tms_wrapper, [self.projects[0]], [], now=self.now)
+        # charts of reused reports are neither referenced nor attached
+        email_report, _ = email_reports.EmailReportProcess.render_html_reports(
+            self.user, cached_reports['Quiet'].all_reports())
+        self.assertNotIn('cid:', email_report)
+        self.assertEqual(eta_tasks.collect_email_images(cached_reports), [])
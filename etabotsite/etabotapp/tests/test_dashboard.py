@@ -0,0 +1,67 @@
+"""test suite for dashboard.py."""
+
+from unittest.mock import patch
+
+from django.contrib.auth.models import User
+from django.test import TestCase
+
+from etabotapp import dashboard
+from etabotapp.models import DashboardCache, Project, TMS
+from etabotapp.report_store import save_project_report
+from etabotapp.TMSlib.interface import BasicReport, DueAlert, HierarchicalReportNode
+
+
+class TestDashboard(TestCase):
+    """Test suite for dashboard.py."""
+
+    def setUp(self):
+        self.user = User.objects.create_user('testuser', 'testuser@example.com', 'testpassword')
+        other_user = User.objects.create_user('other', 'other@example.com', 'testpassword')
+        self.tms = TMS.objects.create(
+            owner=self.user, endpoint='https://tms.example.com', type='JI', name='jira',
+            connectivity_status={'status': 'connected', 'description': 'ok'})
+        TMS.objects.create(owner=other_user, endpoint='https://other.example.com', type='JI')
+        self.projects = [
+            Project.objects.create(
+                owner=self.user, project_tms=self.tms, name=name, mode='scrum', open_status='ToDo',
+                grace_period=24, work_hours={}, vacation_days=[], project_settings={'report_date': '2020-01-14'})
+            for name in ['A', 'B']]
+        save_project_report(
+            self.projects[0], hierarchical_report=HierarchicalReportNode(BasicReport.empty_report('A'), 'entity'))
+
+    def test_build_dashboard(self):
+        with self.assertNumQueries(2):
+            data = dashboard.build_dashboard(self.user)
+        self.assertEqual(data['tms'], [{
+            'id': self.tms.pk, 'name': 'jira', 'endpoint': 'https://tms.example.com', 'type': 'JI',
+            'status': 'connected', 'status_description': 'ok'}])
+        self.assertEqual([p['name'] for p in data['projects']], ['A', 'B'])
+        report = data['projects'][0]['report']
+        self.assertEqual(report['project_on_track'], DueAlert.unknown.value)
+        self.assertEqual((report['version'], report['report_date']), (1, '2020-01-14'))
+        self.assertIsNone(data['projects'][1]['report'])
+
+    def test_cache_until_invalidated(self):
+        data = dashboard.get_dashboard(self.user)
+        with self.assertNumQueries(1):
+            self.assertEqual(dashboard.get_dashboard(self.user), data)
+        # a new report invalidates the cache
+        save_project_report(self.projects[1], full_report='<p>B</p>')
+        self.assertIsNone(DashboardCache.objects.get(user=self.user).data)
+        self.assertEqual(dashboard.get_dashboard(self.user)['projects'][1]['report']['version'], 1)
+        # so does an edit
+        self.projects[0].name = 'A2'
+        self.projects[0].save()
+        self.assertEqual(dashboard.get_dashboard(self.user)['projects'][0]['name'], 'A2')
+
+    def test_invalidated_while_building_is_not_stored(self):
+        build_dashboard = dashboard.build_dashboard
+
+        def build_and_invalidate(user):
+            data = build_dashboard(user)
+            DashboardCache.invalidate(user.pk)
+            return data
+
+        with patch.object(dashboard, 'build_dashboard', side_effect=build_and_invalidate):
+            dashboard.get_dashboard(self.user)
+        self.assertIsNone(DashboardCache.objects.get(user=self.user).data)
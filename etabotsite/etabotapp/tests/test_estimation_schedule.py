@@ -0,0 +1,53 @@
+"""test suite for estimation_schedule.py."""
+
+import datetime
+import unittest
+
+from etabotapp import estimation_schedule
+
+
+class TestEstimationSchedule(unittest.TestCase):
+    """Test suite for estimation_schedule.py."""
+
+    def test_parse_utc_offset_hours(self):
+        self.assertEqual(estimation_schedule.parse_utc_offset_hours('GMT +8'), 8)
+        self.assertEqual(estimation_schedule.parse_utc_offset_hours('UTC-05:30'), -5.5)
+        self.assertEqual(estimation_schedule.parse_utc_offset_hours('GMT'), 0)
+        self.assertEqual(estimation_schedule.parse_utc_offset_hours(
+            'America/Los_Angeles', now=datetime.datetime(2020, 1, 15)), -8)
+        self.assertIsNone(estimation_schedule.parse_utc_offset_hours('Mars/Olympus'))
+        self.assertIsNone(estimation_schedule.parse_utc_offset_hours(None))
+
+    def test_tms_utc_offset_hours(self):
+        self.assertEqual(estimation_schedule.tms_utc_offset_hours(
+            [{'Time Zone': 'GMT -7'}, {'Time Zone': 'GMT +3'}, {}]), 3)
+        self.assertEqual(
+            estimation_schedule.tms_utc_offset_hours([{'Time Zone': 'unknown'}, None]),
+            estimation_schedule.DEFAULT_UTC_OFFSET_H)
+
+    def test_last_scheduled_time(self):
+        now = datetime.datetime(2020, 1, 15, 12, 0)
+        # 7am local report in GMT+8 with 2h lead time starts at 21:00 UTC of previous day
+        self.assertEqual(
+            estimation_schedule.last_scheduled_time(now, 8, report_local_hour=7, lead_time_h=2),
+            datetime.datetime(2020, 1, 14, 21, 0))
+        self.assertEqual(
+            estimation_schedule.last_scheduled_time(now, -5, report_local_hour=7, lead_time_h=2),
+            datetime.datetime(2020, 1, 15, 10, 0))
+
+    def test_select_due(self):
+        now = datetime.datetime(2020, 1, 15, 12, 0)
+        candidates = [
+            ('dispatched_today', 0, datetime.datetime(2020, 1, 15, 6, 0)),
+            ('due_recently', -5, None),
+            ('due_earlier', 0, datetime.datetime(2020, 1, 14, 5, 0)),
+            ('not_due_yet', -12, datetime.datetime(2020, 1, 14, 20, 0)),
+        ]
+        self.assertEqual(
+            estimation_schedule.select_due(now, candidates, in_flight=0, max_concurrent=10),
+            ['due_earlier', 'due_recently'])
+        self.assertEqual(
+            estimation_schedule.select_due(now, candidates, in_flight=9, max_concurrent=10),
+            ['due_earlier'])
+        self.assertEqual(
+            estimation_schedule.select_due(now, candidates, in_flight=10, max_concurrent=10), [])
@@ -6,12 +6,18 @@ Authors: Chad Lewis, Alex Radnaev
 date created: 2020-03-10
 """
 import json
+import smtplib
+import tempfile
+from unittest.mock import patch
 
+import celery as clry
 from django.test import TestCase
 from django.contrib.auth.models import User
 
-from etabotapp.TMSlib.interface import HierarchicalReportNode
-from etabotapp.models import Project, TMS
+from etabotapp.TMSlib.interface import BasicReport, HierarchicalReportNode
+from etabotapp.pipeline_checkpoints import CheckpointStore
+from etabotapp.models import Project, TMS, CeleryTask
+from etabotapp.report_store import report_settings
 from etabotapp import eta_tasks as et
 from etabotapp import django_tasks as dt
 from django.conf import settings
@@ -62,14 +68,45 @@ class TestEmailNotificationsTestCases(TestCase):
             include_future_sprints=True,
             include_backlog=True,
             pickle_df=False)
-        # If we make it here with no exits, assert a pass.
-        self.assertEqual(1, 1)
+        # per-TMS estimation is dispatched as a tracked celery task
+        self.assertEqual(
+            CeleryTask.objects.filter(task_name=dt.ESTIMATE_TASK_NAME, owner=self.user).count(), 1)
 
     def test_estimate_ETA_for_TMS(self):
         assert isinstance(self.project, Project)
         assert isinstance(self.project.project_settings, dict)
         et.estimate_ETA_for_TMS(self.tms, [self.project])
 
+    def test_estimate_ETA_for_TMS_partial_and_merge(self):
+        partial = et.estimate_ETA_for_TMS_partial(self.tms, [self.project], run_id='run')
+        # partial results are passed between celery tasks as json
+        partial = json.loads(json.dumps(partial))
+        self.assertTrue(len(partial['reports']) > 0)
+        et.merge_partial_estimates(self.tms, [self.project], [partial, None], run_id='run')
+        self.project.refresh_from_db()
+        self.assertTrue('report_date' in self.project.project_settings)
+        # the partial and the merge of the same run share one report version
+        reports = report_settings(self.project.latest_report)
+        self.assertIsInstance(reports['report'], str)
+        self.assertIsInstance(reports['hierarchical_report'], dict)
+        self.assertEqual(self.project.reports.count(), 1)
+
+    def test_merge_skips_projects_of_failed_partial(self):
+        """Ensure projects of a failed subset keep their report and report_date."""
+        failed_project = Project.objects.create(
+            owner=self.user, project_tms=self.tms, name='Failed', mode='scrum', open_status='ToDo',
+            grace_period=24, work_hours={}, vacation_days=[], project_settings={'report_date': 'yesterday'})
+        partial = json.loads(json.dumps(et.estimate_ETA_for_TMS_partial(self.tms, [self.project])))
+        with patch.object(et.email_reports.EmailReportProcess, 'send_email') as send_email:
+            failed = et.merge_partial_estimates(self.tms, [self.project, failed_project], [partial, None])
+        self.assertEqual(failed, 1)
+        send_email.assert_called_once()
+        self.project.refresh_from_db()
+        failed_project.refresh_from_db()
+        self.assertTrue('report_date' in self.project.project_settings)
+        self.assertEqual(failed_project.project_settings, {'report_date': 'yesterday'})
+        self.assertIsNone(failed_project.latest_report)
+
 
 class TestStoreReportDateInProjectSettings(TestCase):
     """Test for report date generation."""
@@ -110,8 +147,56 @@ class TestStoreReportDateInProjectSettings(TestCase):
         self.assertTrue('report_date' in self.project.project_settings)
         # Check if report_date is of type str
         self.assertTrue(isinstance(self.project.project_settings['report_date'], str))
-        self.assertTrue('hierarchical_report' in self.project.project_settings)
-        hierarchical_report = self.project.project_settings['hierarchical_report']
+        # reports are stored outside of project_settings
+        self.assertTrue('hierarchical_report' not in self.project.project_settings)
+        hierarchical_report = report_settings(self.project.latest_report)['hierarchical_report']
         self.assertTrue(isinstance(hierarchical_report, dict))
         hierarchical_report_json = json.dumps(hierarchical_report)
         assert isinstance(hierarchical_report_json, str)
+
+
+class TestEstimateRetries(TestCase):
+    """Test for saving reports and retrying estimations on email and other failures."""
+    def setUp(self):
+        self.user = User.objects.create_user('testuser', 'testuser@example.com', 'testpassword')
+        self.tms = TMS.objects.create(owner=self.user, endpoint='https://tms.example.com', type='JI')
+        self.project = Project.objects.create(
+            owner=self.user, project_tms=self.tms, name='Test', mode='scrum', open_status='ToDo',
+            grace_period=24, work_hours={}, vacation_days=[], project_settings={})
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+        raw_status_reports = {'Test': HierarchicalReportNode(BasicReport.empty_report('Test'), 'entity')}
+        for name, value in [
+                ('generate_status_reports_with_logs', (raw_status_reports, [])),
+                ('render_reports_for_email', ('<p>email</p>', '<p>full</p>', []))]:
+            patcher = patch.object(et, name, return_value=value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_reports_are_saved_before_email(self):
+        checkpoints = CheckpointStore('run', root=self.tmp_dir.name)
+        with patch.object(et, 'send_report_email', side_effect=smtplib.SMTPServerDisconnected('down')):
+            with self.assertRaises(smtplib.SMTPException):
+                et.estimate_ETA_for_TMS(self.tms, [self.project], checkpoints=checkpoints, run_id='run')
+        self.project.refresh_from_db()
+        self.assertIn('report_date', self.project.project_settings)
+        self.assertEqual(report_settings(self.project.latest_report)['report'], '<p>full</p>')
+        # the retry only sends the email
+        with patch.object(et, 'send_report_email') as send_report_email, \
+                patch.object(et, 'save_project_reports') as save_project_reports:
+            et.estimate_ETA_for_TMS(self.tms, [self.project], checkpoints=checkpoints, run_id='run')
+        send_report_email.assert_called_once()
+        save_project_reports.assert_not_called()
+        self.assertFalse(checkpoints.has('saving'))
+
+    def test_only_transient_errors_are_retried(self):
+        task = dt.estimate_ETA_for_TMS_project_set_ids
+        for error, retried in [(smtplib.SMTPServerDisconnected('down'), True), (ValueError('bug'), False)]:
+            with patch.object(et, 'estimate_ETA_for_TMS', side_effect=error), \
+                    patch.object(task, 'retry', side_effect=clry.exceptions.Retry()) as retry:
+                if retried:
+                    with self.assertRaises(clry.exceptions.Retry):
+                        task(self.tms.id, [self.project.id], {}, task_id='task_{}'.format(retried))
+                else:
+                    task(self.tms.id, [self.project.id], {}, task_id='task_{}'.format(retried))
+            self.assertEqual(retry.called, retried)
@@ -0,0 +1,63 @@
+"""test suite for sparse fieldsets, values() lists and pagination of the projects and TMS APIs."""
+
+import json
+
+from django.contrib.auth.models import User
+from django.test import TestCase
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+from etabotapp.models import Project, TMS
+from etabotapp.pagination import OptionalCursorPagination
+from etabotapp.report_store import save_project_report
+from etabotapp.serializers import ProjectSerializer, TMSSerializer
+from etabotapp.TMSlib.interface import BasicReport, DueAlert, HierarchicalReportNode
+
+
+class TestListSerialization(TestCase):
+    """Test suite for SparseFieldsMixin and OptionalCursorPagination."""
+
+    def setUp(self):
+        self.user = User.objects.create_user('testuser', 'testuser@example.com', 'testpassword')
+        self.tms = TMS.objects.create(
+            owner=self.user, endpoint='https://tms.example.com', type='JI', username='u', password='p',
+            params={'a': 1}, connectivity_status={'status': 'connected'})
+        for i in range(5):
+            Project.objects.create(
+                owner=self.user, project_tms=self.tms, name='P{}'.format(i), mode='scrum', open_status='ToDo',
+                grace_period=24, work_hours={'1': [10, 14]}, vacation_days=[], velocities={},
+                project_settings={'report_date': '2020-01-14'})
+        save_project_report(
+            Project.objects.get(name='P0'),
+            hierarchical_report=HierarchicalReportNode(BasicReport.empty_report('P0'), 'entity'))
+        self.factory = APIRequestFactory()
+
+    def request(self, query=''):
+        return Request(self.factory.get('/api/projects/' + query))
+
+    def test_values_data_matches_serializer(self):
+        for serializer_class, queryset in [
+                (ProjectSerializer, Project.objects.order_by('id')), (TMSSerializer, TMS.objects.order_by('id'))]:
+            expected = serializer_class(queryset, many=True).data
+            data = serializer_class.values_data(serializer_class.values_rows(queryset))
+            self.assertEqual(json.loads(json.dumps(data)), json.loads(json.dumps(expected)))
+        self.assertEqual(data[0]['connectivity_status'], {'status': 'connected'})
+
+    def test_sparse_fields(self):
+        request = self.request('?fields=id,name,report_summary')
+        data = ProjectSerializer(Project.objects.order_by('id'), many=True, context={'request': request}).data
+        self.assertEqual(list(data[0].keys()), ['id', 'name', 'report_summary'])
+        self.assertEqual(data[0]['report_summary']['project_on_track'], DueAlert.unknown.value)
+        fields = {'name'}
+        rows = ProjectSerializer.values_rows(Project.objects.order_by('id'), fields)
+        self.assertEqual(ProjectSerializer.values_data(rows, fields)[1], {'name': 'P1'})
+
+    def test_optional_cursor_pagination(self):
+        rows = ProjectSerializer.values_rows(Project.objects.all(), {'name'})
+        paginator = OptionalCursorPagination()
+        self.assertIsNone(paginator.paginate_queryset(rows, self.request()))
+        page = paginator.paginate_queryset(rows, self.request('?page_size=2'))
+        self.assertEqual([row['name'] for row in page], ['P0', 'P1'])
+        next_link = paginator.get_next_link()
+        page = paginator.paginate_queryset(rows, self.request('?' + next_link.split('?')[1]))
+        self.assertEqual([row['name'] for row in page], ['P2', 'P3'])
@@ -0,0 +1,71 @@
+"""test suite for metrics.py."""
+
+import multiprocessing
+import os
+import shutil
+import tempfile
+import unittest
+
+from etabotapp import metrics
+from etabotapp.TMSlib.JIRA_API import jira_endpoint_class
+
+
+class TestMetrics(unittest.TestCase):
+    """Test suite for metrics.py."""
+
+    def setUp(self):
+        self.snapshot_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.snapshot_dir)
+
+    def test_merge_and_render(self):
+        registry = metrics.MetricsRegistry(snapshot_dir=self.snapshot_dir, flush_interval_s=3600)
+        registry.inc('requests_total', endpoint='search')
+        registry.inc('requests_total', 2, endpoint='search')
+        registry.observe('request_seconds', 0.3, endpoint='search')
+        registry.flush()
+        # metrics since the last flush
+        registry.inc('requests_total', 3, endpoint='search')
+        registry.observe('request_seconds', 0.3, endpoint='search')
+        other = registry.snapshot()
+        merged = metrics.merge_snapshots(metrics.read_snapshots(self.snapshot_dir) + [other])
+        self.assertEqual(merged['requests_total']['values'][metrics.labels_key({'endpoint': 'search'})], 6)
+        text = metrics.render_text(merged)
+        self.assertIn('# TYPE requests_total counter', text)
+        self.assertIn('requests_total{endpoint="search"} 6', text)
+        self.assertIn('request_seconds_bucket{endpoint="search",le="0.25"} 0', text)
+        self.assertIn('request_seconds_bucket{endpoint="search",le="0.5"} 2', text)
+        self.assertIn('request_seconds_count{endpoint="search"} 2', text)
+
+    def test_read_snapshots_removes_expired(self):
+        registry = metrics.MetricsRegistry(snapshot_dir=self.snapshot_dir)
+        registry.inc('requests_total')
+        registry.flush()
+        self.assertEqual(len(metrics.read_snapshots(self.snapshot_dir)), 1)
+        self.assertEqual(metrics.read_snapshots(self.snapshot_dir, ttl_s=-1), [])
+        self.assertEqual(metrics.read_snapshots(self.snapshot_dir), [])
+
+    def test_short_lived_processes_add_up_in_one_snapshot(self):
+        def task_process():
+            registry = metrics.MetricsRegistry(snapshot_dir=self.snapshot_dir, flush_interval_s=3600)
+            registry.inc('tasks_total', task='dispatch_waiting')
+            registry.observe('task_seconds', 0.3)
+            registry.flush()
+
+        context = multiprocessing.get_context('fork')
+        for _ in range(5):
+            processes = [context.Process(target=task_process) for _ in range(8)]
+            for process in processes:
+                process.start()
+            for process in processes:
+                process.join()
+        self.assertEqual([f for f in os.listdir(self.snapshot_dir) if f.endswith('.json')], [
+            '{}.json'.format(metrics.socket.gethostname())])
+        merged = metrics.merge_snapshots(metrics.read_snapshots(self.snapshot_dir))
+        self.assertEqual(merged['tasks_total']['values'][metrics.labels_key({'task': 'dispatch_waiting'})], 40)
+        self.assertEqual(merged['task_seconds']['values'][metrics.labels_key({})]['count'], 40)
+
+    def test_jira_endpoint_class(self):
+        self.assertEqual(jira_endpoint_class('https://x.atlassian.net/rest/api/2/search?jql=a'), 'search')
+        self.assertEqual(jira_endpoint_class('https://x.atlassian.net/rest/agile/1.0/board/12/sprint'), 'agile/board')
@@ -0,0 +1,51 @@
+"""test suite for pipeline_checkpoints.py."""
+
+import os
+import tempfile
+import threading
+import unittest
+
+from etabotapp.pipeline_checkpoints import CheckpointStore, run_stage
+
+
+class TestPipelineCheckpoints(unittest.TestCase):
+    """Test suite for pipeline_checkpoints.py."""
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.checkpoints = CheckpointStore('test_task_id', root=self.tmp_dir.name)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_save_load_clear(self):
+        self.assertFalse(self.checkpoints.has('stage'))
+        self.assertTrue(self.checkpoints.save('stage', {'a': [1, 2]}))
+        self.assertTrue(self.checkpoints.has('stage'))
+        self.assertEqual(self.checkpoints.load('stage'), {'a': [1, 2]})
+        self.checkpoints.clear()
+        self.assertFalse(self.checkpoints.has('stage'))
+
+    def test_unpicklable_value_is_not_checkpointed(self):
+        self.assertFalse(self.checkpoints.save('stage', threading.Lock()))
+        self.assertFalse(self.checkpoints.has('stage'))
+
+    def test_run_stage_resumes_from_checkpoint(self):
+        calls = []
+
+        def expensive_stage(x):
+            calls.append(x)
+            return x * 2
+
+        self.assertEqual(run_stage(self.checkpoints, 'stage', expensive_stage, 2), 4)
+        self.assertEqual(run_stage(self.checkpoints, 'stage', expensive_stage, 2), 4)
+        self.assertEqual(calls, [2])
+        self.assertEqual(run_stage(None, 'stage', expensive_stage, 3), 6)
+        self.assertEqual(calls, [2, 3])
+
+    def test_purge_expired(self):
+        self.checkpoints.save('stage', 1)
+        self.assertEqual(CheckpointStore.purge_expired(root=self.tmp_dir.name, ttl_s=3600), 0)
+        os.utime(self.checkpoints.path, (0, 0))
+        self.assertEqual(CheckpointStore.purge_expired(root=self.tmp_dir.name, ttl_s=3600), 1)
+        self.assertFalse(self.checkpoints.has('stage'))
@@ -0,0 +1,37 @@
+"""test suite for query_stats.py."""
+
+from django.contrib.auth.models import User
+from django.test import TestCase
+
+from etabotapp import query_stats
+from etabotapp.django_tasks import get_tms_by_id
+from etabotapp.models import TMS
+
+
+class TestQueryStats(TestCase):
+    """Test suite for query_stats.py."""
+
+    def setUp(self):
+        self.user = User.objects.create_user('testuser', 'testuser@example.com', 'testpassword')
+        self.tms_ids = [
+            TMS.objects.create(owner=self.user, endpoint='https://tms{}.example.com'.format(i), type='JI').pk
+            for i in range(3)]
+
+    def test_repeated_queries_are_reported_with_origin(self):
+        with self.assertLogs('django', level='WARNING') as logs:
+            with query_stats.tracked_queries('task', 'n_plus_one') as stats:
+                for tms in TMS.objects.filter(pk__in=self.tms_ids):
+                    for i in range(4):
+                        User.objects.filter(pk=tms.owner_id).first()
+        self.assertEqual(stats.count, 13)
+        self.assertEqual(stats.duplicates, 11)
+        sql, count, total_s, origin = stats.repeated(threshold=10)[0]
+        self.assertEqual(count, 12)
+        self.assertTrue(origin.startswith('tests/test_query_stats.py:'))
+        self.assertIn('possible N+1', logs.output[0])
+
+    def test_get_tms_by_id_uses_single_query(self):
+        with self.assertNumQueries(1):
+            tms = get_tms_by_id(self.tms_ids[0])
+            self.assertEqual(tms.owner.username, 'testuser')
+        self.assertIsNone(get_tms_by_id(-1))
@@ -0,0 +1,49 @@
+"""test suite for report_cache.py."""
+
+import datetime
+from unittest.mock import patch
+
+from django.test import TestCase
+from django.utils import timezone
+
+from etabotapp.models import ReportFragment
+from etabotapp.report_cache import ReportFragmentCache
+from etabotapp.TMSlib.interface import BasicReport, render_reports
+
+
+class TestReportCache(TestCase):
+    """Test suite for report_cache.py."""
+
+    def test_unchanged_reports_are_not_rendered_again(self):
+        cache = ReportFragmentCache(max_entries=10)
+        first = BasicReport.empty_report('Test')
+        render_reports([first], cache=cache)
+        self.assertEqual(ReportFragment.objects.count(), 2)
+        second = BasicReport.empty_report('Test')
+        with patch('django.template.backends.django.Template.render') as render:
+            render_reports([second], cache=cache)
+        render.assert_not_called()
+        self.assertEqual(second.html, first.html)
+        self.assertEqual(second.short_html, first.short_html)
+        changed = BasicReport.empty_report('Other')
+        render_reports([changed], cache=cache)
+        self.assertIn('Other', changed.short_html)
+        self.assertEqual(ReportFragment.objects.count(), 4)
+
+    def test_least_recently_used_fragments_are_evicted(self):
+        cache = ReportFragmentCache(max_entries=2)
+        now = timezone.now()
+        ReportFragment.objects.bulk_create([
+            ReportFragment(key='k{}'.format(i), html='', last_used=now - datetime.timedelta(hours=i))
+            for i in range(4)])
+        cache.get_many(['k3'])
+        self.assertEqual(cache.evict(), 2)
+        self.assertEqual(set(ReportFragment.objects.values_list('key', flat=True)), {'k0', 'k3'})
+
+    def test_batch_over_limit_keeps_max_entries(self):
+        cache = ReportFragmentCache(max_entries=2)
+        cache.set_many({'a': '<p>a</p>', 'b': '<p>b</p>', 'c': '<p>c</p>'})
+        self.assertEqual(ReportFragment.objects.count(), 2)
+        cache.set_many({'d': '<p>d</p>'})
+        self.assertEqual(ReportFragment.objects.count(), 2)
+        self.assertIn('d', cache.get_many(['a', 'b', 'c', 'd']))
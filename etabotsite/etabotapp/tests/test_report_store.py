@@ -0,0 +1,123 @@
+"""test suite for report_store.py."""
+
+import gzip
+import json
+
+from django.contrib.auth.models import User
+from django.test import RequestFactory, TestCase
+
+from etabotapp import report_store
+from etabotapp.models import Project, ProjectReport, TMS
+from etabotapp.serializers import ProjectSerializer
+from etabotapp.TMSlib.interface import BasicReport, HierarchicalReportNode
+
+
+class TestReportStore(TestCase):
+    """Test suite for report_store.py."""
+
+    def setUp(self):
+        self.user = User.objects.create_user('testuser', 'testuser@example.com', 'testpassword')
+        self.tms = TMS.objects.create(owner=self.user, endpoint='https://tms.example.com', type='JI')
+        self.project = Project.objects.create(
+            owner=self.user, project_tms=self.tms, name='Test', mode='scrum', open_status='ToDo',
+            grace_period=24, work_hours={}, vacation_days=[], project_settings={'report_date': '2020-01-14'})
+        self.tree = HierarchicalReportNode(BasicReport.empty_report('Test'), 'entity')
+
+    def test_versions_of_runs(self):
+        report_store.save_project_report(self.project, run_id='run1', hierarchical_report=self.tree)
+        first = report_store.save_project_report(self.project, run_id='run1', full_report='<p>1</p>')
+        self.assertEqual(first.version, 1)
+        second = report_store.save_project_report(self.project, run_id='run2', hierarchical_report=self.tree)
+        self.assertEqual(second.version, 2)
+        self.project.refresh_from_db()
+        self.assertEqual(self.project.latest_report_id, second.pk)
+        reports = report_store.report_settings(self.project.latest_report)
+        # the full report of the previous run is carried over
+        self.assertEqual(reports['report'], '<p>1</p>')
+        self.assertEqual(
+            reports['hierarchical_report'], self.tree.to_dict(include_dataframes=True))
+        self.assertIn('Test', reports['hierarchical_report']['html'])
+        self.assertTrue(len(second.payload) < len(str(reports['hierarchical_report'])))
+        self.assertEqual(report_store.load_payload(second)['version'], 2)
+
+    def test_prune_old_versions(self):
+        for i in range(report_store.PROJECT_REPORT_VERSIONS + 2):
+            report_store.save_project_report(self.project, run_id=str(i), full_report=str(i))
+        self.assertEqual(
+            list(ProjectReport.objects.filter(project=self.project).order_by('version').values_list(
+                'version', flat=True)),
+            list(range(3, report_store.PROJECT_REPORT_VERSIONS + 3)))
+
+    def test_serializer_embeds_reports_on_demand(self):
+        report_store.save_project_report(self.project, full_report='<p>1</p>', hierarchical_report=self.tree)
+        self.project.refresh_from_db()
+        data = ProjectSerializer(self.project).data
+        self.assertEqual(data['project_settings'], {'report_date': '2020-01-14'})
+        self.assertEqual(data['latest_report'], self.project.latest_report_id)
+        data = ProjectSerializer(self.project, context={'embed_reports': True}).data
+        self.assertEqual(data['project_settings']['report'], '<p>1</p>')
+        serializer = ProjectSerializer(
+            self.project, data={'project_settings': {'report': 'stale', 'x': 1}}, partial=True)
+        self.assertTrue(serializer.is_valid())
+        self.assertEqual(serializer.validated_data['project_settings'], {'x': 1})
+
+    def test_report_response_conditional_get(self):
+        report_store.save_project_report(self.project, run_id='run1', full_report='<p>1</p>')
+        project_report = report_store.find_project_report(self.project)
+        factory = RequestFactory()
+        response = report_store.report_response(
+            factory.get('/', HTTP_ACCEPT_ENCODING='gzip, deflate'), project_report)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(json.loads(gzip.decompress(response.content))['report'], '<p>1</p>')
+        etag = response['ETag']
+        response = report_store.report_response(
+            factory.get('/', HTTP_ACCEPT_ENCODING='gzip', HTTP_IF_NONE_MATCH=etag), project_report)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b'')
+        # identity encoding has its own etag
+        response = report_store.report_response(factory.get('/', HTTP_IF_NONE_MATCH=etag), project_report)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.content)['version'], 1)
+        # the same run updates the version in place with a new etag
+        report_store.save_project_report(self.project, run_id='run1', hierarchical_report=self.tree)
+        project_report = report_store.find_project_report(self.project)
+        self.assertEqual(project_report.version, 1)
+        response = report_store.report_response(
+            factory.get('/', HTTP_ACCEPT_ENCODING='gzip', HTTP_IF_NONE_MATCH=etag), project_report)
+        self.assertEqual(response.status_code, 200)
+
+    def test_report_nodes(self):
+        for name in ['a', 'b']:
+            child = HierarchicalReportNode(BasicReport.empty_report(name), name)
+            child.report.entity_uuid = name
+            child.add_child(HierarchicalReportNode(BasicReport.empty_report(name + '1'), name + '1'))
+            child.children[0].report.entity_uuid = name + '1'
+            self.tree.add_child(child)
+        report_store.save_project_report(self.project, run_id='run1', hierarchical_report=self.tree)
+        project_report = report_store.find_project_report(self.project)
+        factory = RequestFactory()
+        response = report_store.report_node_response(factory.get('/'), project_report)
+        root = json.loads(response.content)
+        self.assertEqual(root['position'], 0)
+        self.assertEqual([c['entity_uuid'] for c in root['children']], ['a', 'b'])
+        self.assertEqual(root['children'][1]['children_count'], 1)
+        response = report_store.report_node_response(factory.get('/'), project_report, entity_uuid='b1')
+        node = json.loads(response.content)
+        self.assertEqual((node['position'], node['parent_position'], node['children']), (4, 2, []))
+        self.assertIn('b1', node['html'])
+        # nodes are stored as in the full report
+        payload_tree = report_store.load_payload(project_report)['hierarchical_report']
+        payload_node = payload_tree['children'][1]['children'][0]
+        self.assertEqual({k: v for k, v in node.items() if k not in ('position', 'parent_position', 'version')},
+                         payload_node)
+        response = report_store.report_node_response(
+            factory.get('/', HTTP_IF_NONE_MATCH=response['ETag']), project_report, entity_uuid='b1')
+        self.assertEqual(response.status_code, 304)
+        response = report_store.report_node_response(factory.get('/'), project_report, entity_uuid='missing')
+        self.assertEqual(response.status_code, 404)
+        # a version carrying over the hierarchical report keeps its index
+        report_store.save_project_report(self.project, run_id='run2', full_report='<p>2</p>')
+        project_report = report_store.find_project_report(self.project)
+        self.assertEqual(project_report.version, 2)
+        self.assertEqual(project_report.nodes.count(), 5)
@@ -344,6 +344,21 @@ class UserCommunicationViewTestCase(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
 
 
+class CeleryTaskStatusViewTestCase(APITestCase):
+    """Test suite for celery task status view."""
+
+    def setUp(self):
+        """Define and authenticate test client."""
+        self.client = APIClient()
+        self.client.force_authenticate(user=create_test_user())
+
+    def test_api_reports_unknown_task_as_pending(self):
+        """Test the api answers unknown task ids with PENDING like before tracking rows were read."""
+        response = self.client.get('/api/job-status/unknown_id/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data, {'unknown_id': 'PENDING', 'unknown_id_result': 'None'})
+
+
 class TestAtlassianOAuthCallback(APITestCase):
     def setUp(self):
         """Define and authenticate test client."""
@@ -5,10 +5,13 @@ from rest_framework.authtoken.views import obtain_auth_token
 # from rest_framework_expiring_authtoken import views
 from .views import (
     UserViewSet, ProjectViewSet, TMSViewSet, EstimateTMSView,
-    CeleryTaskStatusView, CriticalPathsView, CriticalPathsViewJIRAplugin)
+    CeleryTaskStatusView, CeleryTaskStatusBatchView, CeleryTaskSpansView, CeleryQueuesView, JiraUsageView,
+    TaskProfileView, DashboardView,
+    CriticalPathsView, CriticalPathsViewJIRAplugin)
 from .views import UserCommunicationView
 from .views import ParseTMSprojects
 from .views import index
+from .views import metrics_text
 from .views import activate
 from .views import email_verification
 from .views import AtlassianOAuthCallback
@@ -33,6 +36,13 @@ urlpatterns += [
     re_path(r'^api/estimate/', EstimateTMSView.as_view(), name="estimate_tms"),
     re_path(r'^api/job-status/(?P<id>.+)/$',
         CeleryTaskStatusView.as_view(), name="job_status"),
+    re_path(r'^api/job-statuses/$', CeleryTaskStatusBatchView.as_view(), name="job_statuses"),
+    re_path(r'^api/job-spans/(?P<id>.+)/$', CeleryTaskSpansView.as_view(), name="job_spans"),
+    re_path(r'^api/metrics/$', metrics_text, name="metrics"),
+    re_path(r'^api/job-queues/$', CeleryQueuesView.as_view(), name="job_queues"),
+    re_path(r'^api/job-profile/(?P<id>.+)/$', TaskProfileView.as_view(), name="job_profile"),
+    re_path(r'^api/jira-usage/$', JiraUsageView.as_view(), name="jira_usage"),
+    re_path(r'^api/dashboard/$', DashboardView.as_view(), name="dashboard"),
     re_path(r'^api/parse_projects/', ParseTMSprojects.as_view(), name="estimate_tms"),
     re_path(r'^api/atlassian_oauth', AtlassianOAuth.as_view(), name='atlassian_oauth'),
     re_path(r'^api/user_communication/', UserCommunicationView.as_view(), name="user_communication"),
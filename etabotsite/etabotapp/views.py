@@ -6,19 +6,24 @@ from django.http import HttpResponse
 from django.views.decorators.csrf import ensure_csrf_cookie
 from django.shortcuts import redirect
 from rest_framework import permissions, status, viewsets
-from rest_framework.decorators import api_view, authentication_classes, permission_classes
+from rest_framework.decorators import action, api_view, authentication_classes, permission_classes
 from rest_framework.views import APIView
 from rest_framework.response import Response
 
 from jira_issue import create_jira_issue_from_json
-from .celery_tracking import send_celery_task_with_tracking
+from .celery_tracking import send_celery_task_with_tracking, queue_depths, task_status_dict, INTERACTIVE_QUEUE
+from .celery_tracking import wait_for_task_statuses, task_status_rows, get_task_spans, jira_usage_by_tenant
+from etabotapp import metrics
 from etabotapp.TMSlib.JIRA_API import update_available_projects_for_TMS
-from .serializers import UserSerializer, ProjectSerializer, TMSSerializer
+from .serializers import UserSerializer, ProjectSerializer, TMSSerializer, requested_fields
+from .pagination import OptionalCursorPagination
+from .dashboard import get_dashboard
 from .models import OAuth1Token, OAuth2Token, OAuth2CodeRequest
 from .models import atlassian_redirect_uri
-from .models import TMS, Project
+from .models import TMS, Project, TaskProfile
 from .models import oauth
 from .permissions import IsOwnerOrReadOnly, IsOwner
+from .report_store import EMBED_PROJECT_REPORTS, find_project_report, report_response, report_node_response
 from etabotapp.TMSlib.JIRA_API import JIRA_wrapper
 import etabotapp.TMSlib.TMS as TMSlib
 # import etabotapp.TMSlib.data_conversion as dc
@@ -35,6 +40,7 @@ from django.conf import settings
 import datetime
 import pytz
 import hashlib
+import zlib
 import etabotapp.TMSlib.Atlassian_API as Atlassian_API
 import networkx as nx
 import pandas as pd
@@ -44,6 +50,8 @@ import pandas as pd
 logger = logging.getLogger('django')
 
 AUTHLIB_OAUTH_CLIENTS = getattr(settings, "AUTHLIB_OAUTH_CLIENTS", False)
+# addresses allowed to scrape metrics without staff session, e.g. a local prometheus agent
+METRICS_ALLOWED_IPS = getattr(settings, 'CUSTOM_SETTINGS', {}).get('metrics_allowed_ips', ['127.0.0.1'])
 
 LOCAL_MODE = getattr(settings, "LOCAL_MODE", False)
 if LOCAL_MODE:
@@ -136,6 +144,21 @@ def email_verification(request):
         return HttpResponse(json.dumps(body), content_type='application/json', status=500)
 
 
+def metrics_text(request):
+    """Metrics of all web and worker processes in the Prometheus text format."""
+    if not request.user.is_staff and request.META.get('REMOTE_ADDR') not in METRICS_ALLOWED_IPS:
+        return HttpResponse(status=403)
+    metrics.flush()
+    merged = metrics.merge_snapshots(metrics.read_snapshots())
+    # queue depth is read from the tracking table rather than aggregated from processes
+    queue_gauge = {'type': metrics.GAUGE, 'values': {}}
+    for queue, depth in queue_depths().items():
+        for state in ('pending', 'waiting'):
+            queue_gauge['values'][metrics.labels_key({'queue': queue, 'state': state})] = depth[state]
+    merged['etabot_celery_queue_tasks'] = queue_gauge
+    return HttpResponse(metrics.render_text(merged), content_type='text/plain; version=0.0.4')
+
+
 class UserViewSet(viewsets.ModelViewSet):
     """
     This viewset automatically provides `list` and `detail` actions.
@@ -154,37 +177,117 @@ class UserViewSet(viewsets.ModelViewSet):
                 else IsOwnerOrReadOnly()),
 
 
-class ProjectViewSet(viewsets.ModelViewSet):
+class ValuesListMixin:
+    """List action serializing from queryset.values() with serializer_class.values_sources,
+    without building model instances. Supports ?fields= and pagination_class."""
+
+    def values_list_enabled(self) -> bool:
+        return True
+
+    def list(self, request, *args, **kwargs):
+        if not self.values_list_enabled():
+            return super().list(request, *args, **kwargs)
+        serializer_class = self.get_serializer_class()
+        fields = requested_fields(request)
+        rows = serializer_class.values_rows(self.filter_queryset(self.get_queryset()), fields)
+        page = self.paginate_queryset(rows)
+        data = serializer_class.values_data(page if page is not None else rows, fields)
+        if page is not None:
+            return self.get_paginated_response(data)
+        return Response(data)
+
+
+class ProjectViewSet(ValuesListMixin, viewsets.ModelViewSet):
     """
     This viewset automatically provides `list`, `create`, `retrieve`,
     `update` and `destroy` actions.
 
-    Additionally we also provide an extra `highlight` action.
+    Additionally we also provide an extra `report` action.
+    Reports are embedded in project_settings unless ?include_reports=0 or setting embed_project_reports is false.
+    Lists are paginated with ?page_size=<n>, ?fields=<name>,<name> selects the returned fields.
     """
     serializer_class = ProjectSerializer
     permission_classes = (permissions.IsAuthenticated,
                           IsOwner,)
+    pagination_class = OptionalCursorPagination
+
+    def embed_reports(self) -> bool:
+        include_reports = self.request.query_params.get('include_reports')
+        if include_reports is None:
+            return EMBED_PROJECT_REPORTS
+        return include_reports in ('1', 'true')
+
+    def values_list_enabled(self) -> bool:
+        return not self.embed_reports()
 
     def get_queryset(self):
-        objects2return = Project.objects.filter(owner=self.request.user)
-        logger.debug('ProjectViewSet get_queryset:{}'.format(objects2return))
-        for o in objects2return:
-            logger.debug('{}: project_tms_id="{}"'.format(
-                o, o.project_tms_id))
-        return objects2return
+        logger.debug('ProjectViewSet get_queryset for user {}'.format(self.request.user))
+        queryset = Project.objects.filter(owner=self.request.user)
+        if self.action in ('list', 'retrieve'):
+            queryset = queryset.select_related('owner', 'latest_report')
+            if not self.embed_reports():
+                queryset = queryset.defer('latest_report__payload')
+        return queryset
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        context['embed_reports'] = self.embed_reports()
+        return context
 
     def perform_create(self, serializer):
         serializer.save(owner=self.request.user)
 
+    @action(detail=True, methods=['get'])
+    def report(self, request, pk=None):
+        """Get the latest reports of the project or their ?version=<version>.
+
+        The precompressed report is served with an ETag, requests with a matching If-None-Match get 304."""
+        project = self.get_object()
+        version = request.query_params.get('version')
+        try:
+            project_report = find_project_report(project, int(version) if version is not None else None)
+        except ValueError:
+            return Response(
+                {'error': 'version must be an integer, got {}'.format(version)},
+                status=status.HTTP_400_BAD_REQUEST)
+        if project_report is None:
+            return Response(
+                {'error': 'no report for project {}'.format(project.pk)},
+                status=status.HTTP_404_NOT_FOUND)
+        return report_response(request, project_report)
+
+    @action(detail=True, methods=['get'], url_path='report/node')
+    def report_node(self, request, pk=None):
+        """Get a node of the hierarchical report by ?entity_uuid=<uuid> or ?position=<position>, the root
+        by default, with summaries of its children. ?version=<version> selects an older report."""
+        project = self.get_object()
+        version = request.query_params.get('version')
+        position = request.query_params.get('position')
+        try:
+            project_report = find_project_report(project, int(version) if version is not None else None)
+            position = int(position) if position is not None else None
+        except ValueError:
+            return Response(
+                {'error': 'version and position must be integers'},
+                status=status.HTTP_400_BAD_REQUEST)
+        if project_report is None:
+            return Response(
+                {'error': 'no report for project {}'.format(project.pk)},
+                status=status.HTTP_404_NOT_FOUND)
+        return report_node_response(
+            request, project_report, entity_uuid=request.query_params.get('entity_uuid'), position=position)
+
 
-class TMSViewSet(viewsets.ModelViewSet):
+class TMSViewSet(ValuesListMixin, viewsets.ModelViewSet):
     """
     This viewset automatically provides `list`, `create`, `retrieve`,
     `update` and `destroy` actions.
+    Lists are paginated with ?page_size=<n>, ?fields=<name>,<name> selects the returned fields.
     """
     serializer_class = TMSSerializer
     permission_classes = (permissions.IsAuthenticated,
                           IsOwner,)
+    pagination_class = OptionalCursorPagination
 
     def get_queryset(self):
         return TMS.objects.filter(owner=self.request.user)
@@ -216,7 +319,7 @@ class ParseTMSprojects(APIView):
                 parse_tms_kwargs = {}
                 celery_task = send_celery_task_with_tracking(
                     'etabotapp.django_tasks.parse_projects_for_tms_id',
-                    (tms.id, parse_tms_kwargs), owner=tms.owner)
+                    (tms.id, parse_tms_kwargs), owner=tms.owner, coalesce=True, queue=INTERACTIVE_QUEUE)
                 logger.info('celery task sent, celery id ={}'.format(celery_task))
                 celery_task_ids.append(celery_task.task_id)
                 res_messages.append('stared celery task id {} for tms id {}'.format(
@@ -444,10 +547,10 @@ def estimate_tms(user, tms, global_params, project_id=None):
         )
     logger.debug('projects: "{}"'.format(projects))
     check_celery_worker_available()
-    # Want to use send task helper here instead
+    # sorted so that equivalent requests coalesce into the same pending task
     result = send_celery_task_with_tracking(
         'etabotapp.django_tasks.estimate_ETA_for_TMS_project_set_ids',
-        (tms.id, projects, global_params), owner=tms.owner)
+        (tms.id, sorted(projects), global_params), owner=tms.owner, coalesce=True, queue=INTERACTIVE_QUEUE)
 
     # todo: stores task_id in database for this user
     return result.task_id
@@ -488,7 +591,7 @@ class CriticalPathsView(APIView):
                 status=status.HTTP_400_BAD_REQUEST)
         result = send_celery_task_with_tracking(
             'etabotapp.django_tasks.generate_critical_path',
-            (tms.id, final_nodes, params), owner=tms.owner)
+            (tms.id, final_nodes, params), owner=tms.owner, queue=INTERACTIVE_QUEUE)
 
         return Response(
             data=result.task_id,
@@ -730,13 +833,115 @@ class CeleryTaskStatusView(APIView):
             return Response(
                 response_dict,
                 status=status.HTTP_400_BAD_REQUEST)
-        logger.debug('task status: {}'.format(
-            celery.AsyncResult(task_id).status))
-        response_dict = {
-            task_id: celery.AsyncResult(task_id).status,
-            '{}_result'.format(task_id): str(celery.AsyncResult(task_id).result)
-        }
+        # only the tracking row is read: status, timing and progress published by the task
+        row = task_status_rows([task_id]).get(task_id)
+        if row is None:
+            # unknown ids are reported as pending like celery does for them
+            response_dict = {task_id: 'PENDING', '{}_result'.format(task_id): str(None)}
+        else:
+            response_dict = task_status_dict(task_id, row)
         logger.debug('CeleryTaskStatusView GET returning {}'.format(response_dict))
         return Response(
             data=response_dict,
             status=status.HTTP_200_OK)
+
+
+class CeleryTaskStatusBatchView(APIView):
+    max_task_ids = 100
+
+    def get(self, request):
+        """Get celery task statuses for comma separated task ids: ?ids=<id1>,<id2>[&wait=<seconds>].
+
+        With wait, the response is held (long-poll) until any of the tasks is finished or wait seconds passed.
+        Tasks of other users are reported as unknown.
+        """
+        task_ids = [task_id for task_id in request.query_params.get('ids', '').split(',') if task_id]
+        if len(task_ids) == 0 or len(task_ids) > self.max_task_ids:
+            return Response(
+                {'error': 'ids must have from 1 to {} comma separated task ids'.format(self.max_task_ids)},
+                status=status.HTTP_400_BAD_REQUEST)
+        try:
+            wait_s = float(request.query_params.get('wait', 0))
+        except ValueError:
+            return Response(
+                {'error': 'wait must be a number of seconds'},
+                status=status.HTTP_400_BAD_REQUEST)
+        owner = None if request.user.is_staff else request.user
+        response_dict = wait_for_task_statuses(task_ids, owner=owner, wait_s=wait_s)
+        logger.debug('CeleryTaskStatusBatchView GET returning {} statuses'.format(len(response_dict)))
+        return Response(
+            data=response_dict,
+            status=status.HTTP_200_OK)
+
+
+class CeleryTaskSpansView(APIView):
+    permission_classes = (permissions.IsAdminUser,)
+
+    def get(self, request, id):
+        """Get timing spans of a celery task run and of the tasks it started."""
+        return Response(
+            data=get_task_spans(id),
+            status=status.HTTP_200_OK)
+
+
+class TaskProfileView(APIView):
+    permission_classes = (permissions.IsAdminUser,)
+
+    def get(self, request, id):
+        """Get top functions and allocation sites of a profiled task or request run.
+
+        With ?download=1 returns pstats file of the run."""
+        profile = TaskProfile.objects.filter(pk=id).first()
+        if profile is None:
+            return Response(
+                {'error': 'no profile for id {}'.format(id)},
+                status=status.HTTP_404_NOT_FOUND)
+        if request.query_params.get('download'):
+            response = HttpResponse(zlib.decompress(profile.stats), content_type='application/octet-stream')
+            response['Content-Disposition'] = 'attachment; filename="{}.prof"'.format(profile.task_id)
+            return response
+        return Response(
+            data={
+                'task_id': profile.task_id,
+                'name': profile.name,
+                'created': profile.created,
+                'duration_s': profile.duration_s,
+                'summary': profile.summary},
+            status=status.HTTP_200_OK)
+
+
+class CeleryQueuesView(APIView):
+    permission_classes = (permissions.IsAdminUser,)
+
+    def get(self, request):
+        """Get number of pending tracked celery tasks per queue (interactive, batch)."""
+        return Response(
+            data=queue_depths(),
+            status=status.HTTP_200_OK)
+
+
+class JiraUsageView(APIView):
+
+    def get(self, request):
+        """Get JIRA API usage totals per tenant and TMS over the last ?days=<days> (30 by default).
+
+        Staff users get all tenants, other users their own TMSs."""
+        try:
+            days = float(request.query_params.get('days', 30))
+        except ValueError:
+            return Response(
+                {'error': 'days must be a number'},
+                status=status.HTTP_400_BAD_REQUEST)
+        owner = None if request.user.is_staff else request.user
+        return Response(
+            data=jira_usage_by_tenant(owner=owner, days=days),
+            status=status.HTTP_200_OK)
+
+
+class DashboardView(APIView):
+
+    def get(self, request):
+        """Get TMS connectivity, projects and headlines of their latest reports of the user for the first paint."""
+        return Response(
+            data=get_dashboard(request.user),
+            status=status.HTTP_200_OK)
@@ -33,14 +33,38 @@ crontab_args = settings.CUSTOM_SETTINGS.get(
     'eta_crontab_args',
     {'hour': 8})   # Midnight Pacific time is 8am UTC
 
-app.conf.beat_schedule = settings.CUSTOM_SETTINGS.get(
-    'eta_beat_schedule',
-    {'estimate-at-midnight': {
+# estimate_due checks which TMSs approach their local morning and dispatches them in a staggered way
+staggered_crontab_args = settings.CUSTOM_SETTINGS.get(
+    'eta_staggered_crontab_args',
+    {'minute': '*/15'})
+
+if settings.CUSTOM_SETTINGS.get('eta_staggered_schedule', True):
+    default_beat_schedule = {'estimate-staggered-by-timezone': {
+        'task': 'etabotapp.django_tasks.estimate_due',
+        'schedule': crontab(**staggered_crontab_args)
+    }}
+else:
+    default_beat_schedule = {'estimate-at-midnight': {
         'task': 'etabotapp.django_tasks.estimate_all',
         'kwargs': {'task_id': 'periodic_update_{}'.format(
             datetime.datetime.utcnow().strftime('%Y-%m-%d_%H-%M-%S'))},
         'schedule': crontab(**crontab_args)
-    }})
+    }}
+
+# tasks waiting for owner quota are normally sent when the owner's tasks finish
+default_beat_schedule['dispatch-waiting-tasks'] = {
+    'task': 'etabotapp.django_tasks.dispatch_waiting',
+    'schedule': crontab()
+}
+
+default_beat_schedule['purge-celery-tasks'] = {
+    'task': 'etabotapp.django_tasks.purge_celery_tasks',
+    'schedule': crontab(**settings.CUSTOM_SETTINGS.get('celery_task_purge_crontab_args', {'hour': 5, 'minute': 30}))
+}
+
+app.conf.beat_schedule = settings.CUSTOM_SETTINGS.get(
+    'eta_beat_schedule',
+    default_beat_schedule)
 
 
 @app.task(bind=True)
@@ -281,6 +281,9 @@ if LOCAL_MODE:
         'django.contrib.auth.middleware.AuthenticationMiddleware',
         'django.contrib.messages.middleware.MessageMiddleware',
         'django.middleware.clickjacking.XFrameOptionsMiddleware',
+        'etabotapp.middleware.MetricsMiddleware',
+        'etabotapp.middleware.QueryStatsMiddleware',
+        'etabotapp.middleware.ProfilingMiddleware',
     ]
 
     CORS_ORIGIN_ALLOW_ALL = True
@@ -293,6 +296,9 @@ else:
         'django.contrib.auth.middleware.AuthenticationMiddleware',
         'django.contrib.messages.middleware.MessageMiddleware',
         'django.middleware.clickjacking.XFrameOptionsMiddleware',
+        'etabotapp.middleware.MetricsMiddleware',
+        'etabotapp.middleware.QueryStatsMiddleware',
+        'etabotapp.middleware.ProfilingMiddleware',
     ]
 
 # CORS_ORIGIN_WHITELIST = (
@@ -465,6 +471,10 @@ CELERY_RESULT_BACKEND = 'db+postgresql://{}:{}@{}:5432/{}'.format(
     DATABASES['default']['HOST'],
     DATABASES['default']['NAME'],
 )  # Disabling the results backend
+# CeleryTask rows are the source of truth for task status, errors and small results.
+# The result backend keeps only results needed by chords (fan-out subtasks) and expires them.
+CELERY_IGNORE_RESULT = not custom_settings.get('celery_store_results', False)
+CELERY_TASK_RESULT_EXPIRES = datetime.timedelta(hours=custom_settings.get('celery_result_expires_h', 24))
 
 # Configuring the message broker for Celery Task Scheduling
 if custom_settings['MESSAGE_BROKER'].lower() == 'aws':
@@ -504,7 +514,23 @@ elif custom_settings['MESSAGE_BROKER'].lower() == 'rabbitmq':
 
     logger.debug('celery settings setup complete')
     logger.info('BROKER_URL: {}'.format(BROKER_URL))
+
+# user-triggered tasks go to the interactive queue served by dedicated workers,
+# periodic estimations and their fan-out go to the batch queue
+CELERY_INTERACTIVE_QUEUE = get_key_value(
+    custom_settings, 'CELERY_INTERACTIVE_QUEUE', default='{}_interactive'.format(CELERY_DEFAULT_QUEUE))
+CELERY_BATCH_QUEUE = get_key_value(
+    custom_settings, 'CELERY_BATCH_QUEUE', default='{}_batch'.format(CELERY_DEFAULT_QUEUE))
+CELERY_ROUTES = {
+    'etabotapp.django_tasks.estimate_all': {'queue': CELERY_BATCH_QUEUE},
+    'etabotapp.django_tasks.estimate_due': {'queue': CELERY_BATCH_QUEUE},
+    'etabotapp.django_tasks.send_daily_project_report': {'queue': CELERY_BATCH_QUEUE},
+    'etabotapp.django_tasks.parse_projects_for_tms_id': {'queue': CELERY_INTERACTIVE_QUEUE},
+    'etabotapp.django_tasks.generate_critical_path': {'queue': CELERY_INTERACTIVE_QUEUE},
+}
 logger.info('CELERY_DEFAULT_QUEUE: {}'.format(CELERY_DEFAULT_QUEUE))
+logger.info('CELERY_INTERACTIVE_QUEUE: {}, CELERY_BATCH_QUEUE: {}'.format(
+    CELERY_INTERACTIVE_QUEUE, CELERY_BATCH_QUEUE))
 logger.debug('setting.py is done')
 # EXPIRING_TOKEN_LIFESPAN = datetime.timedelta(days=1)
 